@@ -0,0 +1,190 @@
+"""Yearly archive databases for old pickups and returns.
+
+Closed loans whose return is older than ``ARCHIVE_AFTER_DAYS`` are moved,
+together with their key_pickups and key_returns rows, out of the main
+database into one SQLite file per pickup year (UTC), next to it:
+
+    key_management.db
+    key_management-archive/2023.db
+    key_management-archive/2024.db
+
+Open loans are never archived, so everything the kiosk views, the dashboard
+and the triggers work on stays in the small main database. Queries that
+need older history attach the archive files of the years their date range
+covers, see Database.loan_sources().
+"""
+import calendar
+import os
+import re
+import sqlite3
+import time
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get("KMS_ARCHIVE_AFTER_DAYS", "365"))
+
+_FILE_RE = re.compile(r"^(\d{4})\.db$")
+
+LOAN_COLUMNS = "pickup_id, return_id, user_rfid, house_rfid, pickup_ts, return_ts"
+
+# Archives written before tokens were stored as UID bytes (see uid.py) are
+# converted when they are first attached, their user_version is then set
+ARCHIVE_VERSION = 1
+
+# Same columns as in the main database. The ids are kept, so they stay unique across the main database and all
+# archives (the main tables use AUTOINCREMENT and never reuse one).
+ARCHIVE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS {schema}.key_pickups (
+        id INTEGER PRIMARY KEY,
+        user_rfid BLOB NOT NULL,
+        house_rfid BLOB NOT NULL,
+        ts INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS {schema}.key_returns (
+        id INTEGER PRIMARY KEY,
+        user_rfid BLOB NOT NULL,
+        house_rfid BLOB NOT NULL,
+        ts INTEGER NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS {schema}.loans (
+        pickup_id INTEGER PRIMARY KEY,
+        return_id INTEGER,
+        user_rfid BLOB NOT NULL,
+        house_rfid BLOB NOT NULL,
+        pickup_ts INTEGER NOT NULL,
+        return_ts INTEGER
+    )""",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_loans_pickup_ts ON loans(pickup_ts)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_loans_house_ts ON loans(house_rfid, pickup_ts)",
+    "CREATE INDEX IF NOT EXISTS {schema}.idx_loans_user_ts ON loans(user_rfid, pickup_ts)",
+]
+
+
+def schema_name(year):
+    return f"archive_{year}"
+
+
+def year_bounds(year):
+    """Epoch seconds of the first second of ``year`` and of the next year (UTC)."""
+    return calendar.timegm((year, 1, 1, 0, 0, 0)), calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+
+
+class Archive:
+    """The yearly archive files of one main database."""
+
+    def __init__(self, db_path):
+        self.directory = os.path.splitext(db_path)[0] + "-archive"
+
+    def path(self, year):
+        return os.path.join(self.directory, f"{year}.db")
+
+    def years(self):
+        """Years that have an archive file, oldest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(m.group(1)) for m in map(_FILE_RE.match, names) if m)
+
+    def years_for(self, start=None, end=None):
+        """Archived years holding pickups between the 'YYYY-MM-DD' dates ``start`` and ``end``."""
+        first = int(start[:4]) if start else 0
+        last = int(end[:4]) if end else 9999
+        return [year for year in self.years() if first <= year <= last]
+
+    def attach(self, conn, years, create=False):
+        """Attach the archives of ``years`` to ``conn`` and return their schema names.
+
+        Archives that are attached already are kept, others are detached
+        first when SQLite's limit of attached databases would be exceeded.
+        """
+        attached = {name for _, name, _ in conn.execute("PRAGMA database_list")}
+        wanted = [schema_name(year) for year in years]
+        missing = [(year, name) for year, name in zip(years, wanted) if name not in attached]
+        if not missing:
+            return wanted
+        limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+        in_use = attached - {"main", "temp"}
+        for name in sorted(in_use - set(wanted)):
+            if len(in_use) + len(missing) <= limit:
+                break
+            conn.execute(f"DETACH DATABASE {name}")
+            in_use.discard(name)
+        for year, name in missing:
+            if create:
+                os.makedirs(self.directory, exist_ok=True)
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (self.path(year),))
+            if create:
+                for statement in ARCHIVE_SCHEMA:
+                    conn.execute(statement.format(schema=name))
+            self._upgrade(conn, name)
+        return wanted
+
+    def _upgrade(self, conn, name):
+        if conn.execute(f"PRAGMA {name}.user_version").fetchone()[0] >= ARCHIVE_VERSION:
+            return
+        tables = {table for (table,) in conn.execute(f"SELECT name FROM {name}.sqlite_master WHERE type = 'table'")}
+        with conn:
+            # uid() is registered by Database on every connection
+            for table in ("key_pickups", "key_returns", "loans"):
+                if table in tables:
+                    conn.execute(f"""
+                        UPDATE {name}.{table} SET user_rfid = uid(user_rfid), house_rfid = uid(house_rfid)
+                        WHERE typeof(user_rfid) = 'text'
+                    """)
+            conn.execute(f"PRAGMA {name}.user_version = {ARCHIVE_VERSION}")
+
+    def move_closed_loans(self, conn, older_than_days=ARCHIVE_AFTER_DAYS):
+        """Move closed loans returned more than ``older_than_days`` ago into the archives.
+
+        Returns {year: loans moved}. Each year is moved in one transaction
+        on the main database and its archive; rows are copied with INSERT OR
+        IGNORE before they are deleted, so a run interrupted between the two
+        databases is completed by the next one.
+        """
+        cutoff = int(time.time()) - older_than_days * 86400
+        years = [year for (year,) in conn.execute("""
+            SELECT DISTINCT CAST(strftime('%Y', pickup_ts, 'unixepoch') AS INTEGER)
+            FROM main.loans WHERE return_ts < ?
+        """, (cutoff,))]
+        moved = {}
+        for year in sorted(years):
+            schema = self.attach(conn, [year], create=True)[0]
+            first, following = year_bounds(year)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DROP TABLE IF EXISTS temp.archived")
+                conn.execute("""
+                    CREATE TEMP TABLE archived AS
+                    SELECT pickup_id, return_id FROM main.loans
+                    WHERE pickup_ts >= ? AND pickup_ts < ? AND return_ts < ?
+                """, (first, following, cutoff))
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {schema}.loans ({LOAN_COLUMNS})
+                    SELECT {LOAN_COLUMNS} FROM main.loans WHERE pickup_id IN (SELECT pickup_id FROM temp.archived)
+                """)
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {schema}.key_pickups
+                    SELECT id, user_rfid, house_rfid, ts FROM main.key_pickups
+                    WHERE id IN (SELECT pickup_id FROM temp.archived)
+                """)
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO {schema}.key_returns
+                    SELECT id, user_rfid, house_rfid, ts FROM main.key_returns
+                    WHERE id IN (SELECT return_id FROM temp.archived)
+                """)
+                count = conn.execute(
+                    "DELETE FROM main.loans WHERE pickup_id IN (SELECT pickup_id FROM temp.archived)").rowcount
+                conn.execute("DELETE FROM main.key_pickups WHERE id IN (SELECT pickup_id FROM temp.archived)")
+                # One return closes every open loan of the key and user, those
+                # loans may have been picked up in different years
+                conn.execute("""
+                    DELETE FROM main.key_returns
+                    WHERE id IN (SELECT return_id FROM temp.archived)
+                    AND id NOT IN (SELECT return_id FROM main.loans WHERE return_id IS NOT NULL)
+                """)
+                conn.execute("DROP TABLE temp.archived")
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            moved[year] = count
+        return moved
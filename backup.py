@@ -0,0 +1,228 @@
+"""Online backups of the main database with SQLite's backup API.
+
+Backups are complete, verified copies of the main database, in a folder
+next to it:
+
+    key_management.db
+    key_management-backups/key_management-20261018-030000.db
+
+create() copies the database with Connection.backup in steps of
+``step_pages`` pages and sleeps ``pause`` seconds after every step, so the
+copy never takes the disk or the GIL from the desks for long. It holds a
+read transaction on the database for the whole copy: in WAL mode this
+does not block writers, and the copy is of one consistent snapshot (a
+backup without it starts over whenever another connection commits, and
+never finishes while the desks are busy). The copy is checked with PRAGMA
+integrity_check before it gets its final name; only the newest ``keep``
+backups are kept.
+
+The yearly archives (archive.py) are not included, they only change when
+loans are archived and can be copied as files then.
+"""
+import datetime
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from instrumentation import observe
+from migrations import migrate
+from uid import sql_uid
+
+# Backups kept, and hours between scheduled backups (0: none)
+BACKUP_KEEP = int(os.environ.get("KMS_BACKUP_KEEP", "7"))
+BACKUP_INTERVAL_HOURS = float(os.environ.get("KMS_BACKUP_INTERVAL_HOURS", "24"))
+# Pages copied per step (4 KiB each) and seconds slept between steps
+STEP_PAGES = 256
+STEP_PAUSE = 0.01
+# A scheduled backup never starts earlier than this after startup
+STARTUP_DELAY = 300.0
+
+_FILE_RE = re.compile(r"-(\d{8}-\d{6})\.db$")
+
+log = logging.getLogger("kms.backup")
+
+
+class BackupError(Exception):
+    pass
+
+
+class Backups:
+    """The rotated backups of one main database."""
+
+    def __init__(self, db_path, keep=BACKUP_KEEP, step_pages=STEP_PAGES, pause=STEP_PAUSE, timeout=5.0):
+        self.db_path = db_path
+        base = os.path.splitext(db_path)[0]
+        self.directory = base + "-backups"
+        self.prefix = os.path.basename(base)
+        self.keep = keep
+        self.step_pages = step_pages
+        self.pause = pause
+        self.timeout = timeout
+
+    def list(self):
+        """Paths of the backups, oldest first."""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(os.path.join(self.directory, name) for name in names
+                      if name.startswith(self.prefix + "-") and _FILE_RE.search(name))
+
+    def latest(self):
+        backups = self.list()
+        return backups[-1] if backups else None
+
+    def taken_at(self, path):
+        """When the backup at ``path`` was started, as a naive local datetime."""
+        return datetime.datetime.strptime(_FILE_RE.search(path).group(1), "%Y%m%d-%H%M%S")
+
+    def create(self, progress=None, cancel=None):
+        """Back up the database and rotate; returns the new backup's path.
+
+        ``progress(remaining, total)`` is called with the pages left after
+        every step. Setting the threading.Event ``cancel`` abandons the
+        backup after the current step with a BackupError.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self.prefix}-{time.strftime('%Y%m%d-%H%M%S')}.db")
+        tmp_path = path + ".tmp"
+        start = time.perf_counter()
+
+        def step(status, remaining, total):
+            if progress is not None:
+                progress(remaining, total)
+            if cancel is not None and cancel.is_set():
+                raise BackupError("Sicherung abgebrochen")
+            if remaining:
+                time.sleep(self.pause)
+
+        source = sqlite3.connect(self.db_path, timeout=self.timeout)
+        target = sqlite3.connect(tmp_path)
+        # Every step is a transaction on the copy; it is only synced once,
+        # when complete, and deleted if anything goes wrong before that
+        target.execute("PRAGMA synchronous = OFF")
+        target.execute("PRAGMA journal_mode = OFF")
+        try:
+            # The snapshot every step copies from, see the module docstring
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            source.backup(target, pages=self.step_pages, progress=step)
+            source.rollback()
+            # The copy has the WAL flag of the database, it is a single file
+            target.execute("PRAGMA journal_mode = DELETE")
+            check(target)
+        except BaseException:
+            target.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            source.close()
+        target.close()
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        observe("backup.create", time.perf_counter() - start)
+        self.rotate()
+        return path
+
+    def rotate(self):
+        """Delete all but the newest ``keep`` backups."""
+        for path in self.list()[:-self.keep] if self.keep > 0 else []:
+            os.remove(path)
+
+    def verify(self, path):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            check(conn)
+        finally:
+            conn.close()
+
+    def restore(self, path):
+        """Replace the database's contents with the backup at ``path``.
+
+        The backup is verified first, and the current contents are kept as
+        ``<name>-before-restore.db`` in the backup folder. The GUI, the
+        station hub and the HTTP API should not be running.
+        """
+        self.verify(path)
+        os.makedirs(self.directory, exist_ok=True)
+        target = sqlite3.connect(self.db_path, timeout=self.timeout)
+        try:
+            keep = sqlite3.connect(os.path.join(self.directory, f"{self.prefix}-before-restore.db"))
+            target.backup(keep)
+            keep.execute("PRAGMA journal_mode = DELETE")
+            keep.close()
+            source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+            # An older backup gets the current schema
+            target.create_function("uid", 1, sql_uid, deterministic=True)
+            migrate(target)
+        finally:
+            target.close()
+
+
+def check(conn):
+    start = time.perf_counter()
+    problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+    observe("backup.verify", time.perf_counter() - start)
+    if problems != ["ok"]:
+        raise BackupError("; ".join(problems[:5]))
+
+
+class BackupScheduler:
+    """Creates a backup every ``interval`` seconds on its own thread.
+
+    The first one is due ``interval`` after the newest backup there is, but
+    not before STARTUP_DELAY. ``last`` is the path of the last backup made,
+    ``last_error`` the error of the last failed one (None after a success).
+    """
+
+    def __init__(self, backups, interval=BACKUP_INTERVAL_HOURS * 3600):
+        self.backups = backups
+        self.interval = interval
+        self.last = backups.latest()
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="backup", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # A backup in progress is abandoned after its current step
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _delay(self):
+        if self.last is None:
+            return STARTUP_DELAY
+        due = self.backups.taken_at(self.last) + datetime.timedelta(seconds=self.interval)
+        return max((due - datetime.datetime.now()).total_seconds(), STARTUP_DELAY)
+
+    def _run(self):
+        delay = self._delay()
+        while not self._stop.wait(delay):
+            try:
+                self.last = self.backups.create(cancel=self._stop)
+                self.last_error = None
+                log.info("backup written to %s", self.last)
+                delay = self.interval
+            except (sqlite3.Error, OSError, BackupError) as e:
+                if self._stop.is_set():
+                    return
+                self.last_error = e
+                log.error("backup failed: %s", e)
+                # Tried again in an hour, or at the next interval if shorter
+                delay = min(self.interval, 3600.0)
@@ -0,0 +1,113 @@
+"""Online backup duration and desk stalls during a backup.
+
+Usage: python benchmarks/bench_backup.py [--events N] [--rate OPS_PER_S]
+
+Copies the generated history (benchmarks/history.py, 1M events by default)
+to a temporary file and lets a desk thread record a pickup or a return
+every 1/``--rate`` seconds on it, as the scan journal's writer does. Then
+backs the database up with backup.Backups three ways while the desk keeps
+going: in one step, and in steps of STEP_PAGES pages with STEP_PAUSE sleeps
+(the default). For comparison, the desk also runs during the integrity
+check of a backup alone and with nothing else running. Reports the
+duration (a backup's includes its integrity check) and the desk
+operations' p50 / p99 and longest stall.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from backup import STEP_PAGES, STEP_PAUSE, Backups
+from database import Database
+from history import house_token, open_history, user_token
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(HERE, ".data")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Desk:
+    """Records one scan every ``interval`` seconds and times it."""
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.latencies = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.latencies
+
+    def _run(self):
+        db = Database(self.path)
+        scans = 0
+        while not self._stop.wait(self.interval):
+            kind = "pickup" if scans % 2 == 0 else "return"
+            start = time.perf_counter()
+            db.record_scans([(kind, user_token(0), house_token(scans // 2 % 100), int(time.time()))])
+            self.latencies.append(time.perf_counter() - start)
+            scans += 1
+        db.close()
+
+
+def run(path, action, interval):
+    desk = Desk(path, interval).start()
+    time.sleep(0.5)
+    start = time.perf_counter()
+    action()
+    elapsed = time.perf_counter() - start
+    time.sleep(0.5)
+    return elapsed, desk.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--houses", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=50.0, help="desk operations per second")
+    args = parser.parse_args()
+
+    params = {"users": args.users, "houses": args.houses, "events": args.events, "seed": args.seed}
+    source = os.path.join(DATA_DIR, "history-u{users}-h{houses}-e{events}-s{seed}.db".format(**params))
+    db = open_history(source, **params)
+    db.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "key_management.db")
+        shutil.copy(source, path)
+        print(f"database {os.path.getsize(path) / 1e6:.0f} MB, desk every {1000 / args.rate:.0f} ms")
+        print(f"{'':<22} {'duration':>9} {'desk p50':>9} {'p99':>9} {'max':>9} {'ops':>6}")
+        backups = Backups(path)
+        cases = [
+            ("backup in one step", Backups(path, step_pages=-1, pause=0).create),
+            (f"{STEP_PAGES} pages, {STEP_PAUSE * 1000:g} ms pauses", backups.create),
+            ("integrity check only", lambda: backups.verify(backups.latest())),
+            ("nothing", lambda: time.sleep(5)),
+        ]
+        for label, action in cases:
+            duration, latencies = run(path, action, 1 / args.rate)
+            print(f"{label:<22} {duration:8.2f}s {percentile(latencies, 50) * 1000:7.2f}ms "
+                  f"{percentile(latencies, 99) * 1000:7.2f}ms {max(latencies) * 1000:7.1f}ms {len(latencies):6d}")
+
+
+if __name__ == "__main__":
+    main()
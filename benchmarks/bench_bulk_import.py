@@ -0,0 +1,81 @@
+"""Rows per second of the bulk house import against adding houses one by one.
+
+Usage: python benchmarks/bench_bulk_import.py [--rows N] [--duplicates PERCENT]
+
+Writes a CSV with N houses (a share of them duplicates that must be
+rejected), then imports it into a fresh database with bulk_import and, for
+comparison, with one KeyManagement.add_house call per row as the GUI form
+does.
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bulk_import import read_records
+from kms_core import KeyManagement, ValidationError
+
+
+def write_file(path, rows, duplicates, existing):
+    rng = random.Random(42)
+    records = [(f"Haus {i}", f"0410{i:010X}") for i in range(rows)]
+    for _ in range(rows * duplicates // 100):
+        # Half repeat a name or token of the file, half one already in the database
+        i = rng.randrange(rows)
+        if rng.random() < 0.5:
+            records[i] = (records[rng.randrange(rows)][0], records[i][1])
+        else:
+            records[i] = (records[i][0], rng.choice(existing))
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "rfid_token"])
+        writer.writerows(records)
+
+
+def fresh(path, existing):
+    kms = KeyManagement.open(path)
+    kms.db.add_houses([(f"Bestand {i}", token) for i, token in enumerate(existing)])
+    return kms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--duplicates", type=int, default=2, help="percent of bad rows")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        existing = [f"0490{i:010X}" for i in range(500)]
+        source = os.path.join(tmp, "houses.csv")
+        write_file(source, args.rows, args.duplicates, existing)
+
+        kms = fresh(os.path.join(tmp, "bulk.db"), existing)
+        start = time.perf_counter()
+        imported, rejects, _ = kms.import_file(source, "houses")
+        elapsed = time.perf_counter() - start
+        kms.close()
+        print(f"bulk import:  {imported} imported, {len(rejects)} rejected in {elapsed * 1000:.1f} ms "
+              f"({args.rows / elapsed:,.0f} rows/s)")
+
+        kms = fresh(os.path.join(tmp, "rows.db"), existing)
+        start = time.perf_counter()
+        imported = rejected = 0
+        for _, name, token in read_records(source):
+            try:
+                kms.add_house(name, token)
+                imported += 1
+            except ValidationError:
+                rejected += 1
+        elapsed = time.perf_counter() - start
+        kms.close()
+        print(f"row by row:   {imported} imported, {rejected} rejected in {elapsed * 1000:.1f} ms "
+              f"({args.rows / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Per-operation latency: connect-per-call versus the shared Database layer.
+
+Usage: python benchmarks/bench_db_connection.py [--ops N] [--users N]
+
+Runs the two hottest desk operations (token lookup and recording a return)
+against a scratch database, once with a fresh sqlite3.connect() per call as
+the GUI used to do and once through database.Database.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import Database
+from history import house_token, user_token
+
+
+def populate(db, users):
+    db.create_schema()
+    with db.conn as conn:
+        conn.executemany("INSERT INTO users (name, rfid_token) VALUES (?, ?)",
+                         [(f"User {i}", user_token(i)) for i in range(users)])
+        conn.executemany("INSERT INTO houses (house_name, rfid_token) VALUES (?, ?)",
+                         [(f"Haus {i}", house_token(i)) for i in range(users)])
+        conn.executemany("INSERT INTO keys (rfid_token, status) VALUES (?, 'available')",
+                         [(house_token(i),) for i in range(users)])
+
+
+def lookup_per_call(path, token):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("SELECT name FROM users WHERE rfid_token = ?", (token,))
+    result = cursor.fetchone()
+    conn.close()
+    return result
+
+
+def return_per_call(path, user, house):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO key_returns (user_rfid, house_rfid, ts)
+        VALUES (?, ?, CAST(strftime('%s', 'now') AS INTEGER))
+    """, (user, house))
+    cursor.execute("UPDATE keys SET status = 'available' WHERE rfid_token = ?", (house,))
+    conn.commit()
+    conn.close()
+
+
+def timed(label, ops, fn):
+    start = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed / ops * 1e6:9.1f} us/op")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        db = Database(path)
+        populate(db, args.users)
+        n = args.users
+
+        print(f"lookup ({args.ops} ops)")
+        old = timed("connect per call", args.ops, lambda i: lookup_per_call(path, user_token(i % n)))
+        new = timed("Database.user_name", args.ops, lambda i: db.user_name(user_token(i % n)))
+        print(f"  speedup {old / new:.1f}x")
+
+        print(f"record return ({args.ops} ops)")
+        old = timed("connect per call", args.ops,
+                    lambda i: return_per_call(path, user_token(i % n), house_token(i % n)))
+        new = timed("Database.record_return", args.ops,
+                    lambda i: db.record_return(user_token(i % n), house_token(i % n)))
+        print(f"  speedup {old / new:.1f}x")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
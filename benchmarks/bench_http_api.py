@@ -0,0 +1,121 @@
+"""Load test of the HTTP API on localhost.
+
+Usage: python benchmarks/bench_http_api.py [--clients N] [--seconds S] [--workers N]
+           [--events N] [--writes PERCENT] [--no-etag]
+
+Generates a small history with benchmarks/history.py, starts http_api.py
+on a free port in its own process (so the clients do not compete with it
+for the GIL) and lets N client threads send a kiosk-like mix for S seconds:
+open loans, the first history page, the dashboard figures, the user list,
+and (--writes percent) pickups and returns. Clients send If-None-Match with
+the ETag of their previous response unless --no-etag is given. Prints
+requests per second, the status codes and p50/p99 latency per endpoint.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from history import generate, house_token, user_token
+from uid import uid_text
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+READS = [("/loans", 5), ("/history?limit=100", 2), ("/stats", 2), ("/users", 1)]
+
+
+def client(port, seconds, writes, use_etag, users, houses, seed, results):
+    rng = random.Random(seed)
+    paths = [path for path, weight in READS for _ in range(weight)]
+    etags = {}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        headers = {}
+        if rng.random() * 100 < writes:
+            user = uid_text(user_token(rng.randrange(users)))
+            house = uid_text(house_token(rng.randrange(houses)))
+            if rng.random() < 0.5:
+                method, path, body = "POST", "/pickups", {"user": user, "houses": [house]}
+            else:
+                method, path, body = "POST", "/returns", {"user": user, "house": house}
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        else:
+            method, path, body = "GET", rng.choice(paths), None
+            if use_etag and path in etags:
+                headers["If-None-Match"] = etags[path]
+        start = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            conn.close()
+            status = response.status
+            if response.getheader("ETag"):
+                etags[path] = response.getheader("ETag")
+        except OSError:
+            status = "error"
+        results.append((f"{method} {path.split('?')[0]}", status, time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--houses", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=50_000)
+    parser.add_argument("--writes", type=float, default=5.0, help="percent of requests that write")
+    parser.add_argument("--no-etag", action="store_true", help="never send If-None-Match")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "api.db")
+        generate(path, args.users, args.houses, args.events, progress=False).close()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "..", "http_api.py"), "--db", path, "--port", "0",
+             "--workers", str(args.workers)],
+            stdout=subprocess.PIPE, text=True)
+        # "Schnittstelle auf http://127.0.0.1:PORT/"
+        port = int(server.stdout.readline().strip().rstrip("/").rsplit(":", 1)[1])
+
+        results = []
+        threads = [threading.Thread(target=client, args=(
+            port, args.seconds, args.writes, not args.no_etag, args.users, args.houses, i, results))
+            for i in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        server.send_signal(signal.SIGINT)
+        server.wait()
+
+    statuses = {}
+    for _, status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    print(f"{args.clients} clients, {args.workers} workers: {len(results):,} requests in {elapsed:.1f}s "
+          f"({len(results) / elapsed:,.0f} req/s)")
+    print("  status: " + ", ".join(f"{status}: {count:,}" for status, count in sorted(statuses.items(), key=str)))
+    for endpoint in sorted({endpoint for endpoint, _, _ in results}):
+        latencies = sorted(latency for name, _, latency in results if name == endpoint)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"  {endpoint:<14} {len(latencies):7,}  p50 {statistics.median(latencies) * 1000:6.2f} ms"
+              f"  p99 {p99 * 1000:6.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
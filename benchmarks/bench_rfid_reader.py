@@ -0,0 +1,76 @@
+"""Throughput of the background RFID reader without hardware.
+
+Usage: python benchmarks/bench_rfid_reader.py [--scans N] [--pty]
+
+The in-memory backend measures line parsing, debouncing and queueing. With
+--pty the same scans are written to a pseudo terminal and read back through
+the real SerialBackend, which also covers pyserial's readline.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from rfid_reader import FakeBackend, RfidReader, SerialBackend
+
+
+def uid_for(i):
+    return [0x04, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF]
+
+
+def drain(reader, count, timeout=30.0):
+    received = 0
+    deadline = time.monotonic() + timeout
+    while received < count and time.monotonic() < deadline:
+        if reader.get_token(timeout=0.5) is not None:
+            received += 1
+    return received
+
+
+def bench_fake(scans):
+    backend = FakeBackend(timeout=0.05)
+    reader = RfidReader(backend, debounce=0.0)
+    reader.start()
+    start = time.perf_counter()
+    for i in range(scans):
+        backend.feed_uid(uid_for(i))
+    received = drain(reader, scans)
+    elapsed = time.perf_counter() - start
+    reader.stop()
+    return received, elapsed
+
+
+def bench_pty(scans):
+    master, slave = os.openpty()
+    reader = RfidReader(SerialBackend(os.ttyname(slave), 9600, timeout=0.05), debounce=0.0)
+    reader.start()
+    while not reader.connected:
+        time.sleep(0.01)
+    start = time.perf_counter()
+    for i in range(scans):
+        line = "Card UID: " + " ".join(f"{b:02X}" for b in uid_for(i)) + "\r\n"
+        os.write(master, line.encode("ascii"))
+    received = drain(reader, scans)
+    elapsed = time.perf_counter() - start
+    reader.stop()
+    os.close(master)
+    os.close(slave)
+    return received, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scans", type=int, default=10000)
+    parser.add_argument("--pty", action="store_true", help="read through a pseudo terminal")
+    args = parser.parse_args()
+
+    name, bench = ("pty", bench_pty) if args.pty else ("memory", bench_fake)
+    received, elapsed = bench(args.scans)
+    print(f"{name}: {received}/{args.scans} tokens in {elapsed:.3f}s "
+          f"({received / elapsed:,.0f} scans/s, {elapsed / max(received, 1) * 1e6:.1f} us/scan)")
+
+
+if __name__ == "__main__":
+    main()
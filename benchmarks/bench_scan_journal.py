@@ -0,0 +1,131 @@
+"""Desk latency and throughput of scans written per scan, through the group
+committing writer, and through the scan journal.
+
+Usage: python benchmarks/bench_scan_journal.py [--desks N] [--seconds S]
+                                               [--lock-ms MS] [--lock-every S]
+
+Generates a history with benchmarks/history.py, then lets ``--desks``
+threads scan keys as fast as they can (pickups and returns of their own
+houses) while another connection holds the write lock for ``--lock-ms``
+every ``--lock-every`` seconds, as a long import, archive run or another
+process would. Each desk waits for its scan: its own record_scans
+transaction, a DatabaseWriter commit, or the scan journal's fsync. Reports
+scans per second, the desks' latency and failures, and for the journal how
+long the database took to catch up afterwards.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import Database
+from db_writer import DatabaseWriter
+from history import generate, house_token, user_token
+from scan_journal import ScanJournal
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def hold_lock(path, lock_ms, every, done):
+    conn = Database(path)
+    while not done.wait(every):
+        conn.conn.execute("BEGIN IMMEDIATE")
+        time.sleep(lock_ms / 1000)
+        conn.conn.commit()
+    conn.close()
+
+
+def desk(record, index, houses, deadline, latencies, errors):
+    user = user_token(index)
+    scans = 0
+    while time.perf_counter() < deadline:
+        house = house_token(index * houses + scans // 2 % houses)
+        kind = "pickup" if scans % 2 == 0 else "return"
+        start = time.perf_counter()
+        try:
+            record([(kind, user, house, int(time.time()))])
+        except Exception:
+            errors.append(kind)
+        else:
+            latencies.append(time.perf_counter() - start)
+        scans += 1
+
+
+def run(path, mode, args):
+    db = Database(path, timeout=args.timeout)
+    writer = None
+    if mode == "per scan":
+        record = db.record_scans
+    else:
+        journal = ScanJournal(path + ".journal") if mode == "journal" else None
+        writer = DatabaseWriter(Database(path, timeout=args.timeout), journal)
+        writer.start()
+        record = writer.write
+    before = db.conn.execute("SELECT (SELECT COUNT(*) FROM key_pickups) + (SELECT COUNT(*) FROM key_returns)").fetchone()[0]
+
+    done = threading.Event()
+    locker = threading.Thread(target=hold_lock, args=(path, args.lock_ms, args.lock_every, done))
+    latencies, errors = [], []
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    desks = [threading.Thread(target=desk, args=(record, i, args.houses, deadline, latencies, errors))
+             for i in range(args.desks)]
+    locker.start()
+    for thread in desks:
+        thread.start()
+    for thread in desks:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    locker.join()
+
+    catch_up = 0.0
+    if writer is not None:
+        while writer.pending():
+            time.sleep(0.01)
+        catch_up = time.perf_counter() - start - elapsed
+        writer.stop()
+    after = db.conn.execute("SELECT (SELECT COUNT(*) FROM key_pickups) + (SELECT COUNT(*) FROM key_returns)").fetchone()[0]
+    db.close()
+    commits = writer.commits if writer is not None else len(latencies)
+    return elapsed, latencies, errors, commits, after - before, catch_up
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--desks", type=int, default=4)
+    parser.add_argument("--houses", type=int, default=50, help="houses per desk")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--lock-ms", type=float, default=1500, help="how long the write lock is held")
+    parser.add_argument("--lock-every", type=float, default=4.0, help="seconds between lock holds")
+    parser.add_argument("--timeout", type=float, default=5.0, help="SQLite busy timeout of the desks")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "history.db")
+        generate(source, events=args.events).close()
+        print(f"{args.desks} desks for {args.seconds:g}s, write lock held {args.lock_ms:g} ms "
+              f"every {args.lock_every:g}s")
+        print(f"{'':<10} {'scans/s':>8} {'p50':>9} {'p99':>9} {'max':>9} {'failed':>7} {'commits':>8} "
+              f"{'written':>8} {'catch-up':>9}")
+        for mode in ("per scan", "writer", "journal"):
+            path = os.path.join(tmp, f"{mode.replace(' ', '_')}.db")
+            shutil.copy(source, path)
+            elapsed, latencies, errors, commits, written, catch_up = run(path, mode, args)
+            p50, p99 = (percentile(latencies, 50), percentile(latencies, 99)) if latencies else (0, 0)
+            worst = max(latencies, default=0)
+            print(f"{mode:<10} {len(latencies) / elapsed:8.0f} {p50 * 1000:7.2f}ms {p99 * 1000:7.2f}ms "
+                  f"{worst * 1000:7.1f}ms {len(errors):7d} {commits:8d} {written:8d} {catch_up * 1000:7.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
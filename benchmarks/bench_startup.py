@@ -0,0 +1,63 @@
+"""Cold import cost of the CLI and GUI entry points.
+
+Usage: python benchmarks/bench_startup.py [--repeat N]
+
+Runs ``python -X importtime -c "import <module>"`` in fresh interpreters and
+reports the median cumulative import time of each entry point, plus the
+heaviest modules it pulls in. Importing key_management_system opens no
+window, so this works without a display.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ENTRY_POINTS = ["kms_core", "kms_cli", "key_management_system"]
+
+
+def importtime(module):
+    """Cumulative microseconds of one cold import, and of its direct imports."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    children = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented by two spaces per level and are
+        # printed before the module that imported them
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        if depth == 1:
+            children[name] = int(cumulative)
+        elif depth == 0:
+            if name == module:
+                return int(cumulative), children
+            children = {}
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports to list")
+    args = parser.parse_args()
+
+    for module in ENTRY_POINTS:
+        runs = [importtime(module) for _ in range(args.repeat)]
+        total = statistics.median(run[0] for run in runs)
+        print(f"{module:<24} {total / 1000:8.1f} ms")
+        children = runs[-1][1]
+        for name in sorted(children, key=children.get, reverse=True)[:args.top]:
+            print(f"    {name:<30} {children[name] / 1000:8.1f} ms")
+        loaded = subprocess.run(
+            [sys.executable, "-c", f"import sys, {module}; print(' '.join(m for m in "
+                                   f"('serial', 'PIL', 'tkinter') if m in sys.modules))"],
+            cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        print(f"    loaded: {loaded or '-'}")
+
+if __name__ == "__main__":
+    main()
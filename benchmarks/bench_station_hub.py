@@ -0,0 +1,131 @@
+"""Load test of the multi-station hub with simulated readers on pty pairs.
+
+Usage: python benchmarks/bench_station_hub.py [--stations N] [--rate SCANS_PER_MIN]
+                                              [--seconds S] [--db PATH] [--no-journal]
+
+Every station gets a pseudo terminal; a simulated reader writes a user card
+and then house keys to it at the requested total rate. Half of the stations
+pick keys up, the other half return them. Reports throughput and the p50 /
+p99 latency measured by the hub, from reading a scan until it is in the
+scan journal, or committed with --no-journal.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import Database
+from station_hub import Station, StationHub
+
+
+def uid_line(i):
+    uid = [0x04, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF]
+    return ("Card UID: " + " ".join(f"{b:02X}" for b in uid) + "\r\n").encode("ascii")
+
+
+def token(i):
+    # The UID of uid_line(i)
+    return bytes([0x04, (i >> 16) & 0xFF, (i >> 8) & 0xFF, i & 0xFF])
+
+
+def populate(db, stations, houses):
+    db.create_schema()
+    with db.conn as conn:
+        conn.executemany("INSERT OR IGNORE INTO users (name, rfid_token) VALUES (?, ?)",
+                         [(f"Station {s}", token(s)) for s in range(stations)])
+        conn.executemany("INSERT OR IGNORE INTO houses (house_name, rfid_token) VALUES (?, ?)",
+                         [(f"Haus {h}", token(100_000 + h)) for h in range(houses)])
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def simulate(master, station_index, houses, interval, deadline):
+    # User card first, then keys; a new session every `houses` keys
+    scans = 0
+    next_time = time.perf_counter()
+    while time.perf_counter() < deadline:
+        if scans % houses == 0:
+            os.write(master, uid_line(station_index))
+            await asyncio.sleep(0.001)
+        os.write(master, uid_line(100_000 + scans % houses))
+        scans += 1
+        next_time += interval
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    return scans
+
+
+async def run(args, db, journal_path):
+    ptys = [os.openpty() for _ in range(args.stations)]
+    stations = [Station(f"desk{i}", os.ttyname(slave), "pickup" if i % 2 == 0 else "return",
+                        debounce=0.0)
+                for i, (_, slave) in enumerate(ptys)]
+    latencies = []
+    statuses = {}
+
+    def on_event(station, status, detail, latency):
+        statuses[status] = statuses.get(status, 0) + 1
+        if latency is not None:
+            latencies.append(latency)
+
+    hub = StationHub(db, stations, on_event=on_event, journal_path=journal_path)
+    await hub.start()
+    while not all(station.connected for station in stations):
+        await asyncio.sleep(0.01)
+
+    interval = 60.0 * args.stations / args.rate
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    sent = await asyncio.gather(*(simulate(master, i, args.houses, interval, deadline)
+                                  for i, (master, _) in enumerate(ptys)))
+    # Wait for the last scans to be read and committed
+    expected = sum(sent)
+    while len(latencies) + statuses.get("duplicate", 0) < expected and time.perf_counter() < deadline + 10:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    await hub.stop()
+    for master, slave in ptys:
+        os.close(master)
+        os.close(slave)
+    return sum(sent), elapsed, latencies, statuses, hub.writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=8)
+    parser.add_argument("--rate", type=int, default=6000, help="total scans per minute")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--houses", type=int, default=500, help="keys per session")
+    parser.add_argument("--db", help="use this database file instead of a temporary one")
+    parser.add_argument("--no-journal", action="store_true", help="commit scans without the scan journal")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(args.db or os.path.join(tmp, "bench.db"))
+        populate(db, args.stations, args.houses)
+        journal_path = None if args.no_journal else os.path.join(tmp, "bench.journal")
+        sent, elapsed, latencies, statuses, writer = asyncio.run(run(args, db, journal_path))
+        db.close()
+
+    print(f"{args.stations} stations, {sent} key scans in {elapsed:.1f}s "
+          f"({len(latencies) / elapsed * 60:,.0f} recorded/min)")
+    print(f"  events: {statuses}")
+    print(f"  writer: {writer.events} events in {writer.commits} transactions "
+          f"({writer.events / max(writer.commits, 1):.1f} per commit)")
+    if latencies:
+        print(f"  scan-to-{'commit' if args.no_journal else 'journal'} p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+              f"p99 {percentile(latencies, 99) * 1000:.2f} ms, "
+              f"max {max(latencies) * 1000:.2f} ms, mean {statistics.mean(latencies) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
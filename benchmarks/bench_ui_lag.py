@@ -0,0 +1,121 @@
+"""Main loop stalls with database work on the loop versus on the task runner.
+
+Usage: python benchmarks/bench_ui_lag.py [--events N] [--seconds S]
+
+Runs a stand-in for the Tk main loop (only ``after``/``after_cancel``, no
+display needed) with an instrumentation.LagProbe, and lets it handle what
+the GUI does most: the dashboard figures, the assignments view's
+load_data and refresh, a search and an export count, every 250 ms. First
+the handlers run their queries on the loop, as the GUI did before the task
+runner, then through task_runner.TaskRunner with the results delivered by
+its poll(). Reports the probe's lag percentiles and total stall time.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from history import open_history
+from instrumentation import LagProbe, metrics
+from task_runner import TaskRunner
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(HERE, ".data")
+ACTION_MS = 250
+
+
+class Loop:
+    """Single-threaded timer loop with the ``after`` interface of a Tk root."""
+
+    def __init__(self):
+        self._timers = []
+        self._ids = itertools.count()
+        self._cancelled = set()
+
+    def after(self, ms, fn, *args):
+        job = next(self._ids)
+        heapq.heappush(self._timers, (time.perf_counter() + ms / 1000, job, fn, args))
+        return job
+
+    def after_cancel(self, job):
+        self._cancelled.add(job)
+
+    def run(self, seconds):
+        deadline = time.perf_counter() + seconds
+        while self._timers and time.perf_counter() < deadline:
+            when, job, fn, args = heapq.heappop(self._timers)
+            if job in self._cancelled:
+                self._cancelled.discard(job)
+                continue
+            delay = when - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            fn(*args)
+
+
+def actions(db):
+    query = db.assignments_page_query()
+    last = db.last_pickup_id()
+    return [
+        ("dashboard", db.dashboard_stats),
+        ("load_data", lambda: (query.count(), query.fetch(query.default_sort, query.default_desc, limit=200),
+                               db.open_loans(upto_pickup_id=db.last_pickup_id()))),
+        ("refresh", lambda: query.fetch_where(query.default_sort, query.default_desc,
+                                              "l.pickup_id > ?", (last - 50,))),
+        ("search", lambda: db.search("Haupt")),
+        ("export_count", db.assignments_count),
+    ]
+
+
+def run(db, seconds, runner=None):
+    metrics.reset()
+    loop = Loop()
+    probe = LagProbe(interval=10).start(loop)
+    cases = itertools.cycle(actions(db))
+    if runner is not None:
+        runner.poll(loop, interval=10)
+
+    def act():
+        name, fn = next(cases)
+        if runner is None:
+            fn()
+        else:
+            runner.submit(fn, key=name)
+        loop.after(ACTION_MS, act)
+
+    loop.after(ACTION_MS, act)
+    loop.run(seconds)
+    probe.stop()
+    p50, p99 = metrics.histogram("ui.lag").percentiles(50, 99)
+    return p50, p99, metrics.histogram("ui.lag").max, probe.stalls, probe.stalled
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--houses", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    params = {"users": args.users, "houses": args.houses, "events": args.events, "seed": args.seed}
+    path = os.path.join(DATA_DIR, "history-u{users}-h{houses}-e{events}-s{seed}.db".format(**params))
+    db = open_history(path, **params)
+
+    print(f"{'':<16} {'lag p50':>9} {'p99':>9} {'max':>9} {'stalls':>7} {'stalled':>9}")
+    runner = TaskRunner(close=db.close).start()
+    for label, task_runner in (("on the loop", None), ("task runner", runner)):
+        p50, p99, worst, stalls, stalled = run(db, args.seconds, task_runner)
+        print(f"{label:<16} {p50 * 1000:7.1f}ms {p99 * 1000:7.1f}ms {worst * 1000:7.1f}ms "
+              f"{stalls:7d} {stalled * 1000:7.0f}ms")
+    runner.stop()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Database size and token lookups with UID bytes versus legacy decimal text.
+
+Usage: python benchmarks/bench_uid_storage.py [--events N]
+
+Generates a history with benchmarks/history.py, copies it with every token
+written back as the zero-padded decimal text used before (see uid.py) and
+VACUUMs both, then reports the file size, the size of each table and index
+holding tokens, and the time of a token lookup through the (token,
+pickup_ts) index in each.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from history import generate, house_token
+from uid import legacy_text
+
+TOKEN_COLUMNS = [("users", ["rfid_token"]), ("houses", ["rfid_token"]), ("keys", ["rfid_token"]),
+                 ("key_pickups", ["user_rfid", "house_rfid"]), ("key_returns", ["user_rfid", "house_rfid"]),
+                 ("loans", ["user_rfid", "house_rfid"]), ("house_stats", ["house_rfid"])]
+
+
+def to_legacy(path):
+    conn = sqlite3.connect(path)
+    conn.create_function("legacy", 1, lambda uid: None if uid is None else legacy_text(uid), deterministic=True)
+    with conn:
+        for table, columns in TOKEN_COLUMNS:
+            conn.execute(f"UPDATE {table} SET {', '.join(f'{c} = legacy({c})' for c in columns)}")
+    conn.close()
+
+
+def measure(path, token, ops):
+    conn = sqlite3.connect(path)
+    conn.execute("VACUUM")
+    size = os.path.getsize(path)
+    objects = dict(conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+    query = "SELECT pickup_ts FROM loans WHERE house_rfid = ? ORDER BY pickup_ts DESC LIMIT 50"
+    conn.execute(query, (token,)).fetchall()
+    start = time.perf_counter()
+    for _ in range(ops):
+        conn.execute(query, (token,)).fetchall()
+    elapsed = (time.perf_counter() - start) / ops
+    conn.close()
+    return size, objects, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--ops", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "uid.db")
+        generate(path, events=args.events).close()
+        legacy_path = os.path.join(tmp, "legacy.db")
+        shutil.copy(path, legacy_path)
+        to_legacy(legacy_path)
+
+        token = house_token(0)
+        size, objects, lookup = measure(path, token, args.ops)
+        legacy_size, legacy_objects, legacy_lookup = measure(legacy_path, legacy_text(token), args.ops)
+
+    print(f"{'':<24} {'decimal text':>12} {'UID bytes':>12}")
+    print(f"{'file':<24} {legacy_size / 1e6:10.1f}MB {size / 1e6:10.1f}MB  ({1 - size / legacy_size:.0%} smaller)")
+    token_objects = sorted(name for name in objects
+                           if name.startswith(("idx_pickups_", "idx_returns_", "idx_loans_"))
+                           or name in ("key_pickups", "key_returns", "loans"))
+    for name in token_objects:
+        print(f"  {name:<22} {legacy_objects[name] / 1e6:10.1f}MB {objects[name] / 1e6:10.1f}MB")
+    print(f"{'house history lookup':<24} {legacy_lookup * 1e6:10.1f}us {lookup * 1e6:10.1f}us")
+
+
+if __name__ == "__main__":
+    main()
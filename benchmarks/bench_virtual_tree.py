@@ -0,0 +1,132 @@
+"""Render cost of the virtual assignments list over 1M synthetic pickups.
+
+Usage: python benchmarks/bench_virtual_tree.py [--rows N] [--db PATH]
+
+Times the first window, scrolling, jumps and re-sorting of VirtualTreeview
+against loading every row as the old view did. Without a display the Tk
+widget is replaced by a list so only the paging cost is measured; with
+DISPLAY set a real Treeview is used.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import Database
+
+HEADINGS = {"User": "User", "House": "House", "Pickup": "Pickup Time", "Return": "Return Time"}
+
+
+def populate(db, rows, users=5000, houses=10000):
+    db.create_schema()
+    if db.conn.execute("SELECT COUNT(*) FROM key_pickups").fetchone()[0] >= rows:
+        return
+    with db.conn as conn:
+        conn.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+            INSERT INTO users (name, rfid_token) SELECT 'User ' || i, uid(printf('0410%010X', i)) FROM n
+        """, (users,))
+        conn.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+            INSERT INTO houses (house_name, rfid_token) SELECT 'Haus ' || i, uid(printf('0420%010X', i)) FROM n
+        """, (houses,))
+        conn.execute("""
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < ?)
+            INSERT INTO key_pickups (user_rfid, house_rfid, ts)
+            SELECT uid(printf('0410%010X', abs(random()) % ?)), uid(printf('0420%010X', abs(random()) % ?)),
+                   CAST(strftime('%s', '2015-01-01') AS INTEGER) + i * 300
+            FROM n
+        """, (rows, users, houses))
+
+
+class ListTree:
+    """Stand-in for ttk.Treeview when no display is available."""
+
+    def __init__(self):
+        self.items = []
+
+    def delete(self, *items):
+        self.items = []
+
+    def get_children(self):
+        return self.items
+
+    def insert(self, parent, index, iid=None, values=()):
+        self.items.append(values)
+
+
+class NullScrollbar:
+    def set(self, first, last):
+        pass
+
+
+def make_view(db):
+    query = db.assignments_page_query()
+    if os.environ.get("DISPLAY"):
+        import tkinter as tk
+        from virtual_tree import VirtualTreeview
+        root = tk.Tk()
+        view = VirtualTreeview(root, query, HEADINGS)
+        view.pack(fill="both", expand=True)
+        root.update()
+        return view, root.update
+    from virtual_tree import VirtualTreeview
+    view = VirtualTreeview.__new__(VirtualTreeview)
+    view.source = query
+    view.page_size = 200
+    view.max_cache = 800
+    view.format_row = None
+    view.runner = None
+    view._generation = 0
+    view._loading = False
+    view._cache_version = 0
+    view.sort = query.default_sort
+    view.desc = query.default_desc
+    view.tree = ListTree()
+    view.vsb = NullScrollbar()
+    view.visible = 30
+    view.offset = 0
+    view._reset()
+    return view, lambda: None
+
+
+def timed(label, fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"  {label:<34} {elapsed * 1000:9.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--db", help="reuse this database file instead of a temporary one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(args.db or os.path.join(tmp, "bench.db"))
+        start = time.perf_counter()
+        populate(db, args.rows)
+        print(f"populated {args.rows:,} pickups in {time.perf_counter() - start:.1f}s")
+
+        view, update = make_view(db)
+        print("virtual list")
+        timed("count + first window", lambda: (view.refresh(), update()))
+        timed("scroll one row (x500)", lambda: (view.scroll(1), update()), repeat=500)
+        timed("scroll one page (x200)", lambda: (view.scroll(view.visible), update()), repeat=200)
+        timed("jump to middle", lambda: (view.show(args.rows // 2), update()))
+        timed("jump to end", lambda: (view.show(args.rows), update()))
+        timed("sort by user", lambda: (view.sort_by("User"), update()))
+        timed("sort by pickup", lambda: (view.sort_by("Pickup"), update()))
+
+        print("full load (previous behaviour)")
+        timed("fetchall of all assignments", lambda: db.assignments().fetchall())
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
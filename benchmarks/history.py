@@ -0,0 +1,178 @@
+"""Seeded generator of a realistic key management history.
+
+Usage: python benchmarks/history.py PATH [--users N] [--houses N] [--events N] [--seed N]
+
+Creates users, houses and a chronological stream of pickup and return
+events through the real schema, so the loans and statistics triggers run as
+they do in production. Some houses and users are much busier than others,
+pickups happen on weekdays during working hours, most keys come back after a
+few hours to days, recent ones are often still out and a few are never
+returned. The same seed always produces the same database.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from database import Database
+
+STREETS = ["Hauptstraße", "Schulstraße", "Gartenstraße", "Bahnhofstraße", "Dorfstraße",
+           "Bergstraße", "Birkenweg", "Lindenstraße", "Kirchstraße", "Waldstraße",
+           "Ringstraße", "Mühlenweg", "Am Markt", "Rosenweg", "Feldstraße"]
+FIRST_NAMES = ["Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hannes", "Ida",
+               "Jonas", "Lena", "Max", "Nora", "Paul", "Sophie", "Tom"]
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner",
+              "Becker", "Schulz", "Hoffmann", "Koch", "Richter", "Klein", "Wolf"]
+
+DAY = 86400
+WORK_HOURS = 11
+# Share of loans that are never returned, and how far back keys may still be out
+LOST_RATE = 0.002
+OPEN_WINDOW = 14 * DAY
+
+
+# 7-byte UIDs as the reader reports them, stored as bytes (see uid.py)
+USER_UIDS = 0x04_10_0000_0000_00
+HOUSE_UIDS = 0x04_20_0000_0000_00
+
+
+def user_token(i):
+    return (USER_UIDS + i).to_bytes(7, "big")
+
+
+def house_token(i):
+    return (HOUSE_UIDS + i).to_bytes(7, "big")
+
+
+def is_complete(db):
+    # Histories generated before tokens were UID bytes are generated again
+    try:
+        row = db.conn.execute("SELECT value FROM bench_meta WHERE key = 'uid_tokens'").fetchone()
+    except Exception:
+        return False
+    return row is not None
+
+
+def working_days(count, end):
+    """Enough weekdays before ``end`` for ``count`` pickups, oldest first."""
+    # About 40 pickups per working hour across the whole portfolio
+    needed = int(count / 40 / WORK_HOURS) + 1
+    days = []
+    day = end // DAY
+    while len(days) < needed:
+        if (day + 3) % 7 < 5:  # 1970-01-01 was a Thursday
+            days.append(day)
+        day -= 1
+    return days[::-1]
+
+
+def pickup_times(rng, count, end):
+    """``count`` increasing epoch seconds up to ``end``, weekdays 7-18 h."""
+    days = working_days(count, end)
+    work_seconds = len(days) * WORK_HOURS * 3600
+    mean_gap = work_seconds / (count + 1)
+    offset = 0.0
+    for _ in range(count):
+        offset = min(offset + rng.expovariate(1 / mean_gap), work_seconds - 1)
+        day, seconds = divmod(int(offset), WORK_HOURS * 3600)
+        yield min(days[day] * DAY + 7 * 3600 + seconds, end)
+
+
+def generate(path, users=5000, houses=10000, events=1_000_000, seed=1, progress=True):
+    rng = random.Random(seed)
+    db = Database(path)
+    db.create_schema()
+    conn = db.conn
+
+    user_names = [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}" for i in range(users)]
+    house_names = [f"{rng.choice(STREETS)} {i // len(STREETS) + 1}-{i}" for i in range(houses)]
+    db.add_users([(name, user_token(i)) for i, name in enumerate(user_names)])
+    db.add_houses([(name, house_token(i)) for i, name in enumerate(house_names)])
+
+    # Busy houses and users: Zipf-like weights over a shuffled order
+    house_weights = list(itertools.accumulate(1 / (rank + 1) ** 0.8 for rank in range(houses)))
+    user_weights = list(itertools.accumulate(1 / (rank + 1) ** 0.6 for rank in range(users)))
+    house_order = rng.sample(range(houses), houses)
+    user_order = rng.sample(range(users), users)
+
+    now = int(time.time())
+    # Roughly every pickup is followed by a return
+    pickups = max(1, int(events / (2 - LOST_RATE)))
+    pending = []  # (return ts, user, house)
+    written = 0
+    batch = []
+
+    def flush():
+        with conn:
+            for kind, user, house, ts in batch:
+                conn.execute(f"INSERT INTO {kind} (user_rfid, house_rfid, ts) VALUES (?, ?, ?)",
+                             (user, house, ts))
+        batch.clear()
+
+    for ts in pickup_times(rng, pickups, now):
+        while pending and pending[0][0] <= ts:
+            return_ts, user, house = heapq.heappop(pending)
+            batch.append(("key_returns", user, house, return_ts))
+        user = user_token(user_order[rng.choices(range(users), cum_weights=user_weights)[0]])
+        house = house_token(house_order[rng.choices(range(houses), cum_weights=house_weights)[0]])
+        batch.append(("key_pickups", user, house, ts))
+        # Most keys come back the same day, some after a few days
+        duration = int(rng.lognormvariate(9.5, 1.2))
+        if rng.random() >= LOST_RATE and not (ts > now - OPEN_WINDOW and rng.random() < 0.5):
+            heapq.heappush(pending, (ts + duration, user, house))
+        if len(batch) >= 50_000:
+            written += len(batch)
+            flush()
+            if progress:
+                print(f"\r  {written:,} events", end="", file=sys.stderr, flush=True)
+    while pending and pending[0][0] <= now:
+        return_ts, user, house = heapq.heappop(pending)
+        batch.append(("key_returns", user, house, return_ts))
+    written += len(batch)
+    flush()
+
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS bench_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany("INSERT OR REPLACE INTO bench_meta VALUES (?, ?)", [
+            ("users", users), ("houses", houses), ("events", written), ("seed", seed), ("complete", 1), ("uid_tokens", 1)])
+    conn.execute("ANALYZE")
+    if progress:
+        print(f"\r  {written:,} events", file=sys.stderr)
+    return db
+
+
+def open_history(path, users, houses, events, seed):
+    """Open the generated database at ``path``, generating it first if needed."""
+    if os.path.exists(path):
+        db = Database(path)
+        if is_complete(db):
+            return db
+        db.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    return generate(path, users, houses, events, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--houses", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    db = open_history(args.path, args.users, args.houses, args.events, args.seed)
+    print(f"{args.path} ready in {time.perf_counter() - start:.1f}s")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
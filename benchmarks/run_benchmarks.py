@@ -0,0 +1,194 @@
+"""Times every query path of the application against a generated history.
+
+Usage: python benchmarks/run_benchmarks.py [--events N] [--users N] [--houses N]
+           [--seed N] [--repeat N] [--only SUBSTRING] [--json PATH]
+           [--baseline PATH] [--save-baseline] [--tolerance PERCENT]
+
+The history is generated once by benchmarks/history.py and kept in
+benchmarks/.data/ (10M events take several minutes). Every case runs the
+same Database calls as the GUI: the dashboard, the three queries of the
+assignments view's load_data, its incremental refresh, scrolling, both CSV
+exports and the per-scan token lookups. No display is needed.
+
+Results are printed as a table and written as JSON. The run is compared
+against the stored baseline (benchmarks/baseline.json, recorded with the
+default parameters) if the parameters match; a case that is slower than the
+tolerance (and by more than the noise floor) is reported as a regression and
+the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from export import CsvExport
+from history import house_token, open_history, user_token
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(HERE, ".data")
+BASELINE_PATH = os.path.join(HERE, "baseline.json")
+# Differences below this many microseconds are noise, whatever the ratio
+NOISE_FLOOR_US = 50
+
+ASSIGNMENT_HEADERS = ["User", "House", "Pickup Time", "Return Time"]
+
+
+def cases(db, tmp):
+    """(name, ops per sample, function) for every benchmarked path."""
+    query = db.assignments_page_query()
+    last_pickup = db.last_pickup_id()
+    first_page = query.fetch(query.default_sort, query.default_desc, limit=200)
+    middle = db.assignments_count() // 2
+    user = user_token(0)
+    house = house_token(0)
+    start = db.conn.execute(
+        "SELECT date(MAX(pickup_ts), 'unixepoch', '-30 days') FROM loans").fetchone()[0]
+
+    def export(cursor_fn, count_fn, headers, name, **filters):
+        path = os.path.join(tmp, name)
+        CsvExport(lambda: cursor_fn(**filters), headers, path, count=lambda: count_fn(**filters)).run()
+
+    return [
+        # Dashboard
+        ("dashboard.stats", 50, db.dashboard_stats),
+        ("dashboard.user_count", 200, db.user_count),
+        ("dashboard.today_pickups", 200, db.today_pickup_count),
+        ("dashboard.overdue", 20, db.overdue_count),
+        ("dashboard.busiest_houses", 50, db.busiest_houses),
+        # Assignments view: load_data
+        ("load_data.assignments_window", 10,
+         lambda: (query.count(), query.fetch(query.default_sort, query.default_desc, limit=200))),
+        ("load_data.open_loans", 3, lambda: db.open_loans(upto_pickup_id=last_pickup)),
+        ("load_data.non_returned_count", 50, db.non_returned_count),
+        # Assignments view: periodic refresh with nothing new, scrolling, sorting
+        ("refresh.idle_poll", 500, lambda: (db.last_pickup_id(), db.last_return_id())),
+        ("scroll.next_page", 50,
+         lambda: query.fetch(query.default_sort, query.default_desc, after=(first_page[-1][1], first_page[-1][0]), limit=200)),
+        ("scroll.jump_middle", 3,
+         lambda: query.fetch(query.default_sort, query.default_desc, skip=middle, limit=200)),
+        ("sort.by_user_first_page", 3, lambda: query.fetch("User", False, limit=200)),
+        # Exports
+        ("export.all_assignments", 1,
+         lambda: export(db.assignments, db.assignments_count, ASSIGNMENT_HEADERS, "all.csv")),
+        ("export.non_returned", 3,
+         lambda: export(db.non_returned, db.non_returned_count, ASSIGNMENT_HEADERS[:3], "nr.csv")),
+        ("export.last_30_days", 3,
+         lambda: export(db.assignments, db.assignments_count, ASSIGNMENT_HEADERS, "range.csv", start=start)),
+        # Per-scan lookups
+        ("scan.user_lookup", 10000, lambda: db.user_name(user)),
+        ("scan.house_lookup", 10000, lambda: db.house_name(house)),
+        ("scan.unknown_token", 10000, lambda: (db.house_name("0"), db.user_name("0"))),
+        ("scan.token_index_check", 1000, db.tokens.check),
+    ]
+
+
+def measure(fn, ops, repeat):
+    """Median and minimum microseconds per operation over ``repeat`` samples."""
+    fn()  # warm the page cache and statement cache
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(ops):
+            fn()
+        samples.append((time.perf_counter() - start) / ops * 1e6)
+    return statistics.median(samples), min(samples)
+
+
+def compare(results, baseline, tolerance):
+    """Print the comparison and return the names of regressed cases.
+
+    The best sample of each case is compared, it is the least affected by
+    other load on the machine.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"  {name:<32} {result['min_us']:12.1f} us  (new)")
+            continue
+        ratio = result["min_us"] / base["min_us"] if base["min_us"] else float("inf")
+        slower = result["min_us"] - base["min_us"] > NOISE_FLOOR_US
+        flag = ""
+        if ratio > 1 + tolerance / 100 and slower:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - tolerance / 100:
+            flag = "faster"
+        print(f"  {name:<32} {result['min_us']:12.1f} us  baseline {base['min_us']:12.1f} us"
+              f"  {ratio:6.2f}x  {flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--houses", type=int, default=10000)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="run only cases whose name contains this")
+    parser.add_argument("--json", metavar="PATH", help="write results to this file")
+    parser.add_argument("--baseline", metavar="PATH", default=BASELINE_PATH,
+                        help="compare against this run (default: benchmarks/baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=25.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    params = {"users": args.users, "houses": args.houses, "events": args.events, "seed": args.seed}
+    path = os.path.join(DATA_DIR, "history-u{users}-h{houses}-e{events}-s{seed}.db".format(**params))
+    start = time.perf_counter()
+    db = open_history(path, **params)
+    print(f"history {path} ({time.perf_counter() - start:.1f}s)")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, ops, fn in cases(db, tmp):
+            if args.only and args.only not in name:
+                continue
+            median, best = measure(fn, ops, args.repeat)
+            results[name] = {"median_us": round(median, 2), "min_us": round(best, 2), "ops": ops}
+            print(f"  {name:<32} {median:12.1f} us  (min {best:.1f})", flush=True)
+    db.close()
+
+    run = {
+        "params": params,
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(run, f, indent=2)
+
+    status = 0
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print(f"baseline {args.baseline} was recorded with {baseline['params']}, not compared")
+        else:
+            print(f"compared with {args.baseline} ({baseline['environment']['date']})")
+            regressions = compare(results, baseline, args.tolerance)
+            if regressions:
+                print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+                status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Bulk import of users or houses from CSV or JSON files.
+
+A file holds one record per row (CSV with a header line) or per object in a
+JSON list, with a name column (``name`` or ``house_name``) and a token column
+(``rfid_token`` or ``token``). All records are checked against the existing
+names and tokens in one pass over the token index and written with a single
+executemany transaction; rows that cannot be imported end up in a reject
+report instead of stopping the import.
+"""
+import csv
+import json
+import os
+from collections import Counter
+
+from task_runner import report_progress
+from uid import to_uid
+
+NAME_COLUMNS = ("name", "house_name")
+TOKEN_COLUMNS = ("rfid_token", "token")
+REJECT_HEADERS = ["Zeile", "Name", "RFID-Token", "Grund"]
+
+
+def _pick(record, columns):
+    for column in columns:
+        value = record.get(column)
+        if value is not None:
+            return str(value).strip()
+    return ""
+
+
+def read_records(path):
+    """(row number, name, token) for every record in a CSV or JSON file."""
+    if path.lower().endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, list):
+            raise ValueError("JSON-Datei muss eine Liste von Objekten enthalten.")
+        return [(i, _pick(record, NAME_COLUMNS), _pick(record, TOKEN_COLUMNS))
+                for i, record in enumerate(data, start=1)]
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        fields = {field.strip().lower() for field in reader.fieldnames or ()}
+        if not fields & set(NAME_COLUMNS) or not fields & set(TOKEN_COLUMNS):
+            raise ValueError("CSV-Datei braucht die Spalten 'name' und 'rfid_token'.")
+        records = []
+        # Row 1 is the header
+        for i, record in enumerate(reader, start=2):
+            record = {key.strip().lower(): value for key, value in record.items() if key}
+            records.append((i, _pick(record, NAME_COLUMNS), _pick(record, TOKEN_COLUMNS)))
+            if i % 1000 == 0:
+                # Rows read so far, when run by the GUI's task runner
+                report_progress(i - 1)
+        return records
+
+
+def validate(records, names, tokens):
+    """Split records into rows to insert and (row, name, token, reason) rejects.
+
+    ``names`` are the names already taken, ``tokens`` every token already in
+    use by a user or a house (keys.rfid_token is unique across both), as
+    UID bytes. Tokens are compared as UIDs, so "04A21F9C" and its legacy
+    decimal form are the same token; rejects keep the text from the file.
+    """
+    name_counts = Counter(name for _, name, _ in records if name)
+    token_counts = Counter(to_uid(token) for _, _, token in records if token)
+    accepted = []
+    rejects = []
+    for row, name, token in records:
+        uid = to_uid(token) if token else b""
+        if not name:
+            reason = "Name fehlt"
+        elif not token:
+            reason = "RFID-Token fehlt"
+        elif name in names:
+            reason = "Name bereits registriert"
+        elif uid in tokens:
+            reason = "RFID bereits vergeben"
+        elif name_counts[name] > 1:
+            reason = "Name mehrfach in der Datei"
+        elif token_counts[uid] > 1:
+            reason = "RFID mehrfach in der Datei"
+        else:
+            accepted.append((name, uid))
+            continue
+        rejects.append((row, name, token, reason))
+    return accepted, rejects
+
+
+def write_rejects(rejects, path):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(REJECT_HEADERS)
+        writer.writerows(rejects)
+
+
+def reject_path(path):
+    return os.path.splitext(path)[0] + ".rejects.csv"
+
+
+def import_file(db, path, kind, rejects_path=None):
+    """Import users or houses (``kind``) from ``path``.
+
+    Returns (imported count, rejects, reject report path or None).
+    """
+    if kind not in ("users", "houses"):
+        raise ValueError(f"unknown import kind: {kind}")
+    records = read_records(path)
+    index = db.tokens
+    # Checked against the in-memory index, no query per row; check() picks
+    # up changes made by other processes first
+    index.check()
+    names = index.user_names if kind == "users" else index.house_names
+    taken_names = {name for name, count in names.items() if count > 0}
+    taken_tokens = index.users.keys() | index.houses.keys()
+    accepted, rejects = validate(records, taken_names, taken_tokens)
+    if kind == "users":
+        db.add_users(accepted)
+    else:
+        db.add_houses(accepted)
+    report = None
+    if rejects:
+        report = rejects_path or reject_path(path)
+        write_rejects(rejects, report)
+    return len(accepted), rejects, report
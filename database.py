@@ -0,0 +1,608 @@
+import calendar
+import sqlite3
+import threading
+import time
+
+from archive import ARCHIVE_AFTER_DAYS, LOAN_COLUMNS, Archive
+from instrumentation import TimedConnection, instrument
+from migrations import migrate
+from overdue_monitor import OverdueMonitor
+from token_index import TokenIndex
+from uid import sql_uid, to_uid, uid_text
+
+DB_PATH = "key_management.db"
+
+# Loans open longer than this are counted as overdue on the dashboard
+OVERDUE_AFTER = "-1 day"
+
+# Timestamps are stored as integer seconds since the epoch (UTC) and shown
+# in the 'YYYY-MM-DD HH:MM:SS' form of CURRENT_TIMESTAMP
+NOW_SQL = "CAST(strftime('%s', 'now') AS INTEGER)"
+
+
+def ts_text(column):
+    return f"datetime({column}, 'unixepoch')"
+
+
+def to_epoch(value):
+    """Seconds since the epoch of an int or a 'YYYY-MM-DD HH:MM:SS' UTC string."""
+    if isinstance(value, str):
+        return calendar.timegm(time.strptime(value, "%Y-%m-%d %H:%M:%S"))
+    return int(value)
+
+
+def loans_from_sql(tables=("loans",)):
+    """FROM clause of the loans in ``tables`` with their user and house.
+
+    Pickups are matched to returns through the materialized loans table,
+    which the triggers in create_schema() keep current. Loans of deleted
+    users or houses are still listed, so keys that are out are never hidden.
+    Several tables (the main one and attached archives) are read as one.
+    """
+    if len(tables) == 1:
+        source = tables[0]
+    else:
+        source = "(" + " UNION ALL ".join(f"SELECT {LOAN_COLUMNS} FROM {table}" for table in tables) + ")"
+    return f"""
+    FROM {source} l
+    LEFT JOIN users u ON l.user_rfid = u.rfid_token
+    LEFT JOIN houses h ON l.house_rfid = h.rfid_token
+"""
+
+
+LOANS_FROM_SQL = loans_from_sql()
+
+ASSIGNMENTS_SQL = f"""
+    SELECT COALESCE(u.name, ''), COALESCE(h.house_name, ''), {ts_text('l.pickup_ts')}, {ts_text('l.return_ts')}
+    {{from_sql}}
+    {{where}}
+    ORDER BY l.pickup_ts DESC
+"""
+
+NON_RETURNED_COUNT_SQL = """
+    SELECT COUNT(*) FROM loans WHERE return_ts IS NULL
+"""
+
+NON_RETURNED_SQL = f"""
+    SELECT COALESCE(u.name, ''), COALESCE(h.house_name, ''), {ts_text('l.pickup_ts')}
+""" + LOANS_FROM_SQL + """
+    {where}
+    ORDER BY l.pickup_ts DESC
+"""
+
+
+# Tells the overdue monitors of other processes to recompute due times
+LOAN_LIMITS_CHANGED_SQL = """
+    INSERT INTO counters (name, value) VALUES ('loan_limits', 1)
+    ON CONFLICT (name) DO UPDATE SET value = value + 1
+"""
+
+
+def loan_filter_sql(start=None, end=None, user=None, house=None, open_only=False):
+    """WHERE clause and parameters for the loan filters used by reports.
+
+    ``start`` and ``end`` are inclusive 'YYYY-MM-DD' pickup dates, ``user``
+    and ``house`` match names exactly.
+    """
+    clauses = []
+    params = []
+    if open_only:
+        clauses.append("l.return_ts IS NULL")
+    if start:
+        clauses.append("l.pickup_ts >= CAST(strftime('%s', ?) AS INTEGER)")
+        params.append(start)
+    if end:
+        clauses.append("l.pickup_ts < CAST(strftime('%s', ?, '+1 day') AS INTEGER)")
+        params.append(end)
+    if user:
+        clauses.append("u.name = ?")
+        params.append(user)
+    if house:
+        clauses.append("h.house_name = ?")
+        params.append(house)
+    where = "WHERE " + " AND ".join(clauses) if clauses else ""
+    return where, params
+
+
+def fts_query(text):
+    """FTS5 query matching every word of ``text`` as a prefix, for search-as-you-type.
+
+    Tokens are indexed as hex; a complete token in the legacy decimal form
+    (12 digits or more, house numbers are shorter) is searched as its hex.
+    """
+    words = [uid_text(to_uid(word)) if len(word) >= 12 and word.isdigit() else word for word in text.split()]
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+class PagedQuery:
+    """Keyset pagination over one table or join, sortable by any column.
+
+    ``columns`` maps a column name to ``(select_expr, sort_expr)``; the sort
+    expression must not be NULL so that ``(sort, id)`` is a total order.
+    Rows are returned as ``(id, sort_value, *column_values)``.
+
+    With ``sources``, a function returning table names, ``{table}`` in
+    ``from_sql`` and ``count_from`` is replaced by each of them in turn. Every
+    table is paged with its own index and the pages are merged, which is far
+    cheaper than sorting a UNION ALL of all of them. ``where`` with its
+    ``params`` limits every query to some of the rows.
+    """
+
+    def __init__(self, db, from_sql, id_expr, columns, default_sort, default_desc=False,
+                 count_from=None, sources=None, where=None, params=()):
+        self.db = db
+        self.from_sql = from_sql
+        self.count_from = count_from or from_sql
+        self.id_expr = id_expr
+        self.columns = columns
+        self.default_sort = default_sort
+        self.default_desc = default_desc
+        self.sources = sources
+        self.where = where
+        self.params = tuple(params)
+
+    def tables(self):
+        return self.sources() if self.sources is not None else [None]
+
+    def _from(self, from_sql, table):
+        return from_sql if table is None else from_sql.format(table=table)
+
+    def count(self):
+        where = f" WHERE {self.where}" if self.where else ""
+        return sum(self.db.conn.execute(f"SELECT COUNT(*) FROM {self._from(self.count_from, table)}{where}",
+                                        self.params).fetchone()[0]
+                   for table in self.tables())
+
+    def fetch(self, sort, desc, after=None, skip=0, limit=100, backwards=False):
+        """Fetch ``limit`` rows following the key ``after`` = (sort_value, id).
+
+        With ``backwards`` the rows preceding ``after`` are returned, nearest
+        first. ``skip`` offsets from ``after`` and is only used for jumps.
+        """
+        sort_expr = self.columns[sort][1]
+        descending = desc != backwards
+        select = ", ".join(expr for expr, _ in self.columns.values())
+        tables = self.tables()
+        rows = []
+        for table in tables:
+            sql = f"SELECT {self.id_expr}, {sort_expr}, {select} FROM {self._from(self.from_sql, table)}"
+            clauses = [self.where] if self.where else []
+            params = list(self.params)
+            if after is not None:
+                clauses.append(f"({sort_expr}, {self.id_expr}) {'<' if descending else '>'} (?, ?)")
+                params.extend(after)
+            if clauses:
+                sql += " WHERE " + " AND ".join(clauses)
+            order = "DESC" if descending else "ASC"
+            sql += f" ORDER BY {sort_expr} {order}, {self.id_expr} {order} LIMIT ? OFFSET ?"
+            # The rows skipped may come from any table
+            params.extend((limit, skip) if len(tables) == 1 else (limit + skip, 0))
+            rows.extend(self.db.conn.execute(sql, params).fetchall())
+        if len(tables) == 1:
+            return rows
+        rows.sort(key=lambda row: (row[1], row[0]), reverse=descending)
+        return rows[skip:skip + limit]
+
+    def fetch_where(self, sort, desc, condition, params):
+        """Fetch the rows matching an extra SQL condition, in display order."""
+        sort_expr = self.columns[sort][1]
+        select = ", ".join(expr for expr, _ in self.columns.values())
+        order = "DESC" if desc else "ASC"
+        if self.where:
+            condition = f"{self.where} AND ({condition})"
+            params = self.params + tuple(params)
+        rows = []
+        for table in self.tables():
+            sql = (f"SELECT {self.id_expr}, {sort_expr}, {select} FROM {self._from(self.from_sql, table)}"
+                   f" WHERE {condition} ORDER BY {sort_expr} {order}, {self.id_expr} {order}")
+            rows.extend(self.db.conn.execute(sql, params).fetchall())
+        rows.sort(key=lambda row: (row[1], row[0]), reverse=desc)
+        return rows
+
+
+class Database:
+    """Database access layer with one long-lived connection per thread.
+
+    Connections are opened lazily and kept for the lifetime of the thread, so
+    the schema is parsed once and prepared statements stay in the sqlite3
+    statement cache. All SQL used by the application lives here. The
+    methods that run SQL are timed as "db.<method>", see instrumentation.py.
+    """
+
+    def __init__(self, path=DB_PATH, timeout=5.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.tokens = TokenIndex(self)
+        self.archive = Archive(path)
+        self.overdue = OverdueMonitor(self)
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, cached_statements=256,
+                               factory=TimedConnection)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA cache_size = -16000")
+        # For migrations and archives still holding text tokens
+        conn.create_function("uid", 1, sql_uid, deterministic=True)
+        return conn
+
+    def close(self):
+        # Only the calling thread's connection can be closed safely
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            with self._lock:
+                self._connections.remove(conn)
+
+    def create_schema(self):
+        """Create or upgrade the schema, see migrations.py."""
+        return migrate(self.conn)
+
+    # Users
+
+    # Token lookups are served from the in-memory TokenIndex. Tokens are
+    # stored as UID bytes, every method taking one also accepts its hex or
+    # legacy decimal text, see uid.py.
+
+    def user_name(self, token):
+        return self.tokens.user_name(to_uid(token))
+
+    def user_token_exists(self, token):
+        return self.tokens.user_name(to_uid(token)) is not None
+
+    def user_name_exists(self, name):
+        return self.tokens.has_user_name(name)
+
+    def add_user(self, name, token):
+        token = to_uid(token)
+        with self.conn as conn:
+            conn.execute("INSERT INTO users (name, rfid_token) VALUES (?, ?)", (name, token))
+            conn.execute("INSERT INTO keys (rfid_token, status) VALUES (?, 'available')", (token,))
+        self.tokens.add_user(token, name)
+
+    def delete_user(self, token):
+        token = to_uid(token)
+        with self.conn as conn:
+            conn.execute("DELETE FROM users WHERE rfid_token = ?", (token,))
+            conn.execute("DELETE FROM keys WHERE rfid_token = ?", (token,))
+        self.tokens.remove_user(token)
+
+    def add_users(self, rows):
+        """Insert (name, rfid_token) rows with their keys in one transaction."""
+        if not rows:
+            return 0
+        rows = [(name, to_uid(token)) for name, token in rows]
+        with self.conn as conn:
+            conn.executemany("INSERT INTO users (name, rfid_token) VALUES (?, ?)", rows)
+            conn.executemany("INSERT INTO keys (rfid_token, status) VALUES (?, 'available')",
+                             [(token,) for _, token in rows])
+        for name, token in rows:
+            self.tokens.add_user(token, name)
+        return len(rows)
+
+    def list_users(self):
+        return self.conn.execute("SELECT id, name, hex(rfid_token) FROM users").fetchall()
+
+    def user_count(self):
+        return self.counter("users")
+
+    def set_user_loan_limit(self, token, seconds):
+        """Set how long the user may keep a key, None for the default."""
+        token = to_uid(token)
+        with self.conn as conn:
+            changed = conn.execute("UPDATE users SET loan_limit = ? WHERE rfid_token = ?",
+                                   (seconds, token)).rowcount
+            conn.execute(LOAN_LIMITS_CHANGED_SQL)
+        self.overdue.limits_changed()
+        return changed
+
+    # Houses
+
+    def house_name(self, token):
+        return self.tokens.house_name(to_uid(token))
+
+    def house_token_exists(self, token):
+        return self.tokens.house_name(to_uid(token)) is not None
+
+    def house_name_exists(self, name):
+        return self.tokens.has_house_name(name)
+
+    def add_house(self, name, token):
+        token = to_uid(token)
+        with self.conn as conn:
+            conn.execute("INSERT INTO houses (house_name, rfid_token) VALUES (?, ?)", (name, token))
+            conn.execute("INSERT INTO keys (rfid_token, status) VALUES (?, 'available')", (token,))
+        self.tokens.add_house(token, name)
+
+    def delete_house(self, token):
+        token = to_uid(token)
+        with self.conn as conn:
+            conn.execute("DELETE FROM houses WHERE rfid_token = ?", (token,))
+            conn.execute("DELETE FROM keys WHERE rfid_token = ?", (token,))
+        self.tokens.remove_house(token)
+
+    def add_houses(self, rows):
+        """Insert (house_name, rfid_token) rows with their keys in one transaction."""
+        if not rows:
+            return 0
+        rows = [(name, to_uid(token)) for name, token in rows]
+        with self.conn as conn:
+            conn.executemany("INSERT INTO houses (house_name, rfid_token) VALUES (?, ?)", rows)
+            conn.executemany("INSERT INTO keys (rfid_token, status) VALUES (?, 'available')",
+                             [(token,) for _, token in rows])
+        for name, token in rows:
+            self.tokens.add_house(token, name)
+        return len(rows)
+
+    def list_houses(self):
+        return self.conn.execute("SELECT id, house_name, hex(rfid_token) FROM houses").fetchall()
+
+    def set_house_loan_limit(self, token, seconds):
+        """Set how long the house's key may be out, None for the default."""
+        token = to_uid(token)
+        with self.conn as conn:
+            changed = conn.execute("UPDATE houses SET loan_limit = ? WHERE rfid_token = ?",
+                                   (seconds, token)).rowcount
+            conn.execute(LOAN_LIMITS_CHANGED_SQL)
+        self.overdue.limits_changed()
+        return changed
+
+    def loan_limits(self):
+        """({user token: seconds}, {house token: seconds}) of the limits that are set."""
+        return (dict(self.conn.execute("SELECT rfid_token, loan_limit FROM users WHERE loan_limit IS NOT NULL")),
+                dict(self.conn.execute("SELECT rfid_token, loan_limit FROM houses WHERE loan_limit IS NOT NULL")))
+
+    # Pickups and returns
+
+    def record_pickups(self, rows):
+        """Write (user_rfid, house_rfid, timestamp) rows in a single transaction."""
+        if not rows:
+            return 0
+        rows = [(to_uid(user_rfid), to_uid(house_rfid), to_epoch(timestamp)) for user_rfid, house_rfid, timestamp in rows]
+        with self.conn as conn:
+            conn.executemany("INSERT INTO key_pickups (user_rfid, house_rfid, ts) VALUES (?, ?, ?)", rows)
+            conn.executemany(
+                "UPDATE keys SET status = 'picked_up' WHERE rfid_token = ?", [(row[1],) for row in rows])
+        for user_rfid, house_rfid, timestamp in rows:
+            self.overdue.pickup(user_rfid, house_rfid, timestamp)
+        return len(rows)
+
+    def record_return(self, user_rfid, house_rfid):
+        user_rfid, house_rfid = to_uid(user_rfid), to_uid(house_rfid)
+        with self.conn as conn:
+            conn.execute(f"""
+                INSERT INTO key_returns (user_rfid, house_rfid, ts)
+                VALUES (?, ?, {NOW_SQL})
+            """, (user_rfid, house_rfid))
+            conn.execute("UPDATE keys SET status = 'available' WHERE rfid_token = ?", (house_rfid,))
+        self.overdue.returned(user_rfid, house_rfid, int(time.time()))
+
+    def record_scans(self, events, journal=None):
+        """Write ("pickup" | "return", user_rfid, house_rfid, timestamp) events
+        in order, in a single transaction.
+
+        ``journal`` is (journal name, sequence number) of the last
+        scan_journal.py entry among the events, stored in the same transaction.
+        """
+        events = [(kind, to_uid(user_rfid), to_uid(house_rfid), to_epoch(timestamp))
+                  for kind, user_rfid, house_rfid, timestamp in events]
+        with self.conn as conn:
+            if journal is not None:
+                conn.execute("""
+                    INSERT INTO scan_journal (name, seq) VALUES (?, ?)
+                    ON CONFLICT (name) DO UPDATE SET seq = excluded.seq
+                """, journal)
+            for kind, user_rfid, house_rfid, timestamp in events:
+                if kind == "pickup":
+                    conn.execute(
+                        "INSERT INTO key_pickups (user_rfid, house_rfid, ts) VALUES (?, ?, ?)",
+                        (user_rfid, house_rfid, timestamp))
+                    conn.execute("UPDATE keys SET status = 'picked_up' WHERE rfid_token = ?", (house_rfid,))
+                else:
+                    conn.execute(
+                        "INSERT INTO key_returns (user_rfid, house_rfid, ts) VALUES (?, ?, ?)",
+                        (user_rfid, house_rfid, timestamp))
+                    conn.execute("UPDATE keys SET status = 'available' WHERE rfid_token = ?", (house_rfid,))
+        for kind, user_rfid, house_rfid, timestamp in events:
+            if kind == "pickup":
+                self.overdue.pickup(user_rfid, house_rfid, timestamp)
+            else:
+                self.overdue.returned(user_rfid, house_rfid, timestamp)
+        return len(events)
+
+    def journal_seq(self, name):
+        """Sequence number of the last entry of journal ``name`` committed, 0 if none."""
+        row = self.conn.execute("SELECT seq FROM scan_journal WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    # Paged lists for the virtual treeviews
+
+    def users_page_query(self):
+        return PagedQuery(self, "users", "id", {
+            "ID": ("id", "id"),
+            "Name": ("name", "name"),
+            "RFID": ("hex(rfid_token)", "rfid_token"),
+        }, "ID")
+
+    def houses_page_query(self):
+        return PagedQuery(self, "houses", "id", {
+            "ID": ("id", "id"),
+            "House": ("house_name", "house_name"),
+            "RFID": ("hex(rfid_token)", "rfid_token"),
+        }, "ID")
+
+    def assignments_page_query(self, where=None, params=()):
+        # Every loan is listed (LEFT JOINs), so counting needs no join
+        return PagedQuery(self, """{table} l
+            LEFT JOIN users u ON l.user_rfid = u.rfid_token
+            LEFT JOIN houses h ON l.house_rfid = h.rfid_token""", "l.pickup_id", {
+            "User": ("COALESCE(u.name, '')", "COALESCE(u.name, '')"),
+            "House": ("COALESCE(h.house_name, '')", "COALESCE(h.house_name, '')"),
+            "Pickup": (ts_text("l.pickup_ts"), "l.pickup_ts"),
+            "Return": (ts_text("l.return_ts"), "COALESCE(l.return_ts, 0)"),
+        }, "Pickup", default_desc=True, count_from="{table} l", sources=self.loan_sources,
+            where=where, params=params)
+
+    def loan_history_query(self, kind, token):
+        """Loans of one user or house (``kind``), read through its (token, pickup_ts) index."""
+        column = "l.user_rfid" if kind == "user" else "l.house_rfid"
+        return self.assignments_page_query(f"{column} = ?", (to_uid(token),))
+
+    # Search
+
+    def search(self, text, limit=50):
+        """Users and houses whose name or token has words starting with the words
+        of ``text``, as (kind, token, name, deleted), best matches first."""
+        query = fts_query(text)
+        if not query:
+            return []
+        return self.conn.execute("""
+            SELECT kind, token, name, deleted FROM search_index
+            WHERE search_index MATCH ?
+            ORDER BY deleted, rank
+            LIMIT ?
+        """, (query, limit)).fetchall()
+
+    # Archive
+
+    def loan_sources(self, start=None, end=None):
+        """The loans tables holding pickups between the 'YYYY-MM-DD' dates
+        ``start`` and ``end``: the main one and the archives of those years,
+        which are attached to this thread's connection when needed."""
+        years = self.archive.years_for(start, end)
+        if not years:
+            return ["loans"]
+        return ["main.loans"] + [f"{schema}.loans" for schema in self.archive.attach(self.conn, years)]
+
+    def archive_loans(self, older_than_days=ARCHIVE_AFTER_DAYS, vacuum=False):
+        """Move old closed loans into the yearly archives, see archive.py.
+
+        Returns {year: loans moved}. ``vacuum`` rebuilds the main database
+        afterwards so the file shrinks, otherwise the freed pages are reused.
+        """
+        moved = self.archive.move_closed_loans(self.conn, older_than_days)
+        if vacuum:
+            self.conn.execute("VACUUM main")
+        return moved
+
+    # Reports
+
+    def counter(self, name):
+        row = self.conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def day_stats(self, day=None):
+        """(pickups, returns) of a local 'YYYY-MM-DD' date, today by default."""
+        row = self.conn.execute(
+            "SELECT pickups, returns FROM daily_stats WHERE day = COALESCE(?, date('now', 'localtime'))",
+            (day,)).fetchone()
+        return row if row else (0, 0)
+
+    def today_pickup_count(self):
+        return self.day_stats()[0]
+
+    def overdue_count(self, older_than=OVERDUE_AFTER):
+        # Range scan of the open-loans partial index, only visits overdue rows
+        return self.conn.execute("""
+            SELECT COUNT(*) FROM loans
+            WHERE return_ts IS NULL AND pickup_ts < CAST(strftime('%s', 'now', ?) AS INTEGER)
+        """, (older_than,)).fetchone()[0]
+
+    def busiest_houses(self, limit=5):
+        """(house name, total pickups, keys out) of the most picked up houses."""
+        return self.conn.execute("""
+            SELECT COALESCE(h.house_name, hex(s.house_rfid)), s.pickups, s.open
+            FROM house_stats s
+            LEFT JOIN houses h ON h.rfid_token = s.house_rfid
+            ORDER BY s.pickups DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+
+    def dashboard_stats(self):
+        """Everything the dashboard shows, read from the summary tables."""
+        pickups, returns = self.day_stats()
+        return {
+            "users": self.counter("users"),
+            "pickups_today": pickups,
+            "returns_today": returns,
+            "keys_out": self.counter("open_loans"),
+            # With the monitor loaded the loan limits apply, otherwise OVERDUE_AFTER
+            "overdue": self.overdue.count() if self.overdue.loaded else self.overdue_count(),
+            "busiest_houses": self.busiest_houses(),
+        }
+
+    # Loan history spans the archives of the years in the date range
+
+    def assignments(self, **filters):
+        from_sql = loans_from_sql(self.loan_sources(filters.get("start"), filters.get("end")))
+        where, params = loan_filter_sql(**filters)
+        return self.conn.execute(ASSIGNMENTS_SQL.format(from_sql=from_sql, where=where), params)
+
+    def assignments_count(self, **filters):
+        from_sql = loans_from_sql(self.loan_sources(filters.get("start"), filters.get("end")))
+        where, params = loan_filter_sql(**filters)
+        return self.conn.execute(f"SELECT COUNT(*) {from_sql} {where}", params).fetchone()[0]
+
+    # Open loans are never archived
+
+    def non_returned_count(self, **filters):
+        if not filters:
+            return self.conn.execute(NON_RETURNED_COUNT_SQL).fetchone()[0]
+        where, params = loan_filter_sql(open_only=True, **filters)
+        return self.conn.execute(f"SELECT COUNT(*) {LOANS_FROM_SQL} {where}", params).fetchone()[0]
+
+    def last_pickup_id(self):
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM key_pickups").fetchone()[0]
+
+    def last_return_id(self):
+        return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM key_returns").fetchone()[0]
+
+    def open_loans(self, after_pickup_id=0, upto_pickup_id=None):
+        """Open loans as (pickup_id, user, house, pickup_ts), newest first."""
+        sql = f"""
+            SELECT l.pickup_id, COALESCE(u.name, ''), COALESCE(h.house_name, ''), {ts_text('l.pickup_ts')}
+        """ + LOANS_FROM_SQL + """
+            WHERE l.return_ts IS NULL AND l.pickup_id > ?
+        """
+        params = [after_pickup_id]
+        if upto_pickup_id is not None:
+            sql += " AND l.pickup_id <= ?"
+            params.append(upto_pickup_id)
+        sql += " ORDER BY l.pickup_ts DESC, l.pickup_id DESC"
+        return self.conn.execute(sql, params).fetchall()
+
+    def open_loan_keys(self):
+        """(user_rfid, house_rfid, pickup_ts) of every open loan, for the overdue monitor."""
+        return self.conn.execute(
+            "SELECT user_rfid, house_rfid, pickup_ts FROM loans WHERE return_ts IS NULL").fetchall()
+
+    def returned_pickup_ids(self, after_return_id, upto_return_id):
+        return [row[0] for row in self.conn.execute(
+            "SELECT pickup_id FROM loans WHERE return_id > ? AND return_id <= ?",
+            (after_return_id, upto_return_id))]
+
+    def non_returned(self, **filters):
+        where, params = loan_filter_sql(open_only=True, **filters)
+        return self.conn.execute(NON_RETURNED_SQL.format(where=where), params)
+
+
+instrument(PagedQuery, "db.page")
+# Token lookups are answered from memory in well under a microsecond, a timer
+# would cost more than the lookup itself
+instrument(Database, "db", skip=("user_name", "user_token_exists", "user_name_exists",
+                                 "house_name", "house_token_exists", "house_name_exists", "close"))
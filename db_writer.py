@@ -0,0 +1,317 @@
+import asyncio
+import concurrent.futures
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from instrumentation import observe
+
+# Journaled scans are applied again after this many seconds when the
+# database is locked or unavailable
+RETRY_DELAY = 1.0
+# Primary result codes of those errors; any other error rejects the entry
+TRANSIENT_ERRORS = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED, sqlite3.SQLITE_IOERR,
+                    sqlite3.SQLITE_FULL, sqlite3.SQLITE_CANTOPEN}
+# The journal is compacted once it is larger than this, or larger than
+# COMPACT_IDLE_BYTES when everything in it has been applied
+COMPACT_BYTES = 256 * 1024
+COMPACT_IDLE_BYTES = 16 * 1024
+
+log = logging.getLogger("kms.writer")
+
+
+class DatabaseWriter:
+    """Single writer thread with group commit.
+
+    ``submit`` is called on an event loop and returns an asyncio future,
+    ``write`` is called from any other thread and blocks. The thread takes
+    everything queued since its last commit (up to ``max_batch``
+    submissions) and writes it with one Database.record_scans transaction,
+    so the events of one submission are always committed together.
+
+    Without a journal, submissions are resolved once they are committed. With
+    a scan_journal.ScanJournal, a second thread appends them to the journal
+    first, as many as have queued up with one fsync, and resolves them as
+    soon as they are on disk; the writer thread then applies them, and
+    retries every RETRY_DELAY seconds while the database is locked or
+    unavailable instead of failing. An entry the database refuses for any
+    other reason is moved to the journal's rejects file (ScanJournal.reject)
+    and counts as applied. Its commits are synced (synchronous =
+    FULL) before an entry counts as applied and can be compacted out of the
+    journal. start() replays the entries a previous run left unapplied.
+    """
+
+    def __init__(self, db, journal=None, max_batch=500, retry_delay=RETRY_DELAY):
+        self.db = db
+        self.journal = journal
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay
+        self.commits = 0
+        self.events = 0
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._journal_queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stopping.clear()
+        if self.journal is not None:
+            # Replayed before anything new; entries found in the journal may
+            # have been committed already, the writer thread checks them
+            # against the database
+            replay = self.journal.open()
+            if self.journal.last_seq == 0:
+                # A new journal file continues the numbers of a lost one
+                self.journal.last_seq = self.journal.applied_seq = self.db.journal_seq(self.journal.name)
+            if replay:
+                self._queue.put(("replay", replay))
+            self._threads.append(threading.Thread(target=self._run_journal, name="scan-journal", daemon=True))
+        self._threads.append(threading.Thread(target=self._run, name="db-writer", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Write what has been submitted; journaled scans the database does not
+        take right away are left in the journal for the next start."""
+        if self._threads:
+            self._stopping.set()
+            (self._queue if self.journal is None else self._journal_queue).put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+            if self.journal is not None:
+                if not self.journal.pending():
+                    self._compact(force=True)
+                self.journal.close()
+
+    def submit(self, event):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._put(([event], future, loop))
+        return future
+
+    def write(self, events, timeout=None):
+        """Commit ("pickup" | "return", user, house, ts) events, or with a
+        journal, append them to it, blocking until done."""
+        future = concurrent.futures.Future()
+        self._put((list(events), future, None))
+        return future.result(timeout)
+
+    def pending(self):
+        """Journaled scans not in the database yet."""
+        return 0 if self.journal is None else self.journal.pending()
+
+    def _put(self, item):
+        (self._queue if self.journal is None else self._journal_queue).put(item)
+
+    def _take(self, source, first):
+        # ``first`` and whatever else has queued up, None ends the batch
+        batch = [first]
+        while len(batch) < self.max_batch:
+            try:
+                item = source.get_nowait()
+            except queue.Empty:
+                return batch, False
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run_journal(self):
+        stopping = False
+        while not stopping:
+            item = self._journal_queue.get()
+            if item is None:
+                break
+            batch, stopping = self._take(self._journal_queue, item)
+            start = time.perf_counter()
+            try:
+                seqs = self.journal.append([events for events, _, _ in batch])
+                error = None
+            except Exception as e:
+                seqs, error = [], e
+            observe("journal.append", time.perf_counter() - start)
+            if seqs:
+                self._queue.put(("journal", [(seq, events) for seq, (events, _, _) in zip(seqs, batch)], start))
+            for _, future, loop in batch:
+                if loop is None:
+                    _resolve(future, error)
+                else:
+                    loop.call_soon_threadsafe(_resolve, future, error)
+        self._queue.put(None)
+
+    def _run(self):
+        if self.journal is None:
+            self._run_direct()
+        else:
+            self._run_journaled()
+        self.db.close()
+
+    def _run_direct(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch, stopping = self._take(self._queue, item)
+            events = [event for submitted, _, _ in batch for event in submitted]
+            try:
+                self.db.record_scans(events)
+                error = None
+            except Exception as e:
+                error = e
+            self.commits += 1
+            self.events += len(events)
+            for _, future, loop in batch:
+                if loop is None:
+                    _resolve(future, error)
+                else:
+                    loop.call_soon_threadsafe(_resolve, future, error)
+
+    def _run_journaled(self):
+        # Applied entries are dropped from the journal when it is compacted,
+        # so they must be on disk once committed: with the connection's
+        # default synchronous = NORMAL a WAL commit is only durable after the
+        # next checkpoint
+        self.db.conn.execute("PRAGMA synchronous = FULL")
+        entries = []
+        journaled = None
+        stopping = False
+        while True:
+            if not entries:
+                if stopping:
+                    break
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch, stopping = self._take(self._queue, item)
+                for kind, *rest in batch:
+                    if kind == "replay":
+                        entries.extend(self._unapplied(rest[0]))
+                    else:
+                        entries.extend(rest[0])
+                        journaled = rest[1] if journaled is None else journaled
+                if not entries:
+                    continue
+            # Everything taken so far goes in one transaction, also when
+            # more has queued up while the database was locked
+            entries = self._apply(entries)
+            if not entries:
+                if journaled is not None:
+                    observe("journal.to_commit", time.perf_counter() - journaled)
+                journaled = None
+                self._compact()
+            elif self._stopping.wait(self.retry_delay):
+                # Left in the journal for the next start
+                break
+            else:
+                more, stopping = self._take_journaled(stopping)
+                entries.extend(more)
+
+    def _take_journaled(self, stopping):
+        entries = []
+        while not stopping and len(entries) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+            else:
+                entries.extend(item[1])
+        return entries, stopping
+
+    def _unapplied(self, entries):
+        while True:
+            try:
+                seq = self.db.journal_seq(self.journal.name)
+                break
+            except sqlite3.Error as e:
+                self._failed(e)
+                if self._stopping.wait(self.retry_delay):
+                    return []
+        if self._durable():
+            self.journal.applied(seq)
+        # Otherwise the entries up to seq stay in the journal until the next
+        # commit, which syncs the whole WAL, marks a later entry applied
+        return [(s, events) for s, events in entries if s > seq]
+
+    def _durable(self):
+        # Entries found committed at startup may have been committed by a
+        # previous run with synchronous = NORMAL and not be on disk yet
+        try:
+            busy, _, _ = self.db.conn.execute("PRAGMA wal_checkpoint(FULL)").fetchone()
+        except sqlite3.Error as e:
+            log.warning("database not checkpointed: %s", e)
+            return False
+        return not busy
+
+    def _apply(self, entries):
+        """Commit ``entries`` in one transaction; returns those still to be
+        applied, empty once they all are."""
+        events = [event for _, submitted in entries for event in submitted]
+        try:
+            self.db.record_scans(events, journal=(self.journal.name, entries[-1][0]))
+        except Exception as e:
+            if _transient(e):
+                self._failed(e)
+                return entries
+            # One bad entry must not hold up the scans after it
+            return self._apply_each(entries)
+        self.last_error = None
+        self.commits += 1
+        self.events += len(events)
+        self.journal.applied(entries[-1][0])
+        return []
+
+    def _apply_each(self, entries):
+        # Entries the database refuses for good are moved to the journal's
+        # rejects file, their sequence number is committed like any other
+        for i, (seq, events) in enumerate(entries):
+            try:
+                try:
+                    self.db.record_scans(events, journal=(self.journal.name, seq))
+                    self.commits += 1
+                    self.events += len(events)
+                except Exception as e:
+                    if _transient(e):
+                        raise
+                    log.error("journal entry %d rejected, written to %s.rejects: %s", seq, self.journal.path, e)
+                    self.journal.reject(seq, events, e)
+                    self.db.record_scans([], journal=(self.journal.name, seq))
+            except (sqlite3.Error, OSError) as e:
+                self._failed(e)
+                return entries[i:]
+            self.journal.applied(seq)
+        self.last_error = None
+        return []
+
+    def _failed(self, error):
+        if self.last_error is None:
+            log.warning("journaled scans not written, retrying: %s", error)
+        self.last_error = error
+
+    def _compact(self, force=False):
+        size = self.journal.size()
+        if force or size > COMPACT_BYTES or (size > COMPACT_IDLE_BYTES and not self.journal.pending()):
+            try:
+                self.journal.compact()
+            except OSError as e:
+                log.warning("scan journal not compacted: %s", e)
+
+
+def _transient(error):
+    return (isinstance(error, sqlite3.OperationalError)
+            and (error.sqlite_errorcode & 0xff) in TRANSIENT_ERRORS)
+
+
+def _resolve(future, error):
+    if future.cancelled():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
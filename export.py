@@ -0,0 +1,83 @@
+import csv
+import os
+import threading
+
+
+class CsvExport:
+    """Streams a query result to a CSV file on a background thread.
+
+    ``query`` and ``count`` are called on the worker thread, so they must use
+    a connection of that thread (database.Database does this by itself). Rows
+    are fetched and written in chunks, memory use does not grow with the size
+    of the result. ``written``, ``total``, ``done`` and ``error`` can be read
+    from the GUI thread to report progress.
+    """
+
+    def __init__(self, query, headers, path, format_row=None, count=None,
+                 compress=False, chunk_size=1000):
+        self.query = query
+        self.headers = headers
+        self.path = path + ".gz" if compress and not path.endswith(".gz") else path
+        self.format_row = format_row
+        self.count = count
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.written = 0
+        self.total = None
+        self.done = False
+        self.cancelled = False
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="csv-export", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        """Export in the calling thread, raising any error."""
+        self._run()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _open(self):
+        if self.compress:
+            import gzip
+            return gzip.open(self.path, "wt", compresslevel=6, newline="", encoding="utf-8")
+        return open(self.path, "w", newline="", encoding="utf-8")
+
+    def _run(self):
+        try:
+            if self.count is not None:
+                self.total = self.count()
+            cursor = self.query()
+            with self._open() as f:
+                writer = csv.writer(f)
+                writer.writerow(self.headers)
+                while not self._cancel.is_set():
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        break
+                    if self.format_row is not None:
+                        rows = [self.format_row(row) for row in rows]
+                    writer.writerows(rows)
+                    self.written += len(rows)
+            cursor.close()
+            if self._cancel.is_set():
+                self.cancelled = True
+                os.remove(self.path)
+        except Exception as e:
+            self.error = e
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        finally:
+            self.done = True
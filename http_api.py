@@ -0,0 +1,342 @@
+"""Local HTTP/JSON API for kiosks and other programs.
+
+Usage: python http_api.py [--db PATH] [--host 127.0.0.1] [--port 8080] [--workers 8]
+
+    GET  /users                      registered users
+    GET  /houses                     registered houses
+    GET  /loans?user=&house=         keys currently out, newest first
+    GET  /history?start=&end=&user=&house=&limit=&offset=
+                                     pickups and returns, newest first
+    GET  /stats                      the dashboard figures
+    POST /pickups  {"user": TOKEN, "houses": [TOKEN, ...]}
+    POST /returns  {"user": TOKEN, "house": TOKEN}
+
+Requests are handled on a bounded pool of worker threads; every worker reads
+through its own connection (Database keeps one per thread). Pickups and
+returns are validated on the worker and committed by a single
+DatabaseWriter thread. GET responses carry an ETag derived from the data
+they depend on, so a request with a matching If-None-Match is answered with
+304 before any query runs. When every worker is busy and the backlog is
+full, new requests get 503 at once instead of queueing without bound.
+"""
+import argparse
+import collections
+import hashlib
+import http.server
+import itertools
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+from database import DB_PATH, Database
+from db_writer import DatabaseWriter
+from instrumentation import observe
+from kms_core import KeyManagement, ValidationError
+from pickup_session import utc_timestamp
+
+# Users and houses changed by other processes are looked for at most this often
+TOKEN_INDEX_CHECK_INTERVAL = 2.0
+HISTORY_LIMIT = 100
+HISTORY_MAX_LIMIT = 1000
+MAX_BODY = 64 * 1024
+CACHED_RESPONSES = 128
+
+
+class PooledHTTPServer(http.server.HTTPServer):
+    """HTTPServer that hands connections to a fixed pool of worker threads."""
+
+    # The default listen backlog of 5 drops connections under load, clients
+    # then wait a full second for the SYN to be retransmitted
+    request_queue_size = 128
+
+    def __init__(self, address, handler, workers=8, backlog=32):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix="api")
+        self.slots = threading.BoundedSemaphore(workers + backlog)
+
+    def process_request(self, request, client_address):
+        if not self.slots.acquire(blocking=False):
+            body = json.dumps({"error": "Server ausgelastet."}).encode()
+            try:
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+                                b"Retry-After: 1\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class ApiHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "Sentinela"
+    # A client that does not send its request within this many seconds is dropped
+    timeout = 10
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        route = GET_ROUTES.get(url.path)
+        if route is None:
+            self.send_json(404, {"error": "Unbekannter Pfad."})
+            return
+        api = self.server.api
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            etag = api.etag(url.path, params)
+            if etag in self.headers.get("If-None-Match", "").replace(" ", "").split(","):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+            else:
+                body = api.response(url.path, params, etag, lambda: route(api, params))
+                self.send_body(200, body, etag)
+        except ValidationError as e:
+            self.send_json(400, {"error": str(e)})
+        except sqlite3.Error as e:
+            self.send_json(500, {"error": f"Datenbankfehler: {e}"})
+        observe(f"api.GET {url.path}", time.perf_counter() - start)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        path = urlsplit(self.path).path
+        route = POST_ROUTES.get(path)
+        if route is None:
+            self.send_json(404, {"error": "Unbekannter Pfad."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length > MAX_BODY:
+                raise ValueError("request too large")
+            data = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(data, dict):
+                raise ValueError("expected an object")
+        except ValueError:
+            self.send_json(400, {"error": "Ungültiges JSON."})
+            return
+        try:
+            self.send_json(201, route(self.server.api, data))
+        except ValidationError as e:
+            self.send_json(422, {"error": str(e)})
+        except sqlite3.Error as e:
+            self.send_json(500, {"error": f"Datenbankfehler: {e}"})
+        observe(f"api.POST {path}", time.perf_counter() - start)
+
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+    def send_body(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.api.verbose:
+            super().log_message(format, *args)
+
+
+class ApiServer:
+    def __init__(self, db, host="127.0.0.1", port=8080, workers=8, backlog=32, verbose=False):
+        self.db = db
+        self.kms = KeyManagement(db)
+        self.verbose = verbose
+        # The writer thread gets a connection of its own from ``db``; pickups
+        # and returns written with it keep db's overdue monitor current
+        self.writer = DatabaseWriter(db)
+        self.httpd = PooledHTTPServer((host, port), ApiHandler, workers, backlog)
+        self.httpd.api = self
+        self.port = self.httpd.server_address[1]
+        # ETags of a restarted server never match ones handed out before
+        self._boot = f"{time.time_ns():x}"
+        self._tokens_checked = 0.0
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Serve in a background thread."""
+        self.db.tokens.load()
+        self._tokens_checked = time.monotonic()
+        self.writer.start()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="api-server", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.writer.stop()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def serve_forever(self):
+        self.start()
+        try:
+            self._thread.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    # Caching
+
+    def check_tokens(self):
+        now = time.monotonic()
+        if now - self._tokens_checked >= TOKEN_INDEX_CHECK_INTERVAL:
+            self._tokens_checked = now
+            self.db.tokens.check()
+
+    def etag(self, path, params):
+        """ETag of a GET response, from the state of the data it is built from."""
+        self.check_tokens()
+        state = [self._boot, path, sorted(params.items()), self.db.tokens.version]
+        if path not in ("/users", "/houses"):
+            state += [self.db.last_pickup_id(), self.db.last_return_id()]
+        if path == "/stats":
+            # Keys become overdue without any write
+            state.append(int(time.time() // 60))
+        return '"' + hashlib.sha1(repr(state).encode()).hexdigest()[:20] + '"'
+
+    def response(self, path, params, etag, build):
+        """The encoded response for ``etag``, built only if it is not cached."""
+        key = (path, tuple(sorted(params.items())))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == etag:
+                self._cache.move_to_end(key)
+                return cached[1]
+        body = json.dumps(build(), ensure_ascii=False).encode("utf-8")
+        with self._lock:
+            self._cache[key] = (etag, body)
+            self._cache.move_to_end(key)
+            while len(self._cache) > CACHED_RESPONSES:
+                self._cache.popitem(last=False)
+        return body
+
+    # Endpoints
+
+    def users(self, params):
+        return [{"id": user_id, "name": name, "rfid_token": token}
+                for user_id, name, token in self.db.list_users()]
+
+    def houses(self, params):
+        return [{"id": house_id, "name": name, "rfid_token": token}
+                for house_id, name, token in self.db.list_houses()]
+
+    def loans(self, params):
+        filters = report_filters(params, ("user", "house"))
+        return [{"user": user, "house": house, "pickup": pickup}
+                for user, house, pickup in self.db.non_returned(**filters)]
+
+    def history(self, params):
+        filters = report_filters(params, ("start", "end", "user", "house"))
+        limit = min(int_param(params, "limit", HISTORY_LIMIT), HISTORY_MAX_LIMIT)
+        offset = int_param(params, "offset", 0)
+        rows = itertools.islice(self.db.assignments(**filters), offset, offset + limit)
+        return [{"user": user, "house": house, "pickup": pickup, "return": returned}
+                for user, house, pickup, returned in rows]
+
+    def stats(self, params):
+        stats = self.db.dashboard_stats()
+        stats["busiest_houses"] = [{"house": name, "pickups": pickups, "out": out}
+                                   for name, pickups, out in stats["busiest_houses"]]
+        return stats
+
+    def pickup(self, data):
+        user = data.get("user")
+        houses = data.get("houses")
+        if not isinstance(user, str) or not isinstance(houses, list) or not houses \
+                or not all(isinstance(house, str) for house in houses):
+            raise ValidationError('Erwartet {"user": TOKEN, "houses": [TOKEN, ...]}.')
+        self.check_tokens()
+        tokens = self.kms.validate_pickup(user, houses)
+        timestamp = utc_timestamp()
+        self.writer.write([("pickup", user, token, timestamp) for token in tokens])
+        return {"recorded": len(tokens)}
+
+    def return_key(self, data):
+        user = data.get("user")
+        house = data.get("house")
+        if not isinstance(user, str) or not isinstance(house, str):
+            raise ValidationError('Erwartet {"user": TOKEN, "house": TOKEN}.')
+        self.check_tokens()
+        self.kms.validate_return(user, house)
+        self.writer.write([("return", user, house, utc_timestamp())])
+        return {"recorded": 1}
+
+
+GET_ROUTES = {
+    "/users": ApiServer.users,
+    "/houses": ApiServer.houses,
+    "/loans": ApiServer.loans,
+    "/history": ApiServer.history,
+    "/stats": ApiServer.stats,
+}
+POST_ROUTES = {
+    "/pickups": ApiServer.pickup,
+    "/returns": ApiServer.return_key,
+}
+
+
+def report_filters(params, names):
+    filters = {name: params[name] for name in names if params.get(name)}
+    for name in ("start", "end"):
+        if name in filters:
+            try:
+                datetime.strptime(filters[name], "%Y-%m-%d")
+            except ValueError:
+                raise ValidationError(f"{name}: Datum bitte im Format JJJJ-MM-TT angeben.")
+    return filters
+
+
+def int_param(params, name, default):
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        raise ValidationError(f"{name}: ganze Zahl erwartet.")
+    if value < 0:
+        raise ValidationError(f"{name}: darf nicht negativ sein.")
+    return value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP/JSON-Schnittstelle der Schlüsselverwaltung")
+    parser.add_argument("--db", default=DB_PATH, help="Datenbankdatei")
+    parser.add_argument("--host", default="127.0.0.1", help="Adresse (Standard: nur lokal)")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=8, help="Anzahl Worker-Threads")
+    parser.add_argument("--backlog", type=int, default=32, help="wartende Anfragen, danach 503")
+    parser.add_argument("--verbose", action="store_true", help="jede Anfrage protokollieren")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    db.create_schema()
+    server = ApiServer(db, args.host, args.port, args.workers, args.backlog, args.verbose)
+    print(f"Schnittstelle auf http://{args.host}:{server.port}/", flush=True)
+    server.serve_forever()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
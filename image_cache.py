@@ -0,0 +1,76 @@
+import base64
+import os
+import tkinter as tk
+
+CACHE_DIR = "image_cache"
+
+
+class ImageCache:
+    """Decoded and resized images, kept alive across view switches.
+
+    ``read(path, size)`` does the file work, decoding and resizing without
+    touching Tk, so it can run on a worker thread; ``photo()`` then makes
+    the PhotoImage of its result on the Tk thread. The PhotoImage is kept
+    until the source file's mtime changes, read() skips the file while it
+    is current. A pre-scaled PNG is written to ``cache_dir`` so later
+    launches load it directly instead of resampling the original again.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        # (path, size) -> (source mtime_ns, PhotoImage)
+        self._images = {}
+
+    def _scaled_path(self, path, size, mtime_ns):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.cache_dir, f"{name}-{size[0]}x{size[1]}-{mtime_ns}.png")
+
+    def read(self, path, size):
+        """The scaled image as (path, size, mtime_ns, PNG bytes, PIL image or
+        None if the PhotoImage made of it is current)."""
+        size = tuple(size)
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = self._images.get((path, size))
+        if cached is not None and cached[0] == mtime_ns:
+            return path, size, mtime_ns, None
+        scaled = self._scaled_path(path, size, mtime_ns)
+        if not os.path.exists(scaled):
+            from PIL import Image
+            image = Image.open(path)
+            image = image.resize(size, Image.Resampling.LANCZOS)
+            self._store(image, path, size, scaled)
+            if not os.path.exists(scaled):
+                return path, size, mtime_ns, image
+        with open(scaled, "rb") as f:
+            return path, size, mtime_ns, f.read()
+
+    def photo(self, image):
+        """PhotoImage of a read() result, on the Tk thread."""
+        path, size, mtime_ns, data = image
+        cached = self._images.get((path, size))
+        # Without data, read() found the PhotoImage current; one made of a
+        # newer file since is as good
+        if cached is not None and (cached[0] == mtime_ns or data is None):
+            return cached[1]
+        if isinstance(data, bytes):
+            photo = tk.PhotoImage(data=base64.b64encode(data))
+        else:
+            from PIL import ImageTk
+            photo = ImageTk.PhotoImage(data)
+        self._images[(path, size)] = (mtime_ns, photo)
+        return photo
+
+    def _store(self, image, path, size, scaled):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Drop copies made from older versions of the source
+            prefix = os.path.basename(scaled).rsplit("-", 1)[0] + "-"
+            for entry in os.listdir(self.cache_dir):
+                if entry.startswith(prefix) and entry.endswith(".png"):
+                    os.remove(os.path.join(self.cache_dir, entry))
+            tmp = scaled + ".tmp"
+            image.save(tmp, format="PNG")
+            os.replace(tmp, scaled)
+        except OSError:
+            # The cache is only an optimization
+            pass
@@ -0,0 +1,254 @@
+"""Low-overhead timers, rolling latency histograms and slow query logging.
+
+Timings are recorded under dotted names ("db.user_name", "view.dashboard",
+"scan.to_journal") with ``timed`` (decorator or context manager) or
+``observe``. Every name has a Histogram with fixed log-spaced buckets for
+the totals and a ring of the latest samples for percentiles. The whole
+registry can be written in Prometheus text format with ``dump_prometheus``.
+
+Database connections opened with ``TimedConnection`` log statements slower
+than ``metrics.slow_query_ms`` (KMS_SLOW_QUERY_MS, default 100) together
+with their EXPLAIN QUERY PLAN to the "kms.slow_query" logger. LagProbe
+records how long the Tk main loop is kept from handling events.
+"""
+import bisect
+import collections
+import functools
+import os
+import sqlite3
+import threading
+import time
+
+# Bucket upper bounds in seconds, 50 us to 10 s
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WINDOW = 1024
+# Only statements that have a useful query plan are checked for slowness
+EXPLAINED = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+SLOW_QUERY_MS = float(os.environ.get("KMS_SLOW_QUERY_MS", "100"))
+
+
+class Histogram:
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = collections.deque(maxlen=WINDOW)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.recent.append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (len(BUCKETS) + 1)
+            self.count = 0
+            self.sum = 0.0
+            self.max = 0.0
+            self.recent.clear()
+
+    def percentiles(self, *ps):
+        """Percentiles (0-100) of the latest WINDOW samples, in seconds."""
+        with self._lock:
+            samples = sorted(self.recent)
+        if not samples:
+            return tuple(None for _ in ps)
+        return tuple(samples[min(len(samples) - 1, int(len(samples) * p / 100))] for p in ps)
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.slow_queries = collections.deque(maxlen=50)
+        self.slow_query_ms = SLOW_QUERY_MS
+        self._lock = threading.Lock()
+        self._slow_logged = {}
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram(name))
+        return histogram
+
+    def observe(self, name, seconds):
+        self.histogram(name).observe(seconds)
+
+    def reset(self):
+        # Cleared in place: timed functions and instrument()ed methods hold
+        # on to their Histogram
+        with self._lock:
+            for histogram in self.histograms.values():
+                histogram.reset()
+            self.slow_queries.clear()
+
+    def record_slow_query(self, conn, sql, params, seconds):
+        plan = explain(conn, sql, params)
+        self.slow_queries.append((time.time(), seconds, sql, plan))
+        # Log each statement at most once a minute
+        now = time.monotonic()
+        key = " ".join(sql.split())
+        if now - self._slow_logged.get(key, -60.0) >= 60.0:
+            self._slow_logged[key] = now
+            # logging is only loaded once something is slow
+            import logging
+            logging.getLogger("kms.slow_query").warning("slow query (%.1f ms): %s\n%s", seconds * 1000, key, plan)
+
+
+metrics = Registry()
+
+
+def observe(name, seconds):
+    metrics.histogram(name).observe(seconds)
+
+
+class timed:
+    """Time a block (``with timed("name"):``) or a function (``@timed("name")``)."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        metrics.histogram(self.name).observe(time.perf_counter() - self.start)
+        return False
+
+    def __call__(self, fn):
+        histogram = metrics.histogram(self.name)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+
+
+def instrument(cls, prefix, skip=()):
+    """Wrap every public method of ``cls`` but ``skip`` with a timer named prefix.method."""
+    for name, value in list(vars(cls).items()):
+        if name.startswith("_") or name in skip or not callable(value) \
+                or isinstance(value, (staticmethod, classmethod)):
+            continue
+        setattr(cls, name, timed(f"{prefix}.{name}")(value))
+    return cls
+
+
+def explain(conn, sql, params=()):
+    try:
+        rows = sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error as e:
+        return f"(no plan: {e})"
+    return "\n".join(f"  {row[-1]}" for row in rows)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection that times every statement and logs slow ones.
+
+    Only the execute step is timed; rows fetched later from a returned
+    cursor are not included.
+    """
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        cursor = super().execute(sql, params)
+        elapsed = time.perf_counter() - start
+        metrics.histogram("sql.execute").observe(elapsed)
+        if elapsed * 1000 >= metrics.slow_query_ms and sql.lstrip()[:7].upper().startswith(EXPLAINED):
+            metrics.record_slow_query(self, sql, params, elapsed)
+        return cursor
+
+    def executemany(self, sql, seq_of_params):
+        start = time.perf_counter()
+        cursor = super().executemany(sql, seq_of_params)
+        metrics.histogram("sql.executemany").observe(time.perf_counter() - start)
+        return cursor
+
+
+class LagProbe:
+    """Measures how long the Tk main loop is blocked.
+
+    Schedules itself with ``root.after`` every ``interval`` ms and records
+    how much later than that it actually ran as "ui.lag": while a handler
+    runs on the main loop, nothing is repainted and no event is handled.
+    Lags of ``stall_ms`` or more are counted as stalls, ``stalled`` is their
+    total in seconds.
+    """
+
+    def __init__(self, interval=100, stall_ms=50, name="ui.lag"):
+        self.interval = interval
+        self.stall = stall_ms / 1000
+        self.name = name
+        self.stalls = 0
+        self.stalled = 0.0
+        self._root = None
+        self._job = None
+        self._expected = None
+
+    def start(self, root):
+        self._root = root
+        self._schedule()
+        return self
+
+    def stop(self):
+        if self._job is not None:
+            self._root.after_cancel(self._job)
+            self._job = None
+
+    def _schedule(self):
+        self._expected = time.perf_counter() + self.interval / 1000
+        self._job = self._root.after(self.interval, self._tick)
+
+    def _tick(self):
+        lag = max(0.0, time.perf_counter() - self._expected)
+        metrics.histogram(self.name).observe(lag)
+        if lag >= self.stall:
+            self.stalls += 1
+            self.stalled += lag
+        self._schedule()
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(registry=metrics):
+    lines = [
+        "# HELP kms_duration_seconds Duration of instrumented operations.",
+        "# TYPE kms_duration_seconds histogram",
+    ]
+    for name in sorted(registry.histograms):
+        histogram = registry.histograms[name]
+        op = _label(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f'kms_duration_seconds_bucket{{op="{op}",le="{bound:g}"}} {cumulative}')
+        lines.append(f'kms_duration_seconds_bucket{{op="{op}",le="+Inf"}} {histogram.count}')
+        lines.append(f'kms_duration_seconds_sum{{op="{op}"}} {histogram.sum:.9f}')
+        lines.append(f'kms_duration_seconds_count{{op="{op}"}} {histogram.count}')
+    return "\n".join(lines) + "\n"
+
+
+def dump_prometheus(path, registry=metrics):
+    """Write the registry in Prometheus text format, e.g. for node_exporter's textfile collector."""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(registry))
+    os.replace(tmp, path)
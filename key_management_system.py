@@ -1,216 +1,306 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
+import logging
+import os
+import queue
 import sqlite3
-import serial
+import time
 from datetime import datetime
-import csv
-from PIL import Image, ImageTk
+from export import CsvExport
+from image_cache import ImageCache
+from instrumentation import LagProbe, dump_prometheus, metrics, observe, timed
+from rfid_reader import RfidReader, ScanHandlerError
+from view_manager import View, ViewManager
+from virtual_tree import VirtualTreeview
+from pickup_session import PickupSession, discard_staged, load_staged, utc_timestamp
+from task_runner import TaskRunner
+from db_writer import DatabaseWriter
+from scan_journal import ScanJournal
+from backup import BACKUP_INTERVAL_HOURS, BackupScheduler, Backups
+from kms_core import KeyManagement, ValidationError
+from uid import uid_text
+
+# A running pickup session is committed after this many ms without a scan
+PICKUP_IDLE_TIMEOUT_MS = 60000
+# The assignments view checks for new pickups and returns this often
+ASSIGNMENTS_REFRESH_MS = 5000
+# How often changes to users and houses by other processes are looked for
+TOKEN_INDEX_CHECK_MS = 2000
+# Loans the overdue monitor thread reported are shown this often
+OVERDUE_ALERT_CHECK_MS = 1000
+OVERDUE_ALERT_LINES = 10
+# The search box searches this long after the last keystroke
+SEARCH_DELAY_MS = 150
+SEARCH_KIND_LABELS = {"user": "Benutzer", "house": "Haus"}
+# The diagnostics view updates its figures this often
+DIAGNOSTICS_REFRESH_MS = 2000
+# With KMS_METRICS_FILE set the timings are written there in Prometheus text format
+METRICS_FILE = os.environ.get("KMS_METRICS_FILE")
+METRICS_DUMP_MS = 15000
+# With KMS_HTTP_PORT set the HTTP/JSON API (http_api.py) runs inside the GUI
+HTTP_PORT = os.environ.get("KMS_HTTP_PORT")
+LOGO_PATH = "logo1.png"
+LOGO_SIZE = (300, 350)
+
+log = logging.getLogger("kms.gui")
+
+images = ImageCache()
 
 def initialize_database():
-    conn = sqlite3.connect("key_management.db")
-    cursor = conn.cursor()
-    cursor.execute("PRAGMA foreign_keys = ON")
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            rfid_token TEXT UNIQUE NOT NULL
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS keys (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            rfid_token TEXT UNIQUE NOT NULL,
-            status TEXT NOT NULL,
-            FOREIGN KEY(rfid_token) REFERENCES users(rfid_token)
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS houses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            house_name TEXT NOT NULL,
-            rfid_token TEXT UNIQUE NOT NULL,
-            FOREIGN KEY(rfid_token) REFERENCES keys(rfid_token)
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS key_pickups (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_rfid TEXT NOT NULL,
-            house_rfid TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_rfid) REFERENCES users (rfid_token),
-            FOREIGN KEY (house_rfid) REFERENCES houses (rfid_token)
-        )
-    """)
-
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS key_returns (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_rfid TEXT NOT NULL,
-            house_rfid TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            FOREIGN KEY (user_rfid) REFERENCES users (rfid_token),
-            FOREIGN KEY (house_rfid) REFERENCES houses (rfid_token)
-        )
-    """)
-    
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pickups_user ON key_pickups(user_rfid)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pickups_house ON key_pickups(house_rfid)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_returns_user ON key_returns(user_rfid)")
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_returns_house ON key_returns(house_rfid)")
+    run_task(db.create_schema, label="Datenbank initialisieren", on_done=lambda _: messagebox.showinfo(
+        "Erfolg", "Datenbank initialisiert oder bereits vorhanden."))
     
-    conn.commit()
-    conn.close()
-    messagebox.showinfo("Erfolg", "Datenbank initialisiert oder bereits vorhanden.")
-    
-
-def dashboard_view():
-    clear_right_frame()
 
-    tk.Label(right_frame, text="🔑 Sentinela", font=("Arial", 20, "bold")).pack(pady=20)
+def dashboard_view(frame):
+    tk.Label(frame, text="🔑 Sentinela", font=("Arial", 20, "bold")).pack(pady=20)
 
-    now = datetime.now().strftime("%d.%m.%Y %H:%M")
-    tk.Label(right_frame, text=f"📅 Aktuelles Datum und Uhrzeit: {now}", font=("Arial", 12)).pack(pady=5)
+    now_label = tk.Label(frame, font=("Arial", 12))
+    now_label.pack(pady=5)
 
-    try:
-        conn = sqlite3.connect("key_management.db")
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT COUNT(*) FROM users")
-        user_count = cursor.fetchone()[0]
-        tk.Label(right_frame, text=f"👥 Anzahl Benutzer: {user_count}", font=("Arial", 12)).pack(pady=5)
-
-        cursor.execute("""
-            SELECT COUNT(*) FROM key_pickups
-            WHERE DATE(timestamp) = DATE('now', 'localtime')
-        """)
-        today_pickups = cursor.fetchone()[0]
-        tk.Label(right_frame, text=f"📦 Abholungen heute: {today_pickups}", font=("Arial", 12)).pack(pady=5)
-
-        conn.close()
-    except Exception as e:
-        tk.Label(right_frame, text=f"Fehler beim Laden der Daten: {e}", fg="red").pack(pady=5)
+    stat_labels = {}
+    for key in ("users", "pickups_today", "returns_today", "keys_out", "overdue", "busiest_houses"):
+        stat_labels[key] = tk.Label(frame, font=("Arial", 12), wraplength=500)
+        stat_labels[key].pack(pady=5)
+    error_label = tk.Label(frame, fg="red")
+    error_label.pack(pady=5)
 
-    # Load and display image
-    try:
-        image = Image.open("logo1.png")
-        image = image.resize((300, 350), Image.Resampling.LANCZOS)
-        photo = ImageTk.PhotoImage(image)
-
-        img_label = tk.Label(right_frame, image=photo)
-        img_label.image = photo  # Keep a reference!
-        img_label.pack(pady=20)
-    except Exception as e:
-        tk.Label(right_frame, text=f"Bild konnte nicht geladen werden: {e}", fg="red").pack(pady=5)
-
-def clear_right_frame():
-    for widget in right_frame.winfo_children():
-        widget.destroy()
-
-def read_rfid_as_decimal_string(serial_port="/dev/ttyUSB0", baud_rate=9600):
-    try:        
-        with serial.Serial(serial_port, baud_rate, timeout=5) as ser:
-            while True:
-                line = ser.readline().decode('utf-8').strip()
-                if line.startswith("Card UID:"): 
-                    uid_hex = line.replace("Card UID:", "").strip()
-                    uid_bytes = [int(byte, 16) for byte in uid_hex.split()]
-                    token = ''.join([f"{byte:03d}" for byte in uid_bytes])
-                    return token
-    except serial.SerialException as e:
-        messagebox.showerror("Serial Error", "Fehler beim Lesen des RFID: {e}")
-    except KeyboardInterrupt:
-        return None
+    # The logo is read, decoded and resized on the task worker in on_show
+    img_label = tk.Label(frame)
+    img_label.pack(pady=20)
 
-def add_user_and_key_view():
-    clear_right_frame()
-
-    tk.Label(right_frame, text="Name:").grid(row=0, column=0, sticky="w")
-    name_entry = tk.Entry(right_frame)
+    def show_logo(image):
+        try:
+            photo = images.photo(image)
+        except Exception as e:
+            show_logo_error(e)
+            return
+        if getattr(img_label, "image", None) is not photo:
+            img_label.config(image=photo, text="")
+            img_label.image = photo  # Keep a reference!
+
+    def show_logo_error(e):
+        img_label.config(image="", text=f"Bild konnte nicht geladen werden: {e}", fg="red")
+        img_label.image = None
+
+    loaded_state = None
+
+    def data_state():
+        # Changes with every pickup, return and user change, and once a minute
+        # so that keys becoming overdue are counted
+        return (db.last_pickup_id(), db.last_return_id(), db.tokens.version, int(time.time() // 60))
+
+    def read_stats(shown_state):
+        # On the task worker
+        state = data_state()
+        return state, None if state == shown_state else db.dashboard_stats()
+
+    def on_show():
+        now = datetime.now().strftime("%d.%m.%Y %H:%M")
+        now_label.config(text=f"📅 Aktuelles Datum und Uhrzeit: {now}")
+        # Shows the logo again if its file has changed
+        run_task(images.read, LOGO_PATH, LOGO_SIZE, key="logo", on_done=show_logo, on_error=show_logo_error)
+        run_task(read_stats, loaded_state, key="dashboard", label="Startseite laden", on_done=show_stats,
+                 on_error=lambda e: error_label.config(text=f"Fehler beim Laden der Daten: {e}"))
+
+    def show_stats(result):
+        nonlocal loaded_state
+        state, stats = result
+        if stats is None:
+            return
+        loaded_state = state
+        error_label.config(text="")
+        stat_labels["users"].config(text=f"👥 Anzahl Benutzer: {stats['users']}")
+        stat_labels["pickups_today"].config(text=f"📦 Abholungen heute: {stats['pickups_today']}")
+        stat_labels["returns_today"].config(text=f"↩️ Rückgaben heute: {stats['returns_today']}")
+        stat_labels["keys_out"].config(text=f"🔓 Schlüssel ausgegeben: {stats['keys_out']}")
+        stat_labels["overdue"].config(text=f"⏰ Überfällig: {stats['overdue']}",
+                                      fg="red" if stats['overdue'] else "black")
+        busiest = ", ".join(f"{name} ({pickups})" for name, pickups, _ in stats['busiest_houses'])
+        stat_labels["busiest_houses"].config(text=f"🏠 Meiste Abholungen: {busiest}" if busiest else "")
+
+    return View(on_show=on_show)
+
+def switch_to(name):
+    # Times the switch and, separately, until Tk has laid out and drawn the view
+    start = time.perf_counter()
+    cancel_scan()
+    set_stream_handler(None)
+    with timed(f"view.{name}"):
+        views.show(name)
+    root.after_idle(lambda: observe(f"view.{name}.drawn", time.perf_counter() - start))
+
+# Set up by main(), importing this module opens no window or port
+kms = None
+db = None
+root = None
+right_frame = None
+# Every view is built once into its own frame, see view_manager.py
+views = None
+# Database and file work runs on its worker, see run_task()
+tasks = None
+# Pickups and returns go to the scan journal and from there to the database
+scans = None
+# Writes to the scan journal run on its worker, see run_scan_task()
+scan_tasks = None
+# Online backups on their own thread, see backup.py
+backups = None
+lag_probe = None
+busy_label = None
+# The search box above the menu, its results are shown by search_view()
+search_var = None
+search_job = None
+
+# RFID reader: the port stays open in a background thread, tokens are
+# delivered to whichever view requested a scan via request_scan().
+reader = None
+pending_scan = None
+stream_handler = None
+last_reader_error = None
+
+def request_scan(callback):
+    global pending_scan
+    if not reader.connected and last_reader_error is not None:
+        messagebox.showerror("Serial Error", f"Fehler beim Lesen des RFID: {last_reader_error}")
+        return
+    reader.clear()
+    pending_scan = callback
+
+def cancel_scan():
+    global pending_scan
+    pending_scan = None
+
+def set_stream_handler(callback):
+    # Receives every token that was not requested by a scan button
+    global stream_handler
+    stream_handler = callback
+
+def on_rfid_token(token):
+    global pending_scan
+    callback = pending_scan
+    pending_scan = None
+    if callback is not None:
+        callback(token)
+    elif stream_handler is not None:
+        stream_handler(token)
+
+def on_reader_error(error):
+    # The reader's own errors are shown when a scan is requested, those of
+    # a scan handler right away
+    global last_reader_error
+    if isinstance(error, ScanHandlerError):
+        messagebox.showerror("Fehler", f"Scan konnte nicht verarbeitet werden: {error}")
+    else:
+        last_reader_error = error
+
+def run_task(fn, *args, key=None, label=None, on_done=None, on_error=None):
+    # Runs fn(*args) on the task worker and on_done(result) back on the Tk
+    # thread, so the window keeps repainting while the database works
+    return tasks.submit(fn, *args, key=key, label=label, on_done=on_done,
+                        on_error=on_error or show_task_error)
+
+def run_scan_task(fn, *args, on_done=None, on_error=None):
+    # Like run_task, for the scan journal: a scan waits for the journal's
+    # fsync, never for a list or import queued on the task worker
+    return scan_tasks.submit(fn, *args, on_done=on_done, on_error=on_error or show_task_error)
+
+def show_task_error(error):
+    if isinstance(error, ValidationError):
+        messagebox.showerror("Fehler", str(error))
+    else:
+        messagebox.showerror("Fehler", f"Datenbankfehler: {error}")
+
+def show_busy(active):
+    # Busy indicator below the menu, with the progress a task reports;
+    # background checks without a label are not shown
+    active = [task for task in active if task.label]
+    if not active:
+        busy_label.config(text="")
+        root.config(cursor="")
+        return
+    task = active[0]
+    text = f"⏳ {task.label}"
+    if task.progress is not None:
+        done, total = task.progress
+        text += f" ({done:,}/{total:,})" if total else f" ({done:,})"
+    if len(active) > 1:
+        text += f" +{len(active) - 1}"
+    busy_label.config(text=text)
+    root.config(cursor="watch")
+
+def import_from_file(kind):
+    path = filedialog.askopenfilename(
+        title="Importdatei wählen",
+        filetypes=[("CSV oder JSON", "*.csv *.json"), ("Alle Dateien", "*.*")])
+    if not path:
+        return
+
+    def imported(result):
+        count, rejects, report = result
+        message = f"{count} Einträge importiert."
+        if rejects:
+            message += f"\n{len(rejects)} Zeilen abgelehnt, siehe {report}"
+        messagebox.showinfo("Import", message)
+
+    run_task(kms.import_file, path, kind, label="Import", on_done=imported)
+
+def add_user_and_key_view(frame):
+    tk.Label(frame, text="Name:").grid(row=0, column=0, sticky="w")
+    name_entry = tk.Entry(frame)
     name_entry.grid(row=0, column=1)
 
     rfid_var = tk.StringVar()
 
+    def on_rfid(rfid_token):
+        rfid_var.set(uid_text(rfid_token))
+
     def scan_rfid():
-        rfid_token = read_rfid_as_decimal_string()
-        if rfid_token:
-            rfid_var.set(rfid_token)
+        request_scan(on_rfid)
 
-    tk.Label(right_frame, text="RFID-Token:").grid(row=1, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=rfid_var, state="readonly").grid(row=1, column=1)
-    tk.Button(right_frame, text="RFID scannen", command=scan_rfid).grid(row=1, column=2)
+    tk.Label(frame, text="RFID-Token:").grid(row=1, column=0, sticky="w")
+    tk.Entry(frame, textvariable=rfid_var, state="readonly").grid(row=1, column=1)
+    tk.Button(frame, text="RFID scannen", command=scan_rfid).grid(row=1, column=2)
 
     def clear_inputs():
         name_entry.delete(0, tk.END)
         rfid_var.set("")
 
     def add_user_and_key():
-        name = name_entry.get().strip()
-        token = rfid_var.get().strip()
-        if not name or not token:
-            messagebox.showerror("Error", "Name und RFID-Token sind erforderlich.")
+        def added(_):
             clear_inputs()
-            return
-
-        conn = sqlite3.connect("key_management.db")
-        cursor = conn.cursor()
+            messagebox.showinfo("Success", "Benutzer und Schlüssel erfolgreich hinzugefügt.")
 
-        cursor.execute("SELECT 1 FROM users WHERE rfid_token = ?", (token,))
-        if cursor.fetchone():
-            messagebox.showerror("Error", "Dieses RFID ist bereits einem Benutzer zugewiesen.")
-            conn.close()
+        def failed(error):
+            show_task_error(error)
             clear_inputs()
-            return
 
-        cursor.execute("SELECT 1 FROM users WHERE name = ?", (name,))
-        if cursor.fetchone():
-            messagebox.showerror("Error", "Dieser Name ist bereits registriert.")
-            conn.close()
-            clear_inputs()
-            return
-
-        cursor.execute("INSERT INTO users (name, rfid_token) VALUES (?, ?)", (name, token))
-        cursor.execute("INSERT INTO keys (rfid_token, status) VALUES (?, 'available')", (token,))
-        conn.commit()
-        conn.close()
-
-        clear_inputs()
-        messagebox.showinfo("Success", "Benutzer und Schlüssel erfolgreich hinzugefügt.")
-
-    tk.Button(right_frame, text="Benutzer und Schlüssel hinzufügen", command=add_user_and_key).grid(row=2, columnspan=3, pady=10)
+        run_task(kms.add_user, name_entry.get(), rfid_var.get(), label="Benutzer hinzufügen",
+                 on_done=added, on_error=failed)
 
+    tk.Button(frame, text="Benutzer und Schlüssel hinzufügen", command=add_user_and_key).grid(row=2, columnspan=3, pady=10)
+    tk.Button(frame, text="Aus Datei importieren...", command=lambda: import_from_file("users")).grid(row=3, columnspan=3)
 
 
-def delete_user_and_key_view():
-    clear_right_frame()
 
+def delete_user_and_key_view(frame):
     rfid_var = tk.StringVar()
     name_var = tk.StringVar()
 
+    def on_rfid(rfid_token):
+        rfid_var.set(uid_text(rfid_token))
+        name = db.user_name(rfid_token)
+        if name:
+            name_var.set(name)
+        else:
+            messagebox.showerror("Error", "Kein Benutzer mit diesem RFID gefunden.")
+
     def scan_rfid():
-        rfid_token = read_rfid_as_decimal_string()
-        if rfid_token:
-            rfid_var.set(rfid_token)
-            conn = sqlite3.connect("key_management.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM users WHERE rfid_token = ?", (rfid_token,))
-            user = cursor.fetchone()
-            if user:
-                name_var.set(user[0])
-            else:
-                messagebox.showerror("Error", "Kein Benutzer mit diesem RFID gefunden.")
-            conn.close()
+        request_scan(on_rfid)
 
-    tk.Label(right_frame, text="RFID-Token:").grid(row=0, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=rfid_var, state="readonly").grid(row=0, column=1)
-    tk.Label(right_frame, text="Benutzername:").grid(row=1, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=name_var, state="readonly").grid(row=1, column=1)
-    tk.Button(right_frame, text="RFID scannen", command=scan_rfid).grid(row=1, column=2)
+    tk.Label(frame, text="RFID-Token:").grid(row=0, column=0, sticky="w")
+    tk.Entry(frame, textvariable=rfid_var, state="readonly").grid(row=0, column=1)
+    tk.Label(frame, text="Benutzername:").grid(row=1, column=0, sticky="w")
+    tk.Entry(frame, textvariable=name_var, state="readonly").grid(row=1, column=1)
+    tk.Button(frame, text="RFID scannen", command=scan_rfid).grid(row=1, column=2)
 
     def delete_user_and_key():
         rfid_token = rfid_var.get()
@@ -219,95 +309,62 @@ def delete_user_and_key_view():
             return
         confirm = messagebox.askyesno("Löschung bestätigen", "Möchten Sie diesen Benutzer und seinen Schlüssel wirklich löschen?")
         if confirm:
-            conn = sqlite3.connect("key_management.db")
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM users WHERE rfid_token = ?", (rfid_token,))
-            cursor.execute("DELETE FROM keys WHERE rfid_token = ?", (rfid_token,))
-            conn.commit()
-            conn.close()
-            rfid_var.set("")
-            name_var.set("")
-            messagebox.showinfo("Erfolg", "Benutzer und zugehöriger Schlüssel erfolgreich gelöscht.")
-
-    tk.Button(right_frame, text="Benutzer und Schlüssel löschen", command=delete_user_and_key).grid(row=2, columnspan=3, pady=10)
-
-def add_key_and_house_view():
-    clear_right_frame()
-
-    tk.Label(right_frame, text="Haus:").grid(row=0, column=0, sticky="w")
-    house_entry = tk.Entry(right_frame)
-    house_entry.grid(row=0, column=1)
+            run_task(kms.delete_user, rfid_token, label="Benutzer löschen", on_done=deleted)
 
-    rfid_var = tk.StringVar()
+    def deleted(_):
+        rfid_var.set("")
+        name_var.set("")
+        messagebox.showinfo("Erfolg", "Benutzer und zugehöriger Schlüssel erfolgreich gelöscht.")
 
-    def scan_rfid():
-        rfid_token = read_rfid_as_decimal_string()
-        if rfid_token:
-            rfid_var.set(rfid_token)
+    tk.Button(frame, text="Benutzer und Schlüssel löschen", command=delete_user_and_key).grid(row=2, columnspan=3, pady=10)
 
-    tk.Label(right_frame, text="RFID-Token:").grid(row=1, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=rfid_var, state="readonly").grid(row=1, column=1)
-    tk.Button(right_frame, text="RFID scannen", command=scan_rfid).grid(row=1, column=2)
+def add_key_and_house_view(frame):
+    tk.Label(frame, text="Haus:").grid(row=0, column=0, sticky="w")
+    house_entry = tk.Entry(frame)
+    house_entry.grid(row=0, column=1)
 
-    def add_key_and_house():
-        house = house_entry.get().strip()
-        token = rfid_var.get().strip()
-        if not house or not token:
-            messagebox.showerror("Error", "Haus und RFID-Token sind erforderlich.")
-            return
+    rfid_var = tk.StringVar()
 
-        conn = sqlite3.connect("key_management.db")
-        cursor = conn.cursor()
+    def on_rfid(rfid_token):
+        rfid_var.set(uid_text(rfid_token))
 
-        cursor.execute("SELECT 1 FROM houses WHERE rfid_token = ?", (token,))
-        if cursor.fetchone():
-            messagebox.showerror("Error", "Dieses RFID ist bereits einem Haus zugeordnet.")
-            conn.close()
-            return
+    def scan_rfid():
+        request_scan(on_rfid)
 
-        cursor.execute("SELECT 1 FROM houses WHERE house_name = ?", (house,))
-        if cursor.fetchone():
-            messagebox.showerror("Fehler", "Dieser Hausname existiert bereits.")
-            conn.close()
-            return
+    tk.Label(frame, text="RFID-Token:").grid(row=1, column=0, sticky="w")
+    tk.Entry(frame, textvariable=rfid_var, state="readonly").grid(row=1, column=1)
+    tk.Button(frame, text="RFID scannen", command=scan_rfid).grid(row=1, column=2)
 
-        cursor.execute("INSERT INTO houses (house_name, rfid_token) VALUES (?, ?)", (house, token))
-        cursor.execute("INSERT INTO keys (rfid_token, status) VALUES (?, 'available')", (token,))
-        conn.commit()
-        conn.close()
+    def add_key_and_house():
+        run_task(kms.add_house, house_entry.get(), rfid_var.get(), label="Haus hinzufügen", on_done=added)
 
+    def added(_):
         house_entry.delete(0, tk.END)      # Clear house name
         rfid_var.set("")                   # Clear RFID
         messagebox.showinfo("Erfolg", "Schlüssel und Haus wurden erfolgreich hinzugefügt.")
 
 
-    tk.Button(right_frame, text="Schlüssel und Haus hinzufügen", command=add_key_and_house).grid(row=2, columnspan=3, pady=10)
+    tk.Button(frame, text="Schlüssel und Haus hinzufügen", command=add_key_and_house).grid(row=2, columnspan=3, pady=10)
+    tk.Button(frame, text="Aus Datei importieren...", command=lambda: import_from_file("houses")).grid(row=3, columnspan=3)
 
 
 
-def delete_key_and_house_view():
-    clear_right_frame()
-
+def delete_key_and_house_view(frame):
     rfid_var = tk.StringVar()
     house_var = tk.StringVar()
 
-    def scan_rfid():
-        rfid_token = read_rfid_as_decimal_string()
-        if not rfid_token:
-            messagebox.showerror("Error", "RFID-Token not detected.")
-            return
-        rfid_var.set(rfid_token)
-        conn = sqlite3.connect("key_management.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT house_name FROM houses WHERE rfid_token = ?", (rfid_token,))
-        result = cursor.fetchone()
-        conn.close()
-        if result:
-            house_var.set(result[0])
+    def on_rfid(rfid_token):
+        rfid_var.set(uid_text(rfid_token))
+        house_name = db.house_name(rfid_token)
+        if house_name:
+            house_var.set(house_name)
         else:
             house_var.set("")
             messagebox.showerror("Error", "Kein Haus mit diesem RFID gefunden.")
 
+    def scan_rfid():
+        request_scan(on_rfid)
+
     def delete_key_and_house():
         rfid_token = rfid_var.get()
         house_name = house_var.get()
@@ -319,216 +376,274 @@ def delete_key_and_house_view():
             f"Möchten Sie dieses Haus'{house_name}' und seinen Schlüssel wirklich löschen (RFID: {rfid_token})?"
         )
         if confirm:
-            conn = sqlite3.connect("key_management.db")
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM houses WHERE rfid_token = ?", (rfid_token,))
-            cursor.execute("DELETE FROM keys WHERE rfid_token = ?", (rfid_token,))
-            conn.commit()
-            conn.close()
-            rfid_var.set("")
-            house_var.set("")
-            messagebox.showinfo("Erfolg", "Schlüssel und zugehöriges Haus wurden erfolgreich gelöscht.")
+            run_task(kms.delete_house, rfid_token, label="Haus löschen", on_done=deleted)
 
+    def deleted(_):
+        rfid_var.set("")
+        house_var.set("")
+        messagebox.showinfo("Erfolg", "Schlüssel und zugehöriges Haus wurden erfolgreich gelöscht.")
 
-    tk.Label(right_frame, text="RFID-Token:").grid(row=0, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=rfid_var, state="readonly").grid(row=0, column=1)
 
-    tk.Label(right_frame, text="Hausname:").grid(row=1, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=house_var, state="readonly").grid(row=1, column=1)
+    tk.Label(frame, text="RFID-Token:").grid(row=0, column=0, sticky="w")
+    tk.Entry(frame, textvariable=rfid_var, state="readonly").grid(row=0, column=1)
 
-    tk.Button(right_frame, text="RFID scannen", command=scan_rfid).grid(row=1, column=2, padx=5)
-    tk.Button(right_frame, text="Schlüssel und Haus löschen", command=delete_key_and_house).grid(row=2, columnspan=3, pady=10)
+    tk.Label(frame, text="Hausname:").grid(row=1, column=0, sticky="w")
+    tk.Entry(frame, textvariable=house_var, state="readonly").grid(row=1, column=1)
 
-def view_users_view():
-    clear_right_frame()
+    tk.Button(frame, text="RFID scannen", command=scan_rfid).grid(row=1, column=2, padx=5)
+    tk.Button(frame, text="Schlüssel und Haus löschen", command=delete_key_and_house).grid(row=2, columnspan=3, pady=10)
 
-    tree = ttk.Treeview(right_frame, columns=("ID", "Name", "RFID"), show="headings")
-    tree.heading("ID", text="ID")
-    tree.heading("Name", text="Name")
-    tree.heading("RFID", text="RFID-Token")
-    tree.pack(fill="both", expand=True)
+def reload_on_token_change(tree):
+    # Users and houses are added and deleted through the token index, its
+    # version tells whether the list is stale
+    shown_version = None
 
-    conn = sqlite3.connect("key_management.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name, rfid_token FROM users")
-    for row in cursor.fetchall():
-        tree.insert("", "end", values=row)
-    conn.close()
-    
-def view_houses_view():
-    clear_right_frame()
+    def on_show():
+        nonlocal shown_version
+        if db.tokens.version != shown_version:
+            shown_version = db.tokens.version
+            tree.refresh()
 
-    tree = ttk.Treeview(right_frame, columns=("ID", "House", "RFID"), show="headings")
-    tree.heading("ID", text="ID")
-    tree.heading("House", text="House Name")
-    tree.heading("RFID", text="RFID-Token")
-    tree.pack(fill="both", expand=True)
+    return View(on_show=on_show)
 
-    conn = sqlite3.connect("key_management.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, house_name, rfid_token FROM houses")
-    for row in cursor.fetchall():
-        tree.insert("", "end", values=row)
-    conn.close()
-
-def pickup_key_view():
-    clear_right_frame()
+def view_users_view(frame):
+    tree = VirtualTreeview(frame, db.users_page_query(),
+                           {"ID": "ID", "Name": "Name", "RFID": "RFID-Token"}, runner=tasks)
+    tree.pack(fill="both", expand=True)
+    return reload_on_token_change(tree)
+    
+def view_houses_view(frame):
+    tree = VirtualTreeview(frame, db.houses_page_query(),
+                           {"ID": "ID", "House": "House Name", "RFID": "RFID-Token"}, runner=tasks)
+    tree.pack(fill="both", expand=True)
+    return reload_on_token_change(tree)
 
+def pickup_key_view(frame):
     user_rfid_var = tk.StringVar()
     user_name_var = tk.StringVar()
-    picked_keys = []
+    status_var = tk.StringVar(value="Benutzerkarte an den Leser halten, danach die Hausschlüssel.")
+    session = None
+    idle_job = None
 
-    tk.Label(right_frame, text="Benutzer-RFID:").grid(row=0, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=user_rfid_var, state="readonly").grid(row=0, column=1)
-    tk.Button(right_frame, text="Benutzer-RFID scannen", command=lambda: scan_user_rfid()).grid(row=0, column=2)
+    tk.Label(frame, text="Benutzer-RFID:").grid(row=0, column=0, sticky="w")
+    tk.Entry(frame, textvariable=user_rfid_var, state="readonly").grid(row=0, column=1)
+    tk.Button(frame, text="Benutzer-RFID scannen", command=lambda: scan_user_rfid()).grid(row=0, column=2)
 
-    tk.Label(right_frame, text="Benutzername:").grid(row=1, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=user_name_var, state="readonly").grid(row=1, column=1)
+    tk.Label(frame, text="Benutzername:").grid(row=1, column=0, sticky="w")
+    tk.Entry(frame, textvariable=user_name_var, state="readonly").grid(row=1, column=1)
 
-    listbox_label = tk.Label(right_frame, text="Abgeholte Schlüssel:")
+    listbox_label = tk.Label(frame, text="Abgeholte Schlüssel:")
     listbox_label.grid(row=2, column=0, sticky="w", pady=(10, 0))
 
-    key_listbox = tk.Listbox(right_frame, width=40, height=8)
+    key_listbox = tk.Listbox(frame, width=40, height=8)
     key_listbox.grid(row=3, column=0, columnspan=3, padx=5, pady=5)
 
+    status_label = tk.Label(frame, textvariable=status_var, anchor="w")
+    status_label.grid(row=5, column=0, columnspan=3, sticky="w")
+
+    def set_status(text, error=False):
+        status_var.set(text)
+        status_label.config(fg="red" if error else "black")
+
+    def start_session(token, name):
+        nonlocal session
+        end_session()
+        session = PickupSession(token, name, scans)
+        user_rfid_var.set(uid_text(token))
+        user_name_var.set(name)
+        key_listbox.delete(0, tk.END)
+        set_status("Benutzer erkannt. Jetzt Hausschlüssel einscannen.")
+
+    def on_user_rfid(token):
+        name = db.user_name(token)
+        if name:
+            start_session(token, name)
+        else:
+            messagebox.showerror("Fehler", "Benutzer nicht gefunden.")
+
     def scan_user_rfid():
-        token = read_rfid_as_decimal_string()
-        if token:
-            user_rfid_var.set(token)
-            conn = sqlite3.connect("key_management.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM users WHERE rfid_token = ?", (token,))
-            result = cursor.fetchone()
-            conn.close()
-            if result:
-                user_name_var.set(result[0])
-                messagebox.showinfo("Bereit", "Benutzer erkannt. Jetzt Hausschlüssel einscannen.")
+        request_scan(on_user_rfid)
+
+    def on_token(token):
+        # Keys stream in without a button press; a user card starts a new session
+        house_name = db.house_name(token)
+        if house_name is None:
+            name = db.user_name(token)
+            if name:
+                start_session(token, name)
             else:
-                messagebox.showerror("Fehler", "Benutzer nicht gefunden.")
-
-    def scan_next_key():
-        token = read_rfid_as_decimal_string()
-        if not token:
+                set_status("Unbekanntes RFID.", error=True)
             return
-        conn = sqlite3.connect("key_management.db")
-        cursor = conn.cursor()
-        cursor.execute("SELECT house_name FROM houses WHERE rfid_token = ?", (token,))
-        result = cursor.fetchone()
-        if result:
-            house_name = result[0]
-            house_rfid = token
-            cursor.execute("INSERT INTO key_pickups (user_rfid, house_rfid) VALUES (?, ?)", 
-                           (user_rfid_var.get(), house_rfid))
-            cursor.execute("UPDATE keys SET status = 'picked_up' WHERE rfid_token = ?", (house_rfid,))
-            conn.commit()
-            picked_keys.append(house_name)
-            key_listbox.insert(tk.END, house_name)
+        if session is None:
+            set_status("Bitte zuerst die Benutzerkarte scannen.", error=True)
+            return
+        if session.contains(token):
+            set_status(f"{house_name} wurde bereits gescannt.")
         else:
-            messagebox.showerror("Fehler", "Haus nicht gefunden.")
-        conn.close()
-
-    def finish_pickup():
+            # Only waits for the scan journal, on the scan worker; the
+            # database is written in the background
+            stage(session, token, house_name, reader.token_time)
+        restart_idle_timer()
+
+    def stage(staging, token, house_name, scanned):
+        def staged(row):
+            staging.writing.discard(token)
+            staging.add(row, house_name)
+            observe("scan.to_journal", time.perf_counter() - scanned)
+            # A session ended meanwhile has its pickups, the desk shows the next one
+            if staging is session:
+                key_listbox.insert(tk.END, house_name)
+                set_status(f"{len(staging.rows)} Schlüssel erfasst.")
+
+        def failed(e):
+            staging.writing.discard(token)
+            set_status(f"Abholung konnte nicht gespeichert werden: {e}", error=True)
+
+        staging.writing.add(token)
+        run_scan_task(staging.write, token, utc_timestamp(), on_done=staged, on_error=failed)
+
+    def restart_idle_timer():
+        nonlocal idle_job
+        if idle_job is not None:
+            root.after_cancel(idle_job)
+        idle_job = root.after(PICKUP_IDLE_TIMEOUT_MS, on_idle_timeout)
+
+    def on_idle_timeout():
+        nonlocal idle_job
+        idle_job = None
+        count = end_session()
+        if count:
+            set_status(f"{count} Abholungen gespeichert, Sitzung beendet.")
+
+    def end_session():
+        # Every key was saved when it was scanned, ending a session only
+        # clears the desk. A session never outlives the view, the next
+        # person at the desk must not add keys to it.
+        nonlocal session, idle_job
+        if idle_job is not None:
+            root.after_cancel(idle_job)
+            idle_job = None
+        count = len(session.rows) if session is not None else 0
+        session = None
         user_rfid_var.set("")
         user_name_var.set("")
-        picked_keys.clear()
         key_listbox.delete(0, tk.END)
+        return count
+
+    def finish_pickup():
+        end_session()
+        set_status("Benutzerkarte an den Leser halten, danach die Hausschlüssel.")
         messagebox.showinfo("Fertig", "Schlüsselabholungen abgeschlossen.")
 
-    # Extra buttons
-    tk.Button(right_frame, text="Hausschlüssel scannen", command=scan_next_key, bg="#f0f0f0").grid(row=4, column=0, pady=10)
-    tk.Button(right_frame, text="Fertig", command=finish_pickup, bg="#d0ffd0").grid(row=4, column=1, pady=10)
+    tk.Button(frame, text="Fertig", command=finish_pickup, bg="#d0ffd0").grid(row=4, column=1, pady=10)
+
+    return View(on_show=lambda: set_stream_handler(on_token), on_hide=end_session)
 
 
-def return_key_view():
-    clear_right_frame()
+def recover_pickup_session():
+    # Left behind by a version that staged pickups in a file of their own
+    session = load_staged()
+    if session is None:
+        return
+    if messagebox.askyesno(
+        "Unterbrochene Abholung",
+        f"Es wurde eine unterbrochene Abholung von {session.user_name} mit "
+        f"{len(session.rows)} Schlüssel(n) gefunden. Jetzt speichern?"
+    ):
+        try:
+            scans.write([("pickup", *row) for row in session.rows])
+        except OSError as e:
+            messagebox.showerror("Fehler", f"Abholungen konnten nicht gespeichert werden: {e}")
+            return
+    discard_staged()
+
 
+def return_key_view(frame):
     user_rfid_var = tk.StringVar()
     user_name_var = tk.StringVar()
     returned_keys = []
 
     # Layout
-    tk.Label(right_frame, text="Benutzer-RFID:").grid(row=0, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=user_rfid_var, state="readonly").grid(row=0, column=1)
-    tk.Button(right_frame, text="Benutzer-RFID scannen", command=lambda: scan_user_rfid()).grid(row=0, column=2)
+    tk.Label(frame, text="Benutzer-RFID:").grid(row=0, column=0, sticky="w")
+    tk.Entry(frame, textvariable=user_rfid_var, state="readonly").grid(row=0, column=1)
+    tk.Button(frame, text="Benutzer-RFID scannen", command=lambda: scan_user_rfid()).grid(row=0, column=2)
 
-    tk.Label(right_frame, text="Benutzername:").grid(row=1, column=0, sticky="w")
-    tk.Entry(right_frame, textvariable=user_name_var, state="readonly").grid(row=1, column=1)
+    tk.Label(frame, text="Benutzername:").grid(row=1, column=0, sticky="w")
+    tk.Entry(frame, textvariable=user_name_var, state="readonly").grid(row=1, column=1)
 
-    listbox_label = tk.Label(right_frame, text="Zurückgegebene Schlüssel:")
+    listbox_label = tk.Label(frame, text="Zurückgegebene Schlüssel:")
     listbox_label.grid(row=2, column=0, sticky="w", pady=(10, 0))
 
-    key_listbox = tk.Listbox(right_frame, width=40, height=8)
+    key_listbox = tk.Listbox(frame, width=40, height=8)
     key_listbox.grid(row=3, column=0, columnspan=3, padx=5, pady=5)
 
+    def on_user_rfid(token):
+        user_rfid_var.set(uid_text(token))
+        name = db.user_name(token)
+        if name:
+            user_name_var.set(name)
+            messagebox.showinfo("Bereit", "Benutzer erkannt. Jetzt Hausschlüssel zum Zurückgeben einscannen.")
+        else:
+            messagebox.showerror("Fehler", "Benutzer nicht gefunden.")
+
     def scan_user_rfid():
-        token = read_rfid_as_decimal_string()
-        if token:
-            user_rfid_var.set(token)
-            conn = sqlite3.connect("key_management.db")
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM users WHERE rfid_token = ?", (token,))
-            result = cursor.fetchone()
-            conn.close()
-            if result:
-                user_name_var.set(result[0])
-                messagebox.showinfo("Bereit", "Benutzer erkannt. Jetzt Hausschlüssel zum Zurückgeben einscannen.")
-            else:
-                messagebox.showerror("Fehler", "Benutzer nicht gefunden.")
+        request_scan(on_user_rfid)
 
-    def scan_next_return_key():
-        token = read_rfid_as_decimal_string()
-        if not token:
+    def on_return_house_rfid(token):
+        # Checked against the token index and written to the scan journal on
+        # the scan worker, the database is written in the background
+        user = user_rfid_var.get()
+        try:
+            kms.validate_return(user, token)
+        except ValidationError as e:
+            messagebox.showerror("Fehler", str(e))
             return
+        scanned = reader.token_time
 
-        conn = sqlite3.connect("key_management.db")
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT house_name FROM houses WHERE rfid_token = ?", (token,))
-        result = cursor.fetchone()
-
-        if result:
-            house_name = result[0]
-            house_rfid = token
+        def returned(_):
+            observe("scan.to_journal", time.perf_counter() - scanned)
+            # Not listed for the next user if the view was left meanwhile
+            if user_rfid_var.get() == user:
+                house_name = db.house_name(token)
+                returned_keys.append(house_name)
+                key_listbox.insert(tk.END, house_name)
 
-            # Insert return record
-            cursor.execute("""
-                INSERT INTO key_returns (user_rfid, house_rfid, timestamp)
-                VALUES (?, ?, CURRENT_TIMESTAMP)
-            """, (user_rfid_var.get(), house_rfid))
+        def failed(e):
+            messagebox.showerror("Fehler", f"Rückgabe konnte nicht gespeichert werden: {e}")
 
-            # Update key status (optional if tracked)
-            cursor.execute("UPDATE keys SET status = 'available' WHERE rfid_token = ?", (house_rfid,))
-            conn.commit()
-            conn.close()
+        run_scan_task(scans.write, [("return", user, token, utc_timestamp())], on_done=returned, on_error=failed)
 
-            returned_keys.append(house_name)
-            key_listbox.insert(tk.END, house_name)
-        else:
-            conn.close()
-            messagebox.showerror("Fehler", "Haus nicht gefunden.")
+    def scan_next_return_key():
+        request_scan(on_return_house_rfid)
 
-    def finish_return():
+    def clear_user():
+        # Like a pickup session, the user never outlives the view: the next
+        # person at the desk must scan their own card
         user_rfid_var.set("")
         user_name_var.set("")
         returned_keys.clear()
         key_listbox.delete(0, tk.END)
+
+    def finish_return():
+        clear_user()
         messagebox.showinfo("Fertig", "Schlüsselrückgaben abgeschlossen.")
 
-    tk.Button(right_frame, text="Hausschlüssel scannen", command=scan_next_return_key, bg="#f0f0f0").grid(row=4, column=0, pady=10)
-    tk.Button(right_frame, text="Fertig", command=finish_return, bg="#d0ffd0").grid(row=4, column=1, pady=10)
+    tk.Button(frame, text="Hausschlüssel scannen", command=scan_next_return_key, bg="#f0f0f0").grid(row=4, column=0, pady=10)
+    tk.Button(frame, text="Fertig", command=finish_return, bg="#d0ffd0").grid(row=4, column=1, pady=10)
+
+    return View(on_hide=clear_user)
 
 
-def view_assigned_keys_view():
-    clear_right_frame()
+def view_assigned_keys_view(frame):
     
     # 1. Create frames with visible borders for debugging
-    top_frame = tk.Frame(right_frame, bd=2, relief=tk.RAISED, bg="#f0f0f0")
+    top_frame = tk.Frame(frame, bd=2, relief=tk.RAISED, bg="#f0f0f0")
     top_frame.pack(fill=tk.X, padx=5, pady=5)
     
-    middle_frame = tk.Frame(right_frame)
+    middle_frame = tk.Frame(frame)
     middle_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
     
-    bottom_frame = tk.Frame(right_frame, bd=2, relief=tk.SUNKEN, bg="#f0f0f0")
+    bottom_frame = tk.Frame(frame, bd=2, relief=tk.SUNKEN, bg="#f0f0f0")
     bottom_frame.pack(fill=tk.X, padx=5, pady=5)
 
     # 2. Add buttons with distinct colors
@@ -545,25 +660,37 @@ def view_assigned_keys_view():
     export_nr_btn = tk.Button(top_frame, text="Export NR CSV", bg="#e6ffe6", **btn_style) 
     export_all_btn = tk.Button(top_frame, text="Export All CSV", bg="#f0e6ff", **btn_style)
     
+    cancel_export_btn = tk.Button(top_frame, text="Cancel Export", state=tk.DISABLED, **btn_style)
+    
     # Pack buttons horizontally
     refresh_btn.pack(side=tk.LEFT, padx=5)
     show_nr_btn.pack(side=tk.LEFT, padx=5)
     export_nr_btn.pack(side=tk.LEFT, padx=5)
     export_all_btn.pack(side=tk.LEFT, padx=5)
+    cancel_export_btn.pack(side=tk.LEFT, padx=5)
+
+    # Export filters
+    filter_frame = tk.Frame(frame)
+    filter_frame.pack(fill=tk.X, padx=5, before=middle_frame)
+    filter_vars = {}
+    for label, key in [("Von (JJJJ-MM-TT):", "start"), ("Bis:", "end"), ("Benutzer:", "user"), ("Haus:", "house")]:
+        tk.Label(filter_frame, text=label).pack(side=tk.LEFT)
+        filter_vars[key] = tk.StringVar()
+        tk.Entry(filter_frame, textvariable=filter_vars[key], width=12).pack(side=tk.LEFT, padx=(0, 8))
+    gzip_var = tk.BooleanVar(value=False)
+    tk.Checkbutton(filter_frame, text="gzip", variable=gzip_var).pack(side=tk.LEFT)
 
     # 3. Add treeview with scrollbars (all assignments)
-    tree = ttk.Treeview(middle_frame, columns=("User", "House", "Pickup", "Return"), show="headings")
-    tree.heading("User", text="User")
-    tree.heading("House", text="House")
-    tree.heading("Pickup", text="Pickup Time")
-    tree.heading("Return", text="Return Time")
-    
-    vsb = ttk.Scrollbar(middle_frame, orient="vertical", command=tree.yview)
-    hsb = ttk.Scrollbar(middle_frame, orient="horizontal", command=tree.xview)
-    tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+    # Only the visible rows are loaded, pages are fetched while scrolling
+    tree = VirtualTreeview(
+        middle_frame, db.assignments_page_query(),
+        {"User": "User", "House": "House", "Pickup": "Pickup Time", "Return": "Return Time"},
+        format_row=lambda row: row[:3] + (row[3] if row[3] else "Not Returned",), runner=tasks)
+
+    hsb = ttk.Scrollbar(middle_frame, orient="horizontal", command=tree.tree.xview)
+    tree.tree.configure(xscrollcommand=hsb.set)
     
-    tree.grid(row=0, column=0, sticky="nsew")
-    vsb.grid(row=0, column=1, sticky="ns")
+    tree.grid(row=0, column=0, columnspan=2, sticky="nsew")
     hsb.grid(row=1, column=0, sticky="ew")
     
     middle_frame.grid_rowconfigure(0, weight=1)
@@ -592,182 +719,509 @@ def view_assigned_keys_view():
     status_label.pack()
 
     # 5. Database functions
-    def load_data():
-        try:
-            tree.delete(*tree.get_children())
-            nr_tree.delete(*nr_tree.get_children())
-            with sqlite3.connect("key_management.db") as conn:
-                cursor = conn.cursor()
-                
-                # Get all key assignments
-                cursor.execute("""
-                    SELECT u.name, h.house_name, kp.timestamp, 
-                           (SELECT MIN(kr.timestamp) 
-                            FROM key_returns kr 
-                            WHERE kr.user_rfid = kp.user_rfid 
-                            AND kr.house_rfid = kp.house_rfid
-                            AND kr.timestamp > kp.timestamp)
-                    FROM key_pickups kp
-                    JOIN users u ON kp.user_rfid = u.rfid_token
-                    JOIN houses h ON kp.house_rfid = h.rfid_token
-                    ORDER BY kp.timestamp DESC
-                """)
-                
-                for row in cursor.fetchall():
-                    return_time = row[3] if row[3] else "Not Returned"
-                    tree.insert("", tk.END, values=row[:3] + (return_time,))
-                
-                # Count and show non-returned keys
-                cursor.execute("""
-                    SELECT COUNT(*) FROM key_pickups kp
-                    WHERE NOT EXISTS (
-                        SELECT 1 FROM key_returns kr 
-                        WHERE kr.user_rfid = kp.user_rfid
-                        AND kr.house_rfid = kp.house_rfid
-                        AND kr.timestamp > kp.timestamp
-                    )
-                """)
-                count = cursor.fetchone()[0]
-                status_var.set(f"Non-returned Keys: {count}")
-
-                # Load non-returned details into nr_tree
-                cursor.execute("""
-                    SELECT u.name, h.house_name, kp.timestamp
-                    FROM key_pickups kp
-                    JOIN users u ON kp.user_rfid = u.rfid_token
-                    JOIN houses h ON kp.house_rfid = h.rfid_token
-                    WHERE NOT EXISTS (
-                        SELECT 1 FROM key_returns kr 
-                        WHERE kr.user_rfid = kp.user_rfid
-                        AND kr.house_rfid = kp.house_rfid
-                        AND kr.timestamp > kp.timestamp
-                    )
-                    ORDER BY kp.timestamp DESC
-                """)
-                for row in cursor.fetchall():
-                    nr_tree.insert("", tk.END, values=row)
+    query = tree.source
+    last_pickup_id = 0
+    last_return_id = 0
+    loaded = False
+    refresh_job = None
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Database error: {str(e)}")
-            status_var.set("Error loading data")
+    def show_non_returned_count():
+        status_var.set(f"Non-returned Keys: {len(nr_tree.get_children())}")
 
-    def export_csv(records, headers, filename_prefix):
+    def read_open_loans():
+        # On the task worker, like read_changes()
+        pickup_id = db.last_pickup_id()
+        return pickup_id, db.last_return_id(), db.open_loans(upto_pickup_id=pickup_id)
+
+    def load_data():
+        # Reloads the visible page of all key assignments on the worker as
+        # well. Tasks run in order, so the page is read before the last ids
+        # and refresh_data() never adds a row the page already has.
+        tree.refresh()
+        run_task(read_open_loans, key="assignments.load", label="Zuordnungen laden",
+                 on_done=show_open_loans, on_error=show_load_error)
+
+    @timed("view.assignments.load_data")
+    def show_open_loans(result):
+        nonlocal last_pickup_id, last_return_id, loaded
+        last_pickup_id, last_return_id, rows = result
+        loaded = True
+        nr_tree.delete(*nr_tree.get_children())
+        for row in rows:
+            nr_tree.insert("", tk.END, iid=str(row[0]), values=row[1:])
+        show_non_returned_count()
+
+    def show_load_error(error, quiet=False):
+        if not quiet:
+            messagebox.showerror("Error", f"Database error: {str(error)}")
+        status_var.set("Error loading data")
+
+    def read_changes(since_pickup_id, since_return_id, sort, desc, prepend):
+        # Only pickups and returns newer than the ones already shown are read
+        pickup_id = db.last_pickup_id()
+        return_id = db.last_return_id()
+        new_rows = opened = returned_rows = returned_ids = None
+        if pickup_id > since_pickup_id:
+            new_range = ("l.pickup_id > ? AND l.pickup_id <= ?", (since_pickup_id, pickup_id))
+            if prepend:
+                new_rows = query.fetch_where(sort, desc, *new_range)
+            opened = db.open_loans(since_pickup_id, pickup_id)
+        if return_id > since_return_id:
+            returned = ("l.return_id > ? AND l.return_id <= ?", (since_return_id, return_id))
+            returned_rows = query.fetch_where(sort, desc, *returned)
+            returned_ids = db.returned_pickup_ids(since_return_id, return_id)
+        return (since_pickup_id, since_return_id, sort, desc, pickup_id, return_id,
+                new_rows, opened, returned_rows, returned_ids)
+
+    def refresh_data(quiet=False):
+        # Repeated clicks and polls while one is running are coalesced
+        if not loaded:
+            return  # load_data() reads everything
+        run_task(read_changes, last_pickup_id, last_return_id, tree.sort, tree.desc, tree.in_default_order(),
+                 key="assignments.refresh", label="Zuordnungen aktualisieren",
+                 on_done=show_changes, on_error=lambda e: show_load_error(e, quiet))
+
+    @timed("view.assignments.refresh")
+    def show_changes(result):
+        nonlocal last_pickup_id, last_return_id
+        (since_pickup_id, since_return_id, sort, desc, pickup_id, return_id,
+         new_rows, opened, returned_rows, returned_ids) = result
+        if (since_pickup_id, since_return_id) != (last_pickup_id, last_return_id):
+            return  # read before a newer result was shown
+        if (sort, desc) != (tree.sort, tree.desc):
+            # Re-sorted meanwhile, the rows were read in the old order
+            tree.refresh()
+            new_rows = returned_rows = None
+
+        if opened is not None:
+            if new_rows is not None:
+                tree.prepend_rows(new_rows)
+            elif (sort, desc) == (tree.sort, tree.desc):
+                tree.refresh()
+            for row in reversed(opened):
+                if not nr_tree.exists(str(row[0])):
+                    nr_tree.insert("", 0, iid=str(row[0]), values=row[1:])
+
+        if returned_ids is not None:
+            if returned_rows is not None:
+                tree.update_rows(returned_rows)
+            for pickup_id_returned in returned_ids:
+                if nr_tree.exists(str(pickup_id_returned)):
+                    nr_tree.delete(str(pickup_id_returned))
+
+        if pickup_id > last_pickup_id or return_id > last_return_id:
+            last_pickup_id, last_return_id = pickup_id, return_id
+            show_non_returned_count()
+
+    def poll_data():
+        nonlocal refresh_job
+        refresh_data(quiet=True)
+        refresh_job = root.after(ASSIGNMENTS_REFRESH_MS, poll_data)
+
+    def stop_polling():
+        nonlocal refresh_job
+        if refresh_job is not None:
+            root.after_cancel(refresh_job)
+            refresh_job = None
+
+    def on_show():
+        # Catches up with what changed while the view was hidden, then keeps it live
+        stop_polling()
+        poll_data()
+
+    export_job = None
+
+    def export_filters():
+        filters = {key: var.get().strip() for key, var in filter_vars.items() if var.get().strip()}
+        for key in ("start", "end"):
+            if key in filters:
+                datetime.strptime(filters[key], "%Y-%m-%d")
+        return filters
+
+    def export_csv(query, count, headers, filename_prefix, format_row=None):
+        nonlocal export_job
+        if export_job is not None and not export_job.done:
+            messagebox.showerror("Error", "Ein Export läuft bereits.")
+            return
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{filename_prefix}_{timestamp}.csv"
-            with open(filename, 'w', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(headers)
-                writer.writerows(records)
-            messagebox.showinfo("Success", f"Exported to {filename}")
-            status_var.set(f"Exported {len(records)} records")
-        except Exception as e:
-            messagebox.showerror("Export Failed", f"Error: {str(e)}")
+            filters = export_filters()
+        except ValueError:
+            messagebox.showerror("Error", "Datum bitte im Format JJJJ-MM-TT angeben.")
+            return
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"{filename_prefix}_{timestamp}.csv"
+        # Runs on a worker thread with its own connection, rows are streamed in chunks
+        export_job = CsvExport(lambda: query(**filters), headers, filename,
+                               format_row=format_row, count=lambda: count(**filters),
+                               compress=gzip_var.get()).start()
+        cancel_export_btn.config(state=tk.NORMAL)
+        poll_export(export_job)
+
+    def poll_export(job):
+        # The export keeps running when the view is hidden; the view is kept
+        # too, so its status is current when it is shown again
+        if not job.done:
+            if job.total:
+                status_var.set(f"Exporting... {job.written:,} / {job.total:,} records")
+            else:
+                status_var.set(f"Exporting... {job.written:,} records")
+            root.after(200, poll_export, job)
+            return
+        cancel_export_btn.config(state=tk.DISABLED)
+        if job.error is not None:
+            messagebox.showerror("Export Failed", f"Error: {str(job.error)}")
             status_var.set("Export failed")
+        elif job.cancelled:
+            status_var.set("Export cancelled")
+        else:
+            messagebox.showinfo("Success", f"Exported to {job.path}")
+            status_var.set(f"Exported {job.written} records")
+
+    def cancel_export():
+        if export_job is not None:
+            export_job.cancel()
 
     def export_non_returned():
-        try:
-            with sqlite3.connect("key_management.db") as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT u.name, h.house_name, kp.timestamp
-                    FROM key_pickups kp
-                    JOIN users u ON kp.user_rfid = u.rfid_token
-                    JOIN houses h ON kp.house_rfid = h.rfid_token
-                    WHERE NOT EXISTS (
-                        SELECT 1 FROM key_returns kr 
-                        WHERE kr.user_rfid = kp.user_rfid
-                        AND kr.house_rfid = kp.house_rfid
-                        AND kr.timestamp > kp.timestamp
-                    )
-                    ORDER BY kp.timestamp DESC
-                """)
-                export_csv(cursor.fetchall(), 
-                           ["User", "House", "Pickup Time"],
-                           "non_returned_keys")
-        except Exception as e:
-            messagebox.showerror("Error", f"Export failed: {str(e)}")
+        export_csv(db.non_returned, db.non_returned_count,
+                   ["User", "House", "Pickup Time"],
+                   "non_returned_keys")
 
     def export_all_assignments():
-        try:
-            with sqlite3.connect("key_management.db") as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                SELECT 
-                    u.name AS user_name,
-                    h.house_name,
-                    kp.timestamp AS pickup_time,
-                    (
-                        SELECT MIN(kr.timestamp)
-                        FROM key_returns kr
-                        WHERE kr.user_rfid = kp.user_rfid
-                          AND kr.house_rfid = kp.house_rfid
-                          AND kr.timestamp > kp.timestamp
-                    ) AS return_time
-                FROM key_pickups kp
-                JOIN users u ON kp.user_rfid = u.rfid_token
-                JOIN houses h ON kp.house_rfid = h.rfid_token
-                ORDER BY kp.timestamp DESC
-            """)
-            rows = cursor.fetchall()
-
-            # Add 'Not Returned' if return_time is NULL
-            formatted_rows = [
-                (user, house, pickup, return_time if return_time else "Not Returned")
-                for user, house, pickup, return_time in rows
-            ]
-
-            export_csv(formatted_rows,
-                       ["User", "House", "Pickup Time", "Return Time"],
-                       "all_key_assignments")
-        except Exception as e:
-            messagebox.showerror("Error", f"Export failed: {str(e)}")
+        # Add 'Not Returned' if return_time is NULL
+        export_csv(db.assignments, db.assignments_count,
+                   ["User", "House", "Pickup Time", "Return Time"],
+                   "all_key_assignments",
+                   format_row=lambda row: row[:3] + (row[3] if row[3] else "Not Returned",))
+
     # 6. Configure button commands
-    refresh_btn.config(command=load_data)
-    show_nr_btn.config(command=lambda: messagebox.showinfo("Non-Returned Keys", status_var.get()))
+    refresh_btn.config(command=refresh_data)
+    show_nr_btn.config(command=lambda: messagebox.showinfo(
+        "Non-Returned Keys", f"Non-returned Keys: {len(nr_tree.get_children())}"))
     export_nr_btn.config(command=export_non_returned)
     export_all_btn.config(command=export_all_assignments)
+    cancel_export_btn.config(command=cancel_export)
 
-    # 7. Initial data load
+    # 7. Initial data load; refreshed incrementally while the view is shown
     load_data()
+    return View(on_show=on_show, on_hide=stop_polling)
+
+
+def search_view(frame):
+    status_label = tk.Label(frame, anchor="w", font=("Arial", 11, "bold"))
+    status_label.pack(fill="x", padx=5, pady=5)
+
+    results = ttk.Treeview(frame, columns=("Kind", "Name", "RFID"), show="headings", height=8)
+    for column, text, width in (("Kind", "Art", 120), ("Name", "Name", 320), ("RFID", "RFID-Token", 160)):
+        results.heading(column, text=text)
+        results.column(column, width=width, stretch=column == "Name")
+    results.pack(fill="x", padx=5)
+
+    history_label = tk.Label(frame, anchor="w", font=("Arial", 11, "bold"))
+    history_label.pack(fill="x", padx=5, pady=(10, 0))
+    # No house has an empty token, the list starts empty
+    history = VirtualTreeview(
+        frame, db.loan_history_query("house", ""),
+        {"User": "User", "House": "House", "Pickup": "Pickup Time", "Return": "Return Time"},
+        format_row=lambda row: row[:3] + (row[3] if row[3] else "Not Returned",), runner=tasks)
+    history.pack(fill="both", expand=True, padx=5, pady=5)
+
+    found = {}
+    shown_text = None
+    shown_match = None
+
+    def show_history(event=None):
+        # Loans of the selected user or house, paged through its index
+        nonlocal shown_match
+        selection = results.selection()
+        if not selection or found[selection[0]] == shown_match:
+            return
+        shown_match = found[selection[0]]
+        kind, token, name, deleted = shown_match
+        history_label.config(text=f"Ausleihen von {name}" + (" (gelöscht)" if deleted else ""))
+        history.set_source(db.loan_history_query(kind, token))
+
+    def run_search():
+        nonlocal shown_text
+        text = search_var.get().strip()
+        if text == shown_text:
+            return
+        shown_text = text
+        # Typing on while a search runs only searches the latest text again
+        run_task(lambda: (text, db.search(text) if text else []), key="search", label="Suchen",
+                 on_done=show_results,
+                 on_error=lambda e: status_label.config(text=f"Suche fehlgeschlagen: {e}"))
+
+    @timed("view.search.query")
+    def show_results(result):
+        nonlocal shown_match
+        text, rows = result
+        results.delete(*results.get_children())
+        found.clear()
+        for i, row in enumerate(rows):
+            kind, token, name, deleted = row
+            found[str(i)] = row
+            label = SEARCH_KIND_LABELS[kind] + (" (gelöscht)" if deleted else "")
+            results.insert("", tk.END, iid=str(i), values=(label, name, token))
+        status_label.config(text=f"{len(rows)} Treffer für „{text}“" if text else "Suchbegriff oben links eingeben")
+        if rows:
+            # Jumps straight to the loans of the best match
+            results.selection_set("0")
+            show_history()
+        else:
+            shown_match = None
+            history_label.config(text="")
+            history.set_source(db.loan_history_query("house", ""))
+
+    results.bind("<<TreeviewSelect>>", show_history)
+    return View(on_show=run_search)
+
+def schedule_search(*args):
+    # Search as you type, once the typing pauses
+    global search_job
+    if search_job is not None:
+        root.after_cancel(search_job)
+    search_job = root.after(SEARCH_DELAY_MS, show_search)
+
+def show_search():
+    global search_job
+    search_job = None
+    switch_to("search")
+
+def diagnostics_view(frame):
+    tk.Label(frame, text="Zeitmessungen in ms (letzte 1024 Werte je Messpunkt)",
+             font=("Arial", 12, "bold")).pack(anchor="w", padx=5, pady=5)
+
+    columns = ("Messpunkt", "Anzahl", "p50", "p95", "p99", "Max")
+    tree = ttk.Treeview(frame, columns=columns, show="headings", height=14)
+    for column in columns:
+        tree.heading(column, text=column)
+        tree.column(column, width=260 if column == "Messpunkt" else 80,
+                    anchor="w" if column == "Messpunkt" else "e")
+    tree.pack(fill="both", expand=True, padx=5)
+
+    journal_label = tk.Label(frame, anchor="w")
+    journal_label.pack(fill="x", padx=5, pady=(5, 0))
+    backup_label = tk.Label(frame, anchor="w")
+    backup_label.pack(fill="x", padx=5)
+
+    tk.Label(frame, text=f"Langsame Abfragen (ab {metrics.slow_query_ms:g} ms):").pack(anchor="w", padx=5, pady=(10, 0))
+    slow_text = tk.Text(frame, height=8, wrap="none")
+    slow_text.pack(fill="x", padx=5)
+
+    buttons = tk.Frame(frame)
+    buttons.pack(fill="x", padx=5, pady=5)
+    refresh_job = None
+
+    def ms(seconds):
+        return "" if seconds is None else f"{seconds * 1000:.2f}"
+
+    def refresh():
+        nonlocal refresh_job
+        tree.delete(*tree.get_children())
+        for name, histogram in sorted(metrics.histograms.items()):
+            p50, p95, p99 = histogram.percentiles(50, 95, 99)
+            tree.insert("", tk.END, values=(name, histogram.count, ms(p50), ms(p95), ms(p99), ms(histogram.max)))
+        error = scans.last_error
+        journal_label.config(
+            text=f"Scan-Journal: {scans.pending()} Scans noch nicht in der Datenbank"
+                 + (f" ({error})" if error is not None else ""),
+            fg="red" if error is not None else "black")
+        if backups.last_error is not None:
+            backup_label.config(text=f"Letzte Sicherung fehlgeschlagen: {backups.last_error}", fg="red")
+        elif backups.last is not None:
+            taken = backups.backups.taken_at(backups.last).strftime("%d.%m.%Y %H:%M")
+            backup_label.config(text=f"Letzte Sicherung: {taken} ({backups.last})", fg="black")
+        else:
+            backup_label.config(text="Noch keine Sicherung", fg="black")
+        slow_text.delete("1.0", tk.END)
+        for when, seconds, sql, plan in reversed(metrics.slow_queries):
+            stamp = datetime.fromtimestamp(when).strftime("%H:%M:%S")
+            slow_text.insert(tk.END, f"{stamp} {seconds * 1000:.1f} ms: {' '.join(sql.split())}\n{plan}\n")
+        refresh_job = root.after(DIAGNOSTICS_REFRESH_MS, refresh)
+
+    def stop_refresh():
+        nonlocal refresh_job
+        if refresh_job is not None:
+            root.after_cancel(refresh_job)
+            refresh_job = None
+
+    def save_prometheus():
+        path = filedialog.asksaveasfilename(
+            title="Zeitmessungen speichern", defaultextension=".prom",
+            filetypes=[("Prometheus-Textformat", "*.prom"), ("Alle Dateien", "*.*")])
+        if not path:
+            return
+        try:
+            dump_prometheus(path)
+        except OSError as e:
+            messagebox.showerror("Fehler", f"Datei konnte nicht geschrieben werden: {e}")
 
+    def restart_refresh():
+        stop_refresh()
+        refresh()
 
+    def reset():
+        metrics.reset()
+        restart_refresh()
 
+    tk.Button(buttons, text="Als Prometheus-Datei speichern...", command=save_prometheus).pack(side="left")
+    tk.Button(buttons, text="Zurücksetzen", command=reset).pack(side="left", padx=5)
 
-# GUI Setup
-root = tk.Tk()
-root.title("Sentinela")
-root.geometry("1000x600")
-
-main_frame = tk.Frame(root)
-main_frame.pack(fill="both", expand=True)
-
-left_frame = tk.Frame(main_frame, width=200, bg="#f0f0f0")
-left_frame.pack(side="left", fill="y")
-
-right_frame = tk.Frame(main_frame)
-right_frame.pack(side="right", fill="both", expand=True)
+    return View(on_show=restart_refresh, on_hide=stop_refresh)
 
-button_list = [
-    ("🏠 Startseite", dashboard_view),
-    ("Abholschlüssel", pickup_key_view),
-    ("Rückgabeschlüssel", return_key_view),
-    ("Zugewiesene Schlüssel anzeigen", view_assigned_keys_view),
-    ("Benutzer hinzufügen", add_user_and_key_view),
-    ("Benutzer löschen", delete_user_and_key_view),
-    ("Benutzer anzeigen", view_users_view),
-    ("Schlüssel und Haus hinzufügen", add_key_and_house_view),
-    ("Schlüssel und Haus löschen", delete_key_and_house_view),
-    ("Häuser ansehen", view_houses_view),
-    ("Datenbank initialisieren",initialize_database),
+def dump_metrics():
+    try:
+        dump_prometheus(METRICS_FILE)
+    except OSError:
+        pass
+    root.after(METRICS_DUMP_MS, dump_metrics)
+
+def start_api():
+    # Only imported when enabled, the GUI starts faster without it
+    from http_api import ApiServer
+    try:
+        api = ApiServer(db, port=int(HTTP_PORT))
+    except (OSError, ValueError) as e:
+        messagebox.showerror("Fehler", f"HTTP-Schnittstelle konnte nicht gestartet werden: {e}")
+        return None
+    api.start()
+    return api
 
+def check_indexes():
+    # Picks up users and houses added or deleted by other processes, and
+    # asks the overdue monitor's thread to look for their pickups, returns
+    # and loan limits. Runs on the task worker.
+    try:
+        db.tokens.check()
+        db.overdue.check()
+    except sqlite3.Error as e:
+        # Checked again in TOKEN_INDEX_CHECK_MS
+        log.warning("token index not checked: %s", e)
+
+def check_token_index():
+    run_task(check_indexes, key="token_index")
+    root.after(TOKEN_INDEX_CHECK_MS, check_token_index)
+
+def show_overdue_alerts():
+    # The monitor thread wakes at each due time and queues the loans, the
+    # warning is shown from the Tk thread
+    loans = []
+    while True:
+        try:
+            loans.extend(db.overdue.alerts.get_nowait())
+        except queue.Empty:
+            break
+    if loans:
+        lines = [f"{db.house_name(house) or uid_text(house)}: {db.user_name(user) or uid_text(user)}, abgeholt "
+                 f"{time.strftime('%Y-%m-%d %H:%M', time.gmtime(pickup_ts))}"
+                 for user, house, pickup_ts, _ in loans[:OVERDUE_ALERT_LINES]]
+        if len(loans) > OVERDUE_ALERT_LINES:
+            lines.append(f"... und {len(loans) - OVERDUE_ALERT_LINES} weitere")
+        messagebox.showwarning("Überfällige Schlüssel", "\n".join(lines))
+    root.after(OVERDUE_ALERT_CHECK_MS, show_overdue_alerts)
+
+# Menu label, name and builder of every view, in menu order
+VIEWS = [
+    ("🏠 Startseite", "dashboard", dashboard_view),
+    ("Abholschlüssel", "pickup", pickup_key_view),
+    ("Rückgabeschlüssel", "return", return_key_view),
+    ("Zugewiesene Schlüssel anzeigen", "assignments", view_assigned_keys_view),
+    ("Benutzer hinzufügen", "add_user", add_user_and_key_view),
+    ("Benutzer löschen", "delete_user", delete_user_and_key_view),
+    ("Benutzer anzeigen", "users", view_users_view),
+    ("Schlüssel und Haus hinzufügen", "add_house", add_key_and_house_view),
+    ("Schlüssel und Haus löschen", "delete_house", delete_key_and_house_view),
+    ("Häuser ansehen", "houses", view_houses_view),
+    ("Diagnose", "diagnostics", diagnostics_view),
 ]
 
-for label, command in button_list:
-    btn = tk.Button(left_frame, text=label, command=command, height=2, width=24)
-    btn.pack(fill="x", pady=2)
-
-# Show dashboard at startup
-dashboard_view()
-
-root.mainloop()
+def build_window():
+    global root, right_frame, views, search_var, busy_label
+    root = tk.Tk()
+    root.title("Sentinela")
+    root.geometry("1000x600")
+
+    main_frame = tk.Frame(root)
+    main_frame.pack(fill="both", expand=True)
+
+    left_frame = tk.Frame(main_frame, width=200, bg="#f0f0f0")
+    left_frame.pack(side="left", fill="y")
+
+    right_frame = tk.Frame(main_frame)
+    right_frame.pack(side="right", fill="both", expand=True)
+    views = ViewManager(right_frame)
+
+    search_var = tk.StringVar()
+    tk.Label(left_frame, text="🔍 Suche", bg="#f0f0f0").pack(anchor="w", padx=2)
+    search_entry = tk.Entry(left_frame, textvariable=search_var)
+    search_entry.pack(fill="x", padx=2, pady=(0, 6))
+    search_entry.bind("<Return>", lambda event: show_search())
+    search_var.trace_add("write", schedule_search)
+    views.register("search", search_view)
+
+    button_list = []
+    for label, name, build in VIEWS:
+        views.register(name, build)
+        button_list.append((label, lambda name=name: switch_to(name)))
+    button_list.append(("Datenbank initialisieren", initialize_database))
+
+    for label, command in button_list:
+        btn = tk.Button(left_frame, text=label, command=command, height=2, width=24)
+        btn.pack(fill="x", pady=2)
+
+    busy_label = tk.Label(left_frame, anchor="w", bg="#f0f0f0", wraplength=190, justify="left")
+    busy_label.pack(side="bottom", fill="x", padx=2, pady=4)
+
+def main():
+    global kms, db, reader, tasks, scans, scan_tasks, backups, lag_probe
+    # Database: one long-lived connection per thread, the Tk thread only
+    # opens it here, all later work runs on the task worker
+    kms = KeyManagement.open()
+    db = kms.db
+    tasks = TaskRunner(close=db.close).start()
+    # Also applies scans an interrupted run left in the journal
+    scans = DatabaseWriter(db, ScanJournal())
+    scans.start()
+    scan_tasks = TaskRunner().start()
+
+    build_window()
+    tasks.poll(root, on_busy=show_busy)
+    scan_tasks.poll(root)
+    # "ui.lag" in the diagnostics view: how long the window was unresponsive
+    lag_probe = LagProbe().start(root)
+
+    # Start the RFID reader and deliver its tokens on the Tk main loop
+    reader = RfidReader()
+    reader.start()
+    reader.poll(root, on_rfid_token, on_error=on_reader_error)
+
+    root.after(TOKEN_INDEX_CHECK_MS, check_token_index)
+    # Open loans are watched in memory, the history is never scanned for
+    # them; the monitor's thread loads them
+    db.overdue.start()
+    root.after(OVERDUE_ALERT_CHECK_MS, show_overdue_alerts)
+    if METRICS_FILE:
+        root.after(METRICS_DUMP_MS, dump_metrics)
+    backups = BackupScheduler(Backups(db.path), BACKUP_INTERVAL_HOURS * 3600)
+    if BACKUP_INTERVAL_HOURS > 0:
+        backups.start()
+    api = start_api() if HTTP_PORT else None
+
+    # Show dashboard at startup
+    switch_to("dashboard")
+    recover_pickup_session()
+
+    root.mainloop()
+    lag_probe.stop()
+    tasks.stop()
+    scan_tasks.stop()
+    scans.stop()
+    backups.stop()
+    if api is not None:
+        api.stop()
+    db.overdue.stop()
+    reader.stop()
+    kms.close()
+
+if __name__ == "__main__":
+    main()
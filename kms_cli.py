@@ -0,0 +1,163 @@
+"""Command line access to the key management database, without the GUI.
+
+Usage examples:
+    python kms_cli.py users
+    python kms_cli.py add-user "Anna Muster" 004162031156
+    python kms_cli.py import-houses portfolio.csv
+    python kms_cli.py pickup 004162031156 001002003004 005006007008
+    python kms_cli.py assignments --start 2025-01-01 --open --csv out.csv
+    python kms_cli.py stats
+    python kms_cli.py loan-limit house 001002003004 4
+    python kms_cli.py archive --older-than 365
+    python kms_cli.py backup
+    python kms_cli.py restore key_management-backups/key_management-20261018-030000.db
+"""
+import argparse
+import sys
+
+from archive import ARCHIVE_AFTER_DAYS
+from database import DB_PATH
+from kms_core import KeyManagement, ValidationError
+
+
+def print_rows(rows):
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+
+
+def write_csv(cursor, headers, path):
+    # Imported here so the other commands do not pay for it
+    from export import CsvExport
+    job = CsvExport(lambda: cursor, headers, path).run()
+    print(f"{job.written} Zeilen nach {job.path} exportiert")
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--start", help="erstes Abholdatum (JJJJ-MM-TT)")
+    parser.add_argument("--end", help="letztes Abholdatum (JJJJ-MM-TT)")
+    parser.add_argument("--user", help="Benutzername")
+    parser.add_argument("--house", help="Hausname")
+    parser.add_argument("--csv", metavar="PATH", help="als CSV-Datei schreiben")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Sentinela Schlüsselverwaltung")
+    parser.add_argument("--db", default=DB_PATH, help="Datenbankdatei")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("users", help="Benutzer auflisten")
+    commands.add_parser("houses", help="Häuser auflisten")
+    p = commands.add_parser("add-user", help="Benutzer hinzufügen")
+    p.add_argument("name")
+    p.add_argument("token")
+    p = commands.add_parser("delete-user", help="Benutzer löschen")
+    p.add_argument("token")
+    p = commands.add_parser("add-house", help="Haus hinzufügen")
+    p.add_argument("name")
+    p.add_argument("token")
+    p = commands.add_parser("delete-house", help="Haus löschen")
+    p.add_argument("token")
+    for kind, text in (("users", "Benutzer"), ("houses", "Häuser")):
+        p = commands.add_parser(f"import-{kind}", help=f"{text} aus CSV- oder JSON-Datei importieren")
+        p.add_argument("path")
+        p.add_argument("--rejects", metavar="PATH", help="Datei für abgelehnte Zeilen")
+    p = commands.add_parser("pickup", help="Schlüsselabholung erfassen")
+    p.add_argument("user_token")
+    p.add_argument("house_tokens", nargs="+")
+    p = commands.add_parser("return", help="Schlüsselrückgabe erfassen")
+    p.add_argument("user_token")
+    p.add_argument("house_token")
+    p = commands.add_parser("assignments", help="Abholungen und Rückgaben auflisten")
+    add_filter_arguments(p)
+    p.add_argument("--open", action="store_true", help="nur nicht zurückgegebene Schlüssel")
+    commands.add_parser("stats", help="Kennzahlen der Startseite")
+    p = commands.add_parser("loan-limit", help="Leihfrist eines Benutzers oder Hauses setzen")
+    p.add_argument("kind", choices=("user", "house"))
+    p.add_argument("token")
+    p.add_argument("hours", type=float, nargs="?", help="Stunden, ohne Angabe gilt die Standardfrist")
+    p = commands.add_parser("archive", help="alte abgeschlossene Ausleihen in Jahresarchive verschieben")
+    p.add_argument("--older-than", type=int, default=ARCHIVE_AFTER_DAYS, metavar="DAYS",
+                   help=f"Rückgabe älter als so viele Tage (Standard: {ARCHIVE_AFTER_DAYS})")
+    p.add_argument("--vacuum", action="store_true", help="Datenbankdatei danach verkleinern")
+    commands.add_parser("backup", help="geprüfte Sicherung der Datenbank im laufenden Betrieb schreiben")
+    commands.add_parser("backups", help="Sicherungen auflisten")
+    p = commands.add_parser("restore", help="Datenbank aus einer Sicherung wiederherstellen")
+    p.add_argument("path", nargs="?", help="Sicherungsdatei, ohne Angabe die neueste")
+    return parser
+
+
+def run(kms, args):
+    if args.command == "users":
+        print_rows(kms.users())
+    elif args.command == "houses":
+        print_rows(kms.houses())
+    elif args.command == "add-user":
+        kms.add_user(args.name, args.token)
+    elif args.command == "delete-user":
+        kms.delete_user(args.token)
+    elif args.command == "add-house":
+        kms.add_house(args.name, args.token)
+    elif args.command == "delete-house":
+        kms.delete_house(args.token)
+    elif args.command in ("import-users", "import-houses"):
+        kind = args.command.split("-", 1)[1]
+        imported, rejects, report = kms.import_file(args.path, kind, args.rejects)
+        print(f"{imported} importiert, {len(rejects)} abgelehnt")
+        if report:
+            print(f"Abgelehnte Zeilen: {report}")
+    elif args.command == "pickup":
+        print(f"{kms.pickup(args.user_token, args.house_tokens)} Abholungen erfasst")
+    elif args.command == "return":
+        kms.return_key(args.user_token, args.house_token)
+    elif args.command == "assignments":
+        filters = {"start": args.start, "end": args.end, "user": args.user, "house": args.house}
+        if args.open:
+            cursor = kms.non_returned(**filters)
+            headers = ["User", "House", "Pickup Time"]
+        else:
+            cursor = kms.assignments(**filters)
+            headers = ["User", "House", "Pickup Time", "Return Time"]
+        if args.csv:
+            write_csv(cursor, headers, args.csv)
+        else:
+            print_rows(cursor)
+    elif args.command == "stats":
+        stats = kms.stats()
+        for name in ("users", "pickups_today", "returns_today", "keys_out", "overdue"):
+            print(f"{name}\t{stats[name]}")
+        for house, pickups, out in stats["busiest_houses"]:
+            print(f"busiest_house\t{house}\t{pickups}\t{out}")
+    elif args.command == "loan-limit":
+        if args.kind == "user":
+            kms.set_user_loan_limit(args.token, args.hours)
+        else:
+            kms.set_house_loan_limit(args.token, args.hours)
+    elif args.command == "archive":
+        moved = kms.archive(args.older_than, args.vacuum)
+        for year, count in sorted(moved.items()):
+            print(f"{year}\t{count} Ausleihen archiviert")
+        print(f"{sum(moved.values())} Ausleihen archiviert")
+    elif args.command == "backup":
+        print(f"Sicherung geschrieben: {kms.backup()}")
+    elif args.command == "backups":
+        for path in kms.backups():
+            print(path)
+    elif args.command == "restore":
+        print(f"Wiederhergestellt aus {kms.restore(args.path)}")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    kms = KeyManagement.open(args.db)
+    try:
+        run(kms, args)
+    except ValidationError as e:
+        print(f"Fehler: {e}", file=sys.stderr)
+        return 1
+    finally:
+        kms.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""Headless key management API: users, houses, pickups, returns and reports.
+
+Used by the Tk front end (key_management_system.py) and the command line
+(kms_cli.py). Nothing here imports tkinter, serial or PIL, so scripts and
+batch jobs can import it without a display or a reader attached.
+"""
+import os
+
+from database import DB_PATH, Database
+from pickup_session import utc_timestamp
+from uid import to_uid, uid_text
+
+
+class ValidationError(Exception):
+    """A request was rejected; the message is meant to be shown to the user."""
+
+
+def loan_limit_seconds(hours):
+    if hours is None:
+        return None
+    if hours <= 0:
+        raise ValidationError("Die Leihfrist muss größer als null sein.")
+    return round(hours * 3600)
+
+
+class KeyManagement:
+    def __init__(self, db):
+        self.db = db
+
+    @classmethod
+    def open(cls, path=DB_PATH):
+        db = Database(path)
+        db.create_schema()
+        db.tokens.load()
+        return cls(db)
+
+    def close(self):
+        self.db.close()
+
+    # Users
+
+    def user_name(self, token):
+        return self.db.user_name(token)
+
+    def add_user(self, name, token):
+        name = name.strip()
+        token = to_uid(token)
+        if not name or not token:
+            raise ValidationError("Name und RFID-Token sind erforderlich.")
+        if self.db.user_token_exists(token):
+            raise ValidationError("Dieses RFID ist bereits einem Benutzer zugewiesen.")
+        if self.db.user_name_exists(name):
+            raise ValidationError("Dieser Name ist bereits registriert.")
+        self.db.add_user(name, token)
+
+    def delete_user(self, token):
+        token = to_uid(token)
+        if not token:
+            raise ValidationError("RFID-Token nicht erkannt.")
+        if not self.db.user_token_exists(token):
+            raise ValidationError("Kein Benutzer mit diesem RFID gefunden.")
+        self.db.delete_user(token)
+
+    def users(self):
+        return self.db.list_users()
+
+    def set_user_loan_limit(self, token, hours):
+        """Let the user keep keys for ``hours``, None for the default limit."""
+        if not self.db.user_token_exists(token):
+            raise ValidationError("Kein Benutzer mit diesem RFID gefunden.")
+        self.db.set_user_loan_limit(token, loan_limit_seconds(hours))
+
+    # Houses
+
+    def house_name(self, token):
+        return self.db.house_name(token)
+
+    def add_house(self, name, token):
+        name = name.strip()
+        token = to_uid(token)
+        if not name or not token:
+            raise ValidationError("Haus und RFID-Token sind erforderlich.")
+        if self.db.house_token_exists(token):
+            raise ValidationError("Dieses RFID ist bereits einem Haus zugeordnet.")
+        if self.db.house_name_exists(name):
+            raise ValidationError("Dieser Hausname existiert bereits.")
+        self.db.add_house(name, token)
+
+    def delete_house(self, token):
+        token = to_uid(token)
+        if not token:
+            raise ValidationError("RFID-Token nicht erkannt.")
+        if not self.db.house_token_exists(token):
+            raise ValidationError("Kein Haus mit diesem RFID gefunden.")
+        self.db.delete_house(token)
+
+    def houses(self):
+        return self.db.list_houses()
+
+    def set_house_loan_limit(self, token, hours):
+        """Let the house's key stay out for ``hours``, None for the default limit."""
+        if not self.db.house_token_exists(token):
+            raise ValidationError("Kein Haus mit diesem RFID gefunden.")
+        self.db.set_house_loan_limit(token, loan_limit_seconds(hours))
+
+    # Bulk import
+
+    def import_file(self, path, kind, rejects_path=None):
+        """Import users or houses from a CSV or JSON file.
+
+        Returns (imported count, rejects, reject report path or None).
+        """
+        # csv and json are only needed here
+        import bulk_import
+        try:
+            return bulk_import.import_file(self.db, path, kind, rejects_path)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            raise ValidationError(f"Datei konnte nicht gelesen werden: {e}")
+
+    # Pickups and returns
+
+    def validate_pickup(self, user_token, house_tokens):
+        """Check the tokens of a pickup, returns the house tokens as UID bytes without repeats."""
+        if self.db.user_name(user_token) is None:
+            raise ValidationError("Benutzer nicht gefunden.")
+        # A key scanned twice, or given in both text forms, is only picked up once
+        house_tokens = list(dict.fromkeys(map(to_uid, house_tokens)))
+        unknown = [uid_text(token) for token in house_tokens if self.db.house_name(token) is None]
+        if unknown:
+            raise ValidationError(f"Haus nicht gefunden: {', '.join(unknown)}")
+        return house_tokens
+
+    def pickup(self, user_token, house_tokens, timestamp=None):
+        """Record pickups of several keys by one user in one transaction."""
+        tokens = self.validate_pickup(user_token, house_tokens)
+        timestamp = timestamp or utc_timestamp()
+        return self.db.record_pickups([(user_token, token, timestamp) for token in tokens])
+
+    def validate_return(self, user_token, house_token):
+        if self.db.user_name(user_token) is None:
+            raise ValidationError("Benutzer nicht gefunden.")
+        if self.db.house_name(house_token) is None:
+            raise ValidationError("Haus nicht gefunden.")
+
+    def return_key(self, user_token, house_token):
+        self.validate_return(user_token, house_token)
+        self.db.record_return(user_token, house_token)
+
+    # Reports
+
+    def assignments(self, **filters):
+        return self.db.assignments(**filters)
+
+    def non_returned(self, **filters):
+        return self.db.non_returned(**filters)
+
+    def stats(self):
+        return self.db.dashboard_stats()
+
+    # Maintenance
+
+    def archive(self, older_than_days, vacuum=False):
+        """Move closed loans older than ``older_than_days`` into the yearly archives."""
+        if older_than_days < 1:
+            raise ValidationError("Archivieren erst ab einem Tag Alter möglich.")
+        return self.db.archive_loans(older_than_days, vacuum)
+
+    def backups(self):
+        """Paths of the database's backups, oldest first."""
+        from backup import Backups
+        return Backups(self.db.path).list()
+
+    def backup(self):
+        """Write a verified backup of the database while it is in use, see backup.py.
+
+        Returns the backup's path.
+        """
+        from backup import BackupError, Backups
+        try:
+            return Backups(self.db.path).create()
+        except BackupError as e:
+            raise ValidationError(f"Sicherung fehlgeschlagen: {e}")
+
+    def restore(self, path=None):
+        """Replace the database's contents with a backup, the latest one by default.
+
+        Returns the path of the backup restored.
+        """
+        from backup import BackupError, Backups
+        backups = Backups(self.db.path)
+        path = path or backups.latest()
+        if path is None or not os.path.exists(path):
+            raise ValidationError("Keine Sicherung gefunden.")
+        try:
+            backups.restore(path)
+        except BackupError as e:
+            raise ValidationError(f"Sicherung ist beschädigt: {e}")
+        self.db.tokens.load()
+        return path
@@ -0,0 +1,465 @@
+"""Versioned schema migrations, tracked in ``PRAGMA user_version``.
+
+Each migration runs once, in its own transaction, in the order of
+MIGRATIONS; the database's user_version is the number of migrations
+applied. Migrations are history: change the schema by appending a new one,
+never by editing an applied one.
+
+The first three reproduce the schema that create_schema() used to build with
+CREATE ... IF NOT EXISTS, so existing databases (user_version 0) pass
+through them without changes.
+"""
+
+
+def initial_schema(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            rfid_token TEXT UNIQUE NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS keys (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rfid_token TEXT UNIQUE NOT NULL,
+            status TEXT NOT NULL,
+            FOREIGN KEY(rfid_token) REFERENCES users(rfid_token)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS houses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            house_name TEXT NOT NULL,
+            rfid_token TEXT UNIQUE NOT NULL,
+            FOREIGN KEY(rfid_token) REFERENCES keys(rfid_token)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS key_pickups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_rfid TEXT NOT NULL,
+            house_rfid TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_rfid) REFERENCES users (rfid_token),
+            FOREIGN KEY (house_rfid) REFERENCES houses (rfid_token)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS key_returns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_rfid TEXT NOT NULL,
+            house_rfid TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            FOREIGN KEY (user_rfid) REFERENCES users (rfid_token),
+            FOREIGN KEY (house_rfid) REFERENCES houses (rfid_token)
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pickups_user ON key_pickups(user_rfid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pickups_house ON key_pickups(house_rfid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_returns_user ON key_returns(user_rfid)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_returns_house ON key_returns(house_rfid)")
+
+
+def loans(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'loans'").fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS loans (
+            pickup_id INTEGER PRIMARY KEY,
+            return_id INTEGER,
+            user_rfid TEXT NOT NULL,
+            house_rfid TEXT NOT NULL,
+            pickup_ts TEXT NOT NULL,
+            return_ts TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_pickup_ts ON loans(pickup_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_loans_return_id ON loans(return_id) WHERE return_id IS NOT NULL")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_loans_open ON loans(pickup_ts)
+        WHERE return_ts IS NULL
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_loans_open_key ON loans(house_rfid, user_rfid)
+        WHERE return_ts IS NULL
+    """)
+    if not exists:
+        # One-time backfill: a pickup is closed by the first later return
+        # of the same key by the same user
+        conn.execute("""
+            INSERT INTO loans (pickup_id, return_id, user_rfid, house_rfid, pickup_ts)
+            SELECT kp.id,
+                   (SELECT kr.id FROM key_returns kr
+                    WHERE kr.user_rfid = kp.user_rfid
+                    AND kr.house_rfid = kp.house_rfid
+                    AND kr.timestamp > kp.timestamp
+                    ORDER BY kr.timestamp, kr.id LIMIT 1),
+                   kp.user_rfid, kp.house_rfid, kp.timestamp
+            FROM key_pickups kp
+        """)
+        conn.execute("""
+            UPDATE loans SET return_ts = (SELECT timestamp FROM key_returns WHERE id = loans.return_id)
+            WHERE return_id IS NOT NULL
+        """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_loans_pickup AFTER INSERT ON key_pickups
+        BEGIN
+            INSERT INTO loans (pickup_id, user_rfid, house_rfid, pickup_ts)
+            VALUES (NEW.id, NEW.user_rfid, NEW.house_rfid, NEW.timestamp);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_loans_return AFTER INSERT ON key_returns
+        BEGIN
+            UPDATE loans SET return_id = NEW.id, return_ts = NEW.timestamp
+            WHERE house_rfid = NEW.house_rfid
+            AND user_rfid = NEW.user_rfid
+            AND return_ts IS NULL
+            AND pickup_ts <= NEW.timestamp;
+        END
+    """)
+
+
+def dashboard_stats(conn):
+    # Counters for the dashboard, kept current by triggers so reading
+    # them never scans the history. Days are local dates.
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_stats'").fetchone()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            pickups INTEGER NOT NULL DEFAULT 0,
+            returns INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS house_stats (
+            house_rfid TEXT PRIMARY KEY,
+            pickups INTEGER NOT NULL DEFAULT 0,
+            open INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_house_stats_pickups ON house_stats(pickups)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    if not exists:
+        # One-time backfill from the existing history
+        conn.execute("""
+            INSERT INTO daily_stats (day, pickups)
+            SELECT date(timestamp, 'localtime'), COUNT(*) FROM key_pickups GROUP BY 1
+        """)
+        conn.execute("""
+            INSERT INTO daily_stats (day, returns)
+            SELECT date(timestamp, 'localtime'), COUNT(*) FROM key_returns GROUP BY 1
+            ON CONFLICT (day) DO UPDATE SET returns = excluded.returns
+        """)
+        conn.execute("""
+            INSERT INTO house_stats (house_rfid, pickups, open)
+            SELECT house_rfid, COUNT(*), COUNT(*) - COUNT(return_ts) FROM loans GROUP BY house_rfid
+        """)
+        conn.execute("""
+            INSERT OR REPLACE INTO counters (name, value)
+            VALUES ('users', (SELECT COUNT(*) FROM users)),
+                   ('open_loans', (SELECT COUNT(*) FROM loans WHERE return_ts IS NULL))
+        """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_pickup AFTER INSERT ON key_pickups
+        BEGIN
+            INSERT INTO daily_stats (day, pickups) VALUES (date(NEW.timestamp, 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET pickups = pickups + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_return AFTER INSERT ON key_returns
+        BEGIN
+            INSERT INTO daily_stats (day, returns) VALUES (date(NEW.timestamp, 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET returns = returns + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_loan_open AFTER INSERT ON loans
+        BEGIN
+            INSERT INTO house_stats (house_rfid, pickups, open) VALUES (NEW.house_rfid, 1, 1)
+            ON CONFLICT (house_rfid) DO UPDATE SET pickups = pickups + 1, open = open + 1;
+            UPDATE counters SET value = value + 1 WHERE name = 'open_loans';
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_loan_close AFTER UPDATE OF return_ts ON loans
+        WHEN OLD.return_ts IS NULL AND NEW.return_ts IS NOT NULL
+        BEGIN
+            UPDATE house_stats SET open = open - 1 WHERE house_rfid = NEW.house_rfid;
+            UPDATE counters SET value = value - 1 WHERE name = 'open_loans';
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_user_add AFTER INSERT ON users
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'users';
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_user_delete AFTER DELETE ON users
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'users';
+        END
+    """)
+
+
+def epoch_timestamps(conn):
+    # key_pickups.timestamp (DATETIME) and key_returns.timestamp (TEXT) become
+    # integer seconds since the epoch (UTC) in a ``ts`` column, and loans
+    # follows. The tables are rebuilt since SQLite cannot change a column
+    # type; the triggers reading the old columns are replaced.
+    for trigger in ("trg_loans_pickup", "trg_loans_return", "trg_stats_pickup", "trg_stats_return",
+                    "trg_stats_loan_open", "trg_stats_loan_close"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    for table in ("key_pickups", "key_returns"):
+        conn.execute(f"""
+            CREATE TABLE {table}_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_rfid TEXT NOT NULL,
+                house_rfid TEXT NOT NULL,
+                ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                FOREIGN KEY (user_rfid) REFERENCES users (rfid_token),
+                FOREIGN KEY (house_rfid) REFERENCES houses (rfid_token)
+            )
+        """)
+        conn.execute(f"""
+            INSERT INTO {table}_new (id, user_rfid, house_rfid, ts)
+            SELECT id, user_rfid, house_rfid, COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), 0)
+            FROM {table}
+        """)
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+    # Time-range and ordered queries per key and per user
+    conn.execute("CREATE INDEX idx_pickups_house_ts ON key_pickups(house_rfid, ts)")
+    conn.execute("CREATE INDEX idx_pickups_user_ts ON key_pickups(user_rfid, ts)")
+    conn.execute("CREATE INDEX idx_pickups_ts ON key_pickups(ts)")
+    conn.execute("CREATE INDEX idx_returns_house_ts ON key_returns(house_rfid, ts)")
+    conn.execute("CREATE INDEX idx_returns_user_ts ON key_returns(user_rfid, ts)")
+
+    conn.execute("""
+        CREATE TABLE loans_new (
+            pickup_id INTEGER PRIMARY KEY,
+            return_id INTEGER,
+            user_rfid TEXT NOT NULL,
+            house_rfid TEXT NOT NULL,
+            pickup_ts INTEGER NOT NULL,
+            return_ts INTEGER
+        )
+    """)
+    conn.execute("""
+        INSERT INTO loans_new (pickup_id, return_id, user_rfid, house_rfid, pickup_ts, return_ts)
+        SELECT pickup_id, return_id, user_rfid, house_rfid,
+               COALESCE(CAST(strftime('%s', pickup_ts) AS INTEGER), 0),
+               CAST(strftime('%s', return_ts) AS INTEGER)
+        FROM loans
+    """)
+    conn.execute("DROP TABLE loans")
+    conn.execute("ALTER TABLE loans_new RENAME TO loans")
+    conn.execute("CREATE INDEX idx_loans_pickup_ts ON loans(pickup_ts)")
+    conn.execute("CREATE INDEX idx_loans_return_id ON loans(return_id) WHERE return_id IS NOT NULL")
+    conn.execute("CREATE INDEX idx_loans_open ON loans(pickup_ts) WHERE return_ts IS NULL")
+    conn.execute("CREATE INDEX idx_loans_open_key ON loans(house_rfid, user_rfid) WHERE return_ts IS NULL")
+    conn.execute("CREATE INDEX idx_loans_house_ts ON loans(house_rfid, pickup_ts)")
+    conn.execute("CREATE INDEX idx_loans_user_ts ON loans(user_rfid, pickup_ts)")
+
+    conn.execute("""
+        CREATE TRIGGER trg_loans_pickup AFTER INSERT ON key_pickups
+        BEGIN
+            INSERT INTO loans (pickup_id, user_rfid, house_rfid, pickup_ts)
+            VALUES (NEW.id, NEW.user_rfid, NEW.house_rfid, NEW.ts);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER trg_loans_return AFTER INSERT ON key_returns
+        BEGIN
+            UPDATE loans SET return_id = NEW.id, return_ts = NEW.ts
+            WHERE house_rfid = NEW.house_rfid
+            AND user_rfid = NEW.user_rfid
+            AND return_ts IS NULL
+            AND pickup_ts <= NEW.ts;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER trg_stats_pickup AFTER INSERT ON key_pickups
+        BEGIN
+            INSERT INTO daily_stats (day, pickups) VALUES (date(NEW.ts, 'unixepoch', 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET pickups = pickups + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER trg_stats_return AFTER INSERT ON key_returns
+        BEGIN
+            INSERT INTO daily_stats (day, returns) VALUES (date(NEW.ts, 'unixepoch', 'localtime'), 1)
+            ON CONFLICT (day) DO UPDATE SET returns = returns + 1;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER trg_stats_loan_open AFTER INSERT ON loans
+        BEGIN
+            INSERT INTO house_stats (house_rfid, pickups, open) VALUES (NEW.house_rfid, 1, 1)
+            ON CONFLICT (house_rfid) DO UPDATE SET pickups = pickups + 1, open = open + 1;
+            UPDATE counters SET value = value + 1 WHERE name = 'open_loans';
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER trg_stats_loan_close AFTER UPDATE OF return_ts ON loans
+        WHEN OLD.return_ts IS NULL AND NEW.return_ts IS NOT NULL
+        BEGIN
+            UPDATE house_stats SET open = open - 1 WHERE house_rfid = NEW.house_rfid;
+            UPDATE counters SET value = value - 1 WHERE name = 'open_loans';
+        END
+    """)
+
+
+def loan_limits(conn):
+    # Seconds a key may stay out, NULL for the default (see overdue_monitor.py)
+    conn.execute("ALTER TABLE users ADD COLUMN loan_limit INTEGER")
+    conn.execute("ALTER TABLE houses ADD COLUMN loan_limit INTEGER")
+
+
+def search_index(conn):
+    # Full-text index of user and house names and tokens for the search box,
+    # rowid 2 * id for users and 2 * id + 1 for houses. Deleted users and
+    # houses keep their row (deleted = 1), their loans are still in the
+    # history and only the index remembers their names.
+    conn.execute("""
+        CREATE VIRTUAL TABLE search_index USING fts5(
+            name, token, kind UNINDEXED, deleted UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+        )
+    """)
+    conn.execute("""
+        INSERT INTO search_index (rowid, name, token, kind, deleted)
+        SELECT 2 * id, name, rfid_token, 'user', 0 FROM users
+    """)
+    conn.execute("""
+        INSERT INTO search_index (rowid, name, token, kind, deleted)
+        SELECT 2 * id + 1, house_name, rfid_token, 'house', 0 FROM houses
+    """)
+    for table, kind, name, offset in (("users", "user", "name", 0), ("houses", "house", "house_name", 1)):
+        conn.execute(f"""
+            CREATE TRIGGER trg_search_{table}_add AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO search_index (rowid, name, token, kind, deleted)
+                VALUES (2 * NEW.id + {offset}, NEW.{name}, NEW.rfid_token, '{kind}', 0);
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER trg_search_{table}_update AFTER UPDATE OF {name}, rfid_token ON {table}
+            BEGIN
+                UPDATE search_index SET name = NEW.{name}, token = NEW.rfid_token
+                WHERE rowid = 2 * NEW.id + {offset};
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER trg_search_{table}_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE search_index SET deleted = 1 WHERE rowid = 2 * OLD.id + {offset};
+            END
+        """)
+
+
+def blob_uids(conn):
+    # Tokens become the raw UID bytes instead of zero-padded decimal text
+    # (a 7-byte UID: 7 bytes instead of 21 characters in every row and
+    # index), see uid.py. The columns are rewritten in place: a BLOB keeps
+    # its type in a TEXT column, and rebuilding the history tables would
+    # copy them once more. Indexes on the tokens are dropped first and built
+    # again afterwards, which is much faster than updating them row by row.
+    from uid import sql_uid
+    conn.create_function("uid", 1, sql_uid, deterministic=True)
+
+    token_indexes = ["idx_pickups_house_ts", "idx_pickups_user_ts", "idx_returns_house_ts",
+                     "idx_returns_user_ts", "idx_loans_house_ts", "idx_loans_user_ts", "idx_loans_open_key"]
+    index_sql = [sql for (sql,) in conn.execute(
+        f"SELECT sql FROM sqlite_master WHERE type = 'index' AND name IN ({', '.join('?' * len(token_indexes))})",
+        token_indexes)]
+    for name in token_indexes:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+    # Their replacements below store the token in the index as hex text
+    for table in ("users", "houses"):
+        conn.execute(f"DROP TRIGGER trg_search_{table}_update")
+
+    for table, columns in (("users", ["rfid_token"]), ("houses", ["rfid_token"]), ("keys", ["rfid_token"]),
+                           ("key_pickups", ["user_rfid", "house_rfid"]),
+                           ("key_returns", ["user_rfid", "house_rfid"]),
+                           ("loans", ["user_rfid", "house_rfid"]), ("house_stats", ["house_rfid"])):
+        assignments = ", ".join(f"{column} = uid({column})" for column in columns)
+        conn.execute(f"UPDATE {table} SET {assignments} WHERE typeof({columns[0]}) = 'text'")
+
+    for sql in index_sql:
+        conn.execute(sql)
+    # Deleted users and houses included
+    conn.execute("UPDATE search_index SET token = hex(uid(token))")
+    for table, kind, name, offset in (("users", "user", "name", 0), ("houses", "house", "house_name", 1)):
+        conn.execute(f"DROP TRIGGER trg_search_{table}_add")
+        conn.execute(f"""
+            CREATE TRIGGER trg_search_{table}_add AFTER INSERT ON {table}
+            BEGIN
+                INSERT INTO search_index (rowid, name, token, kind, deleted)
+                VALUES (2 * NEW.id + {offset}, NEW.{name}, hex(NEW.rfid_token), '{kind}', 0);
+            END
+        """)
+        conn.execute(f"""
+            CREATE TRIGGER trg_search_{table}_update AFTER UPDATE OF {name}, rfid_token ON {table}
+            BEGIN
+                UPDATE search_index SET name = NEW.{name}, token = hex(NEW.rfid_token)
+                WHERE rowid = 2 * NEW.id + {offset};
+            END
+        """)
+
+
+def scan_journal(conn):
+    # Sequence number of the last scan_journal.py entry committed, per
+    # journal file, written in the same transaction as the entry's scans
+    conn.execute("""
+        CREATE TABLE scan_journal (
+            name TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    """)
+
+
+MIGRATIONS = [
+    initial_schema,
+    loans,
+    dashboard_stats,
+    epoch_timestamps,
+    loan_limits,
+    search_index,
+    blob_uids,
+    scan_journal,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Apply all pending migrations. Returns the resulting schema version."""
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= schema_version(conn):
+            continue
+        # IMMEDIATE takes the write lock first, so two processes starting at
+        # once cannot both apply the same migration
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if number > schema_version(conn):
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    return schema_version(conn)
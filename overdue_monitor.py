@@ -0,0 +1,251 @@
+"""Flags keys that are out longer than their loan limit.
+
+A loan is due ``limit`` seconds after its pickup. The limit is the shorter
+of the house's and the user's ``loan_limit`` column, or DEFAULT_LOAN_LIMIT
+if neither is set. Open loans are kept in a min-heap keyed by due time,
+which Database.record_pickups/record_return/record_scans update as they
+commit, so the database is never scanned for overdue keys. Writes of other
+processes are noticed through ``PRAGMA data_version``; those of this
+process, which the hooks have seen already, are told apart by the highest
+pickup and return ids and the ``loan_limits`` counter.
+"""
+import heapq
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+from uid import uid_text
+
+DEFAULT_LOAN_LIMIT = 24 * 3600
+# More loans becoming overdue at once are logged as one line
+LOGGED_LOANS = 10
+
+log = logging.getLogger("kms.overdue")
+
+
+class OverdueMonitor:
+    """Open loans in a min-heap of (due, pickup_ts, house_rfid, user_rfid).
+
+    Does nothing until it is loaded. start() runs a thread that loads it,
+    then sleeps until the next due time, logs the loans that became overdue
+    and puts them on ``alerts`` as one list of (user_rfid, house_rfid,
+    pickup_ts, due) per wake-up; every loan is reported once. While the
+    thread runs it is the only one reading the database for the monitor:
+    check() and limits_changed() only ask it to. Without the thread, load()
+    and check() must always be called on the same thread. Returned loans are not removed
+    from the heap but skipped when they reach its top.
+    """
+
+    def __init__(self, db, default_limit=DEFAULT_LOAN_LIMIT):
+        self.db = db
+        self.default_limit = default_limit
+        self.user_limits = {}
+        self.house_limits = {}
+        self.loaded = False
+        self.alerts = queue.Queue()
+        self._heap = []
+        # (house_rfid, user_rfid) -> pickup times of its open loans, not yet due / overdue
+        self._open = {}
+        self._overdue = {}
+        self._data_version = None
+        # (last pickup id, last return id, loan_limits counter) when loaded,
+        # and the pickups and returns the hooks have seen since
+        self._signature = None
+        self._written = [0, 0]
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        # "check" / "reload", for the thread
+        self._requests = set()
+
+    def limit(self, user_rfid, house_rfid):
+        limits = [limit for limit in (self.house_limits.get(house_rfid), self.user_limits.get(user_rfid))
+                  if limit is not None]
+        return min(limits) if limits else self.default_limit
+
+    def load(self):
+        """Read the limits and the open loans, proportional to the keys out, not the history."""
+        data_version = self.db.conn.execute("PRAGMA data_version").fetchone()[0]
+        signature = self._read_signature()
+        user_limits, house_limits = self.db.loan_limits()
+        loans = self.db.open_loan_keys()
+        with self._cond:
+            self.user_limits = user_limits
+            self.house_limits = house_limits
+            self._data_version = data_version
+            self._signature = signature
+            self._written = [0, 0]
+            # Loans reported before a reload are not reported again
+            alerted = {(key, ts) for key, times in self._overdue.items() for ts in times}
+            self._heap = []
+            self._open = {}
+            self._overdue = {}
+            now = time.time()
+            for user_rfid, house_rfid, pickup_ts in loans:
+                key = (house_rfid, user_rfid)
+                due = pickup_ts + self.limit(user_rfid, house_rfid)
+                if due <= now and (key, pickup_ts) in alerted:
+                    self._overdue.setdefault(key, []).append(pickup_ts)
+                else:
+                    self._open.setdefault(key, []).append(pickup_ts)
+                    self._heap.append((due, pickup_ts, house_rfid, user_rfid))
+            heapq.heapify(self._heap)
+            self.loaded = True
+            self._cond.notify()
+
+    def _read_signature(self):
+        return self.db.last_pickup_id(), self.db.last_return_id(), self.db.counter("loan_limits")
+
+    def check(self):
+        """Reload if another process wrote pickups or returns or changed a
+        loan limit. Returns True on reload, or False when the thread does it."""
+        if self._thread is not None:
+            self._request("check")
+            return False
+        return self._check()
+
+    def _check(self):
+        if not self.loaded:
+            return False
+        data_version = self.db.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return False
+        self._data_version = data_version
+        signature = self._read_signature()
+        with self._cond:
+            pickups, returns = signature[0] - self._signature[0], signature[1] - self._signature[1]
+            if (pickups, returns, signature[2]) == (*self._written, self._signature[2]):
+                # Only this process wrote, through the hooks below
+                self._signature = signature
+                self._written = [0, 0]
+                return False
+        self.load()
+        return True
+
+    # Kept current by Database after each commit
+
+    def pickup(self, user_rfid, house_rfid, pickup_ts):
+        if not self.loaded:
+            return
+        with self._cond:
+            self._written[0] += 1
+            times = self._open.setdefault((house_rfid, user_rfid), [])
+            if pickup_ts in times:
+                return  # already read by a reload
+            times.append(pickup_ts)
+            due = pickup_ts + self.limit(user_rfid, house_rfid)
+            heapq.heappush(self._heap, (due, pickup_ts, house_rfid, user_rfid))
+            if self._heap[0][1:] == (pickup_ts, house_rfid, user_rfid):
+                # The thread sleeps until a later deadline
+                self._cond.notify()
+
+    def returned(self, user_rfid, house_rfid, return_ts):
+        # Like the loans trigger: closes every open loan of the key by the user
+        if not self.loaded:
+            return
+        with self._cond:
+            self._written[1] += 1
+            for loans in (self._open, self._overdue):
+                key = (house_rfid, user_rfid)
+                remaining = [ts for ts in loans.get(key, ()) if ts > return_ts]
+                if remaining:
+                    loans[key] = remaining
+                else:
+                    loans.pop(key, None)
+
+    def limits_changed(self):
+        """Recompute every due time after a loan limit was set."""
+        if self._thread is not None:
+            self._request("reload")
+        elif self.loaded:
+            self.load()
+
+    def _request(self, what):
+        with self._cond:
+            self._requests.add(what)
+            self._cond.notify()
+
+    # Queries
+
+    def overdue(self):
+        """Overdue loans as (user_rfid, house_rfid, pickup_ts, due), longest overdue first."""
+        self._pop_due(time.time())
+        with self._cond:
+            loans = [(user_rfid, house_rfid, ts, ts + self.limit(user_rfid, house_rfid))
+                     for (house_rfid, user_rfid), times in self._overdue.items() for ts in times]
+        return sorted(loans, key=lambda loan: loan[3])
+
+    def count(self):
+        self._pop_due(time.time())
+        with self._cond:
+            return sum(len(times) for times in self._overdue.values())
+
+    def next_due(self):
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    def _pop_due(self, now):
+        due = []
+        with self._cond:
+            while self._heap and self._heap[0][0] <= now:
+                due_ts, pickup_ts, house_rfid, user_rfid = heapq.heappop(self._heap)
+                key = (house_rfid, user_rfid)
+                times = self._open.get(key)
+                if not times or pickup_ts not in times:
+                    continue  # returned
+                times.remove(pickup_ts)
+                if not times:
+                    del self._open[key]
+                self._overdue.setdefault(key, []).append(pickup_ts)
+                due.append((user_rfid, house_rfid, pickup_ts, due_ts))
+        if len(due) > LOGGED_LOANS:
+            # e.g. at startup after a weekend
+            log.warning("%d Schlüssel überfällig", len(due))
+        elif due:
+            for user_rfid, house_rfid, pickup_ts, _ in due:
+                log.warning("Schlüssel überfällig: %s bei %s seit %s",
+                            self.db.house_name(house_rfid) or uid_text(house_rfid),
+                            self.db.user_name(user_rfid) or uid_text(user_rfid),
+                            time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(pickup_ts)))
+        if due:
+            self.alerts.put(due)
+        return due
+
+    # Background thread
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="overdue-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            with self._cond:
+                self._stopping = True
+                self._cond.notify()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        requests = set() if self.loaded else {"reload"}
+        while True:
+            try:
+                if "reload" in requests:
+                    self.load()
+                elif "check" in requests:
+                    self._check()
+            except sqlite3.Error as e:
+                # Tried again at the next check
+                log.error("open loans not read: %s", e)
+            self._pop_due(time.time())
+            with self._cond:
+                if self._stopping:
+                    return
+                if not self._requests:
+                    # Wakes at the next due time, or earlier when a pickup is
+                    # due sooner or a check or reload is asked for
+                    timeout = max(0.0, self._heap[0][0] - time.time()) if self._heap else None
+                    self._cond.wait(timeout)
+                requests, self._requests = self._requests, set()
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+from uid import to_uid
+
+# Written by sessions before scans went to the scan journal (scan_journal.py)
+STAGING_PATH = "pickup_session.staging"
+
+
+def utc_timestamp():
+    # Seconds since the epoch, as stored in key_pickups.ts; staging files
+    # written before that hold 'YYYY-MM-DD HH:MM:SS' strings, which
+    # Database.record_pickups accepts as well
+    return int(time.time())
+
+
+class PickupSession:
+    """Pickups of one user at the desk.
+
+    Every scan is written to the scan journal by ``writer`` (a
+    db_writer.DatabaseWriter with a ScanJournal) as soon as it is staged and
+    applied to the database in the background, so nothing is lost when the
+    session is interrupted and staging never waits for the database. The
+    session only remembers what the desk shows. Tokens are kept as UID bytes.
+
+    ``stage`` blocks until the journal is fsync'd. The GUI splits it: it
+    runs ``write`` on a worker thread and ``add``s the row on the Tk thread
+    when that is done; ``writing`` holds the houses in between.
+    """
+
+    def __init__(self, user_rfid, user_name, writer=None):
+        self.user_rfid = to_uid(user_rfid)
+        self.user_name = user_name
+        self.writer = writer
+        self.rows = []
+        self.house_names = []
+        self.writing = set()
+
+    def contains(self, house_rfid):
+        house_rfid = to_uid(house_rfid)
+        return house_rfid in self.writing or any(row[1] == house_rfid for row in self.rows)
+
+    def stage(self, house_rfid, house_name, timestamp=None):
+        self.add(self.write(house_rfid, timestamp), house_name)
+
+    def write(self, house_rfid, timestamp=None):
+        """Write the pickup to the scan journal, returns its row."""
+        row = (self.user_rfid, to_uid(house_rfid), timestamp or utc_timestamp())
+        self.writer.write([("pickup", *row)])
+        return row
+
+    def add(self, row, house_name):
+        self.rows.append(row)
+        self.house_names.append(house_name)
+
+
+def load_staged(staging_path=STAGING_PATH):
+    """Return the PickupSession an interrupted run of an older version left in
+    its staging file, or None. Its rows have not been written anywhere else."""
+    if not os.path.exists(staging_path):
+        return None
+    session = None
+    with open(staging_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn last line from a crash mid-write
+                break
+            if session is None:
+                session = PickupSession(record["user_rfid"], record["user_name"])
+            else:
+                # Files written before tokens were bytes hold decimal text
+                session.rows.append((session.user_rfid, to_uid(record["house_rfid"]), record["timestamp"]))
+                session.house_names.append(record["house_name"])
+    if session is None:
+        os.remove(staging_path)
+    return session
+
+
+def discard_staged(staging_path=STAGING_PATH):
+    if os.path.exists(staging_path):
+        os.remove(staging_path)
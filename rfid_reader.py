@@ -0,0 +1,229 @@
+import queue
+import threading
+import time
+
+from instrumentation import observe, timed
+from uid import legacy_text
+
+
+def parse_uid_line(line):
+    # "Card UID: 04 A2 1F 9C" -> b"\x04\xa2\x1f\x9c", see uid.py
+    if not line.startswith("Card UID:"):
+        return None
+    uid_hex = line[len("Card UID:"):].strip()
+    if not uid_hex:
+        return None
+    try:
+        return bytes.fromhex(uid_hex)
+    except ValueError:
+        pass
+    # Bytes not printed as two digits each ("4 A2 1F 9C")
+    try:
+        return bytes(int(byte, 16) for byte in uid_hex.split())
+    except ValueError:
+        return None
+
+
+class ScanHandlerError(Exception):
+    """Passed to RfidReader.poll's ``on_error`` when the token callback
+    raised; the exception it raised is its ``__cause__``."""
+
+
+@timed("rfid.read_once")
+def read_rfid_uid(serial_port="/dev/ttyUSB0", baud_rate=9600, timeout=5):
+    # One-shot blocking read for scripts, the GUI uses RfidReader instead
+    import serial
+    with serial.Serial(serial_port, baud_rate, timeout=timeout) as ser:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            token = parse_uid_line(ser.readline().decode('utf-8', errors='replace').strip())
+            if token:
+                return token
+    return None
+
+
+def read_rfid_as_decimal_string(serial_port="/dev/ttyUSB0", baud_rate=9600, timeout=5):
+    # The token in the form used before tokens were stored as bytes
+    token = read_rfid_uid(serial_port, baud_rate, timeout)
+    return None if token is None else legacy_text(token)
+
+
+class SerialBackend:
+    def __init__(self, serial_port="/dev/ttyUSB0", baud_rate=9600, timeout=0.5):
+        self.serial_port = serial_port
+        self.baud_rate = baud_rate
+        self.timeout = timeout
+        self.ser = None
+
+    def open(self):
+        # pyserial is imported on first use, so the core and CLI never load it
+        import serial
+        self.ser = serial.Serial(self.serial_port, self.baud_rate, timeout=self.timeout)
+
+    def readline(self):
+        # Returns "" on timeout so the reader thread can check for stop requests
+        return self.ser.readline().decode('utf-8', errors='replace')
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+
+
+class FakeBackend:
+    """In-memory reader feed for benchmarks and running without hardware."""
+
+    def __init__(self, timeout=0.5):
+        self.timeout = timeout
+        self.lines = queue.Queue()
+
+    def feed_uid(self, uid_bytes):
+        self.lines.put("Card UID: " + " ".join(f"{b:02X}" for b in uid_bytes) + "\n")
+
+    def feed_line(self, line):
+        self.lines.put(line)
+
+    def open(self):
+        pass
+
+    def readline(self):
+        try:
+            return self.lines.get(timeout=self.timeout)
+        except queue.Empty:
+            return ""
+
+    def close(self):
+        pass
+
+
+class RfidReader:
+    """Keeps the reader open in a background thread and queues decoded tokens.
+
+    The GUI drains ``tokens`` from the Tk main loop (see ``poll``), so no
+    serial I/O ever happens on the UI thread. ``token_time`` is the
+    perf_counter() at which the token being handled was read, for measuring
+    scan-to-commit latency.
+    """
+
+    def __init__(self, backend=None, debounce=1.5, reconnect_delay=2.0):
+        self.backend = backend if backend is not None else SerialBackend()
+        self.debounce = debounce
+        self.reconnect_delay = reconnect_delay
+        self.tokens = queue.Queue()
+        self.errors = queue.Queue()
+        self.connected = False
+        self.token_time = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_token = None
+        self._last_time = 0.0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rfid-reader", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.backend.open()
+            except Exception as e:
+                self._report_error(e)
+                self._stop.wait(self.reconnect_delay)
+                continue
+
+            self.connected = True
+            try:
+                while not self._stop.is_set():
+                    line = self.backend.readline()
+                    if line:
+                        self._handle_line(line.strip())
+            except Exception as e:
+                self._report_error(e)
+            finally:
+                self.connected = False
+                try:
+                    self.backend.close()
+                except Exception:
+                    pass
+
+            if not self._stop.is_set():
+                self._stop.wait(self.reconnect_delay)
+
+    def _report_error(self, error):
+        # Only keep the latest error, a disconnected reader would otherwise flood the queue
+        while not self.errors.empty():
+            try:
+                self.errors.get_nowait()
+            except queue.Empty:
+                break
+        self.errors.put(error)
+
+    def _handle_line(self, line):
+        token = parse_uid_line(line)
+        if token is None:
+            return
+        read_time = time.perf_counter()
+        now = time.monotonic()
+        # A card held on the reader repeats its UID, only report it once
+        if token == self._last_token and now - self._last_time < self.debounce:
+            self._last_time = now
+            return
+        self._last_token = token
+        self._last_time = now
+        self.tokens.put((token, read_time))
+
+    def get_token(self, timeout=None):
+        try:
+            return self.tokens.get(timeout=timeout)[0]
+        except queue.Empty:
+            return None
+
+    def clear(self):
+        while True:
+            try:
+                self.tokens.get_nowait()
+            except queue.Empty:
+                return
+
+    def poll(self, root, callback, interval=50, on_error=None):
+        """Drain queued tokens on the Tk main loop every ``interval`` ms.
+
+        ``on_error(error)`` is called with the reader's errors, and with a
+        ScanHandlerError when ``callback`` raised; the next token is
+        delivered either way.
+        """
+        try:
+            while True:
+                try:
+                    token, self.token_time = self.tokens.get_nowait()
+                except queue.Empty:
+                    break
+                start = time.perf_counter()
+                observe("rfid.queue_wait", start - self.token_time)
+                try:
+                    callback(token)
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    error = ScanHandlerError(str(e))
+                    error.__cause__ = e
+                    on_error(error)
+                observe("scan.handle", time.perf_counter() - start)
+            if on_error is not None:
+                while True:
+                    try:
+                        error = self.errors.get_nowait()
+                    except queue.Empty:
+                        break
+                    on_error(error)
+        finally:
+            root.after(interval, self.poll, root, callback, interval, on_error)
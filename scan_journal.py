@@ -0,0 +1,164 @@
+"""Append-only journal of pickup and return scans in front of the database.
+
+A scan is safe once its line is in the journal: append() writes it and
+fsyncs the file before returning, so a desk can confirm a key while the
+database is locked or slow. db_writer.DatabaseWriter applies journal
+entries to the database in the background and stores the sequence number
+of the last one it committed in the scan_journal table, in the same
+transaction, so an entry is never applied twice and entries left over by
+a crash are applied again at the next start.
+
+Every line is one JSON object. Entries are {"seq": N, "events": [[kind,
+user, house, ts], ...]} with tokens as hex; the events of one entry are
+always committed together. compact() rewrites the file as a {"seq": N}
+line, standing for the applied entries up to N, followed by the entries
+not applied yet, so the file stays small and sequence numbers continue
+after a restart. A journal file belongs to one process.
+
+Entries the database refuses for good (a malformed event, say) are moved
+to ``<path>.rejects`` by reject(), with the error, so they can be looked
+at and entered again by hand; they do not hold up the entries after them.
+"""
+import json
+import os
+import threading
+
+from uid import to_uid, uid_text
+
+JOURNAL_PATH = "scans.journal"
+
+
+class ScanJournal:
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        # Key of the journal's row in the scan_journal table
+        self.name = os.path.basename(path)
+        self.last_seq = 0
+        self.applied_seq = 0
+        # seq -> line of the entries not applied yet, in order
+        self._pending = {}
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """Open the journal for appending, returns the entries found in it as
+        (seq, events) pairs."""
+        entries = []
+        torn = False
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line from a crash mid-write
+                        torn = True
+                        break
+                    self.last_seq = max(self.last_seq, record["seq"])
+                    if "events" in record:
+                        self._pending[record["seq"]] = line if line.endswith("\n") else line + "\n"
+                        entries.append((record["seq"], [_from_json(event) for event in record["events"]]))
+                    else:
+                        self.applied_seq = record["seq"]
+        self._file = open(self.path, "a", encoding="utf-8")
+        if torn:
+            # The next line must not be appended to the torn one
+            self.compact()
+        return entries
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def append(self, entries):
+        """Write lists of ("pickup" | "return", user, house, ts) events as one
+        entry each and fsync once. Returns their sequence numbers."""
+        with self._lock:
+            seqs = list(range(self.last_seq + 1, self.last_seq + 1 + len(entries)))
+            lines = [json.dumps({"seq": seq, "events": [_to_json(e) for e in events]}) + "\n"
+                     for seq, events in zip(seqs, entries)]
+            end = self._file.tell()
+            try:
+                self._file.write("".join(lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            except OSError:
+                # Nothing of a failed append may be applied later
+                try:
+                    self._file.truncate(end)
+                except OSError:
+                    pass
+                raise
+            self.last_seq += len(entries)
+            self._pending.update(zip(seqs, lines))
+            return seqs
+
+    def applied(self, seq):
+        """Forget the entries up to ``seq``, they are in the database."""
+        with self._lock:
+            self.applied_seq = max(self.applied_seq, seq)
+            for pending in [s for s in self._pending if s <= seq]:
+                del self._pending[pending]
+
+    def reject(self, seq, events, error):
+        """Append entry ``seq`` with ``error`` to the rejects file and fsync it.
+        The caller still has to mark it applied."""
+        try:
+            events = [_to_json(event) for event in events]
+        except (TypeError, ValueError):
+            events = [repr(event) for event in events]
+        line = json.dumps({"seq": seq, "events": events, "error": str(error)}) + "\n"
+        with self._lock:
+            with open(self.path + ".rejects", "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def pending(self):
+        """Number of entries not applied yet."""
+        with self._lock:
+            return len(self._pending)
+
+    def size(self):
+        with self._lock:
+            return self._file.tell()
+
+    def compact(self):
+        """Rewrite the journal without the entries already applied."""
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"seq": self.last_seq if not self._pending else self.applied_seq}) + "\n")
+                f.write("".join(self._pending.values()))
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            _fsync_dir(self.path)
+            self._file = open(self.path, "a", encoding="utf-8")
+
+
+def _to_json(event):
+    kind, user_rfid, house_rfid, timestamp = event
+    return [kind, uid_text(to_uid(user_rfid)), uid_text(to_uid(house_rfid)), timestamp]
+
+
+def _from_json(event):
+    kind, user_rfid, house_rfid, timestamp = event
+    return kind, to_uid(user_rfid), to_uid(house_rfid), timestamp
+
+
+def _fsync_dir(path):
+    # Makes the rename itself durable
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,276 @@
+"""Serves several RFID key desks (stations) on one database.
+
+Usage: python station_hub.py --station Empfang=/dev/ttyUSB0:pickup \
+                             --station Hof=/dev/ttyUSB1:return
+
+Every station has its own reader and session: a user card starts a session,
+the house keys scanned after it are picked up or returned, depending on the
+station's mode. Readers are read on one asyncio event loop; all writes go
+through a single DatabaseWriter thread that commits whatever has queued up
+in one transaction, so stations never contend for the database lock. Scans
+are confirmed once they are in the hub's scan journal (station_hub.journal,
+see scan_journal.py), a locked or slow database only delays their commit.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import termios
+import time
+import tty
+
+from database import DB_PATH, Database
+from db_writer import DatabaseWriter
+from instrumentation import dump_prometheus, observe
+from pickup_session import utc_timestamp
+from rfid_reader import parse_uid_line
+from scan_journal import ScanJournal
+from uid import uid_text
+
+# A station forgets its user after this many seconds without a scan
+SESSION_IDLE_TIMEOUT = 60.0
+TOKEN_INDEX_CHECK_INTERVAL = 2.0
+# How often the timings are written with --metrics
+METRICS_DUMP_INTERVAL = 15.0
+JOURNAL_PATH = "station_hub.journal"
+
+log = logging.getLogger("kms.hub")
+
+
+def open_serial(port, baud_rate=9600):
+    """Open a serial port (or pty) in raw mode as an unbuffered binary file."""
+    fd = os.open(port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        attrs = termios.tcgetattr(fd)
+        speed = getattr(termios, f"B{baud_rate}")
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    except Exception:
+        os.close(fd)
+        raise
+    return os.fdopen(fd, "rb", buffering=0)
+
+
+class Station:
+    """One key desk: its reader and its current user session."""
+
+    def __init__(self, name, port, mode="pickup", baud_rate=9600, debounce=1.5):
+        if mode not in ("pickup", "return"):
+            raise ValueError(f"unknown station mode: {mode}")
+        self.name = name
+        self.port = port
+        self.mode = mode
+        self.baud_rate = baud_rate
+        self.debounce = debounce
+        self.connected = False
+        self.user_rfid = None
+        self.user_name = None
+        self.seen = set()
+        self.last_scan = 0.0
+        self._last_token = None
+        self._last_time = 0.0
+
+    def start_session(self, token, name):
+        self.user_rfid = token
+        self.user_name = name
+        self.seen = set()
+
+    def end_session(self):
+        self.user_rfid = None
+        self.user_name = None
+        self.seen = set()
+
+    def is_repeat(self, token, now):
+        # A card held on the reader repeats its UID, only handle it once
+        repeat = token == self._last_token and now - self._last_time < self.debounce
+        self._last_token = token
+        self._last_time = now
+        return repeat
+
+
+class StationHub:
+    """Reads all stations on one event loop and records their scans.
+
+    ``on_event(station, status, detail, latency)`` is called for every
+    handled scan. ``status`` is one of "session", "pickup", "return",
+    "duplicate", "no_user", "unknown" or "error"; ``latency`` is the time in
+    seconds from reading the line until a pickup or return is in the scan
+    journal at ``journal_path``, or committed if that is None. With
+    ``metrics_file`` the timings are written there in Prometheus text format
+    every METRICS_DUMP_INTERVAL seconds.
+    """
+
+    def __init__(self, db, stations, on_event=None, reconnect_delay=2.0,
+                 idle_timeout=SESSION_IDLE_TIMEOUT, metrics_file=None, journal_path=JOURNAL_PATH):
+        self.db = db
+        self.stations = stations
+        self.on_event = on_event
+        self.reconnect_delay = reconnect_delay
+        self.idle_timeout = idle_timeout
+        self.metrics_file = metrics_file
+        self.writer = DatabaseWriter(Database(db.path, db.timeout),
+                                     ScanJournal(journal_path) if journal_path else None)
+        self._latency_name = "scan.to_journal" if journal_path else "scan.to_commit"
+        self._tasks = []
+        self._pending = set()
+
+    def _emit(self, station, status, detail="", latency=None):
+        if self.on_event is not None:
+            self.on_event(station, status, detail, latency)
+
+    async def start(self):
+        self.db.tokens.load()
+        self.writer.start()
+        self._tasks = [asyncio.create_task(self._read_station(station)) for station in self.stations]
+        self._tasks.append(asyncio.create_task(self._check_tokens()))
+        if self.metrics_file:
+            self._tasks.append(asyncio.create_task(self._dump_metrics()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Let queued scans reach the journal or database before the writer exits
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        await asyncio.to_thread(self.writer.stop)
+
+    async def run(self):
+        await self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    async def _check_tokens(self):
+        # Users and houses may be added by the GUI while the hub runs
+        while True:
+            await asyncio.sleep(TOKEN_INDEX_CHECK_INTERVAL)
+            try:
+                self.db.tokens.check()
+            except sqlite3.Error as e:
+                # Checked again after TOKEN_INDEX_CHECK_INTERVAL
+                log.warning("token index not checked: %s", e)
+
+    async def _dump_metrics(self):
+        while True:
+            await asyncio.sleep(METRICS_DUMP_INTERVAL)
+            try:
+                dump_prometheus(self.metrics_file)
+            except OSError as e:
+                print(f"Metriken konnten nicht geschrieben werden: {e}", flush=True)
+
+    async def _read_station(self, station):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                f = open_serial(station.port, station.baud_rate)
+            except OSError as e:
+                self._emit(station, "error", str(e))
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            reader = asyncio.StreamReader()
+            transport, _ = await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), f)
+            station.connected = True
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    token = parse_uid_line(line.decode("utf-8", errors="replace").strip())
+                    if token is not None:
+                        self.handle_token(station, token, time.perf_counter())
+            except OSError as e:
+                self._emit(station, "error", str(e))
+            finally:
+                station.connected = False
+                transport.close()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def handle_token(self, station, token, received):
+        if station.is_repeat(token, received):
+            return
+        if station.user_rfid is not None and received - station.last_scan > self.idle_timeout:
+            station.end_session()
+        station.last_scan = received
+
+        # Lookups are served from the in-memory token index
+        house_name = self.db.tokens.house_name(token)
+        if house_name is None:
+            user_name = self.db.tokens.user_name(token)
+            if user_name is None:
+                self._emit(station, "unknown", uid_text(token))
+            else:
+                station.start_session(token, user_name)
+                self._emit(station, "session", user_name)
+            return
+        if station.user_rfid is None:
+            self._emit(station, "no_user", house_name)
+            return
+        if token in station.seen:
+            self._emit(station, "duplicate", house_name)
+            return
+        station.seen.add(token)
+
+        future = self.writer.submit((station.mode, station.user_rfid, token, utc_timestamp()))
+        self._pending.add(future)
+
+        def committed(future):
+            self._pending.discard(future)
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self._emit(station, "error", str(future.exception()))
+            else:
+                latency = time.perf_counter() - received
+                observe(self._latency_name, latency)
+                self._emit(station, station.mode, house_name, latency)
+
+        future.add_done_callback(committed)
+
+
+def parse_station(spec):
+    # NAME=PORT[:MODE]
+    name, _, rest = spec.partition("=")
+    port, _, mode = rest.partition(":")
+    if not name or not port:
+        raise argparse.ArgumentTypeError(f"expected NAME=PORT[:pickup|return], got {spec!r}")
+    if mode not in ("", "pickup", "return"):
+        raise argparse.ArgumentTypeError(f"unknown station mode: {mode}")
+    return Station(name, port, mode or "pickup")
+
+
+def print_event(station, status, detail, latency):
+    suffix = f" ({latency * 1000:.1f} ms)" if latency is not None else ""
+    print(f"[{station.name}] {status}: {detail}{suffix}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mehrere Schlüsselstationen an einer Datenbank")
+    parser.add_argument("--db", default=DB_PATH, help="Datenbankdatei")
+    parser.add_argument("--station", type=parse_station, action="append", required=True,
+                        metavar="NAME=PORT[:MODE]", help="Station mit Leser und Modus (pickup/return)")
+    parser.add_argument("--metrics", metavar="DATEI",
+                        help="Zeitmessungen regelmäßig im Prometheus-Textformat in diese Datei schreiben")
+    parser.add_argument("--journal", default=JOURNAL_PATH, metavar="DATEI",
+                        help="Scan-Journal, in das jeder Scan vor der Datenbank geschrieben wird")
+    args = parser.parse_args(argv)
+
+    db = Database(args.db)
+    db.create_schema()
+    hub = StationHub(db, args.station, on_event=print_event, metrics_file=args.metrics,
+                     journal_path=args.journal)
+    try:
+        asyncio.run(hub.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
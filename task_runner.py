@@ -0,0 +1,192 @@
+"""Runs database and file work on worker threads instead of the Tk main loop.
+
+``submit(fn, *args)`` queues ``fn`` for a worker thread and returns a Task.
+When it has finished, ``poll()`` (drained with ``root.after`` on the Tk
+thread, like RfidReader.poll) calls ``on_done(result)`` or
+``on_error(exception)`` there, so callbacks may touch widgets and functions
+run on the worker must not. database.Database gives every thread its own
+connection, so Database and KeyManagement methods can run on a worker as
+they are.
+
+Tasks submitted with a ``key`` are coalesced: while one is still queued, a
+new one with the same key replaces its function and callbacks, and while
+one is running, at most one more is queued to run after it. Clicking
+Refresh five times in a row therefore reads the database at most twice.
+
+A single worker (the default) runs tasks in the order they were submitted,
+so a list reloaded after an add always sees the new row.
+"""
+import logging
+import queue
+import threading
+import time
+
+from instrumentation import observe
+
+log = logging.getLogger("kms.tasks")
+
+_current = threading.local()
+
+
+def report_progress(done, total=None):
+    """Progress of the task running on the calling thread, shown while it is busy."""
+    task = getattr(_current, "task", None)
+    if task is not None:
+        task.progress = (done, total)
+
+
+class Task:
+    """One submitted function; ``progress`` is (done, total or None) once reported."""
+
+    def __init__(self, fn, args, key, name, label, on_done, on_error):
+        self.fn = fn
+        self.args = args
+        self.key = key
+        # Timed as "task.<name>"
+        self.name = name or (key if isinstance(key, str) else getattr(fn, "__name__", "task"))
+        self.label = label
+        self.on_done = on_done
+        self.on_error = on_error
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.running = False
+        self.done = False
+        self.submitted = time.perf_counter()
+
+
+class TaskRunner:
+    """Worker threads for Task functions; ``active`` lists the queued and running ones.
+
+    ``close`` is called on every worker thread before it exits, e.g.
+    Database.close to close that thread's connection.
+    """
+
+    def __init__(self, workers=1, close=None):
+        self.workers = workers
+        self.close = close
+        self.active = []
+        self._queue = queue.Queue()
+        self._finished = queue.Queue()
+        self._lock = threading.Lock()
+        # key -> Task, queued but not started / running / to start after the running one
+        self._queued = {}
+        self._running = {}
+        self._waiting = {}
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"task-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=5.0):
+        """Let the workers finish the tasks queued so far, then end them."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, fn, *args, key=None, name=None, label=None, on_done=None, on_error=None):
+        """Queue fn(*args). ``label`` is shown while it is busy, ``name`` (default:
+        ``key`` or the function's name) is its timer."""
+        task = Task(fn, args, key, name, label, on_done, on_error)
+        with self._lock:
+            if key is not None:
+                pending = self._queued.get(key) or self._waiting.get(key)
+                if pending is not None:
+                    # Not started yet, the newer request takes its place
+                    pending.fn, pending.args, pending.label = fn, args, label
+                    pending.on_done, pending.on_error = on_done, on_error
+                    return pending
+                if key in self._running:
+                    # The running one may have read the data before the
+                    # change this request is about, run once more after it
+                    self._waiting[key] = task
+                    self.active.append(task)
+                    return task
+                self._queued[key] = task
+            self.active.append(task)
+        self._queue.put(task)
+        return task
+
+    def _run(self):
+        try:
+            while True:
+                task = self._queue.get()
+                if task is None:
+                    return
+                with self._lock:
+                    if task.key is not None:
+                        del self._queued[task.key]
+                        self._running[task.key] = task
+                    task.running = True
+                start = time.perf_counter()
+                observe("task.queue_wait", start - task.submitted)
+                _current.task = task
+                try:
+                    task.result = task.fn(*task.args)
+                except Exception as e:
+                    task.error = e
+                finally:
+                    _current.task = None
+                observe(f"task.{task.name}", time.perf_counter() - start)
+                with self._lock:
+                    if task.key is not None:
+                        del self._running[task.key]
+                        waiting = self._waiting.pop(task.key, None)
+                        if waiting is not None:
+                            self._queued[task.key] = waiting
+                            self._queue.put(waiting)
+                self._finished.put(task)
+        finally:
+            if self.close is not None:
+                self.close()
+
+    def busy(self):
+        with self._lock:
+            return list(self.active)
+
+    def deliver(self):
+        """Run the callbacks of finished tasks on the calling (Tk) thread."""
+        while True:
+            try:
+                task = self._finished.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self.active.remove(task)
+            task.done = True
+            if task.error is None:
+                if task.on_done is not None:
+                    task.on_done(task.result)
+            elif task.on_error is not None:
+                task.on_error(task.error)
+            else:
+                log.error("task %s failed", task.name, exc_info=task.error)
+
+    def poll(self, root, interval=20, on_busy=None):
+        """Deliver finished tasks on the Tk main loop every ``interval`` ms.
+
+        ``on_busy(tasks)`` is called with the active tasks whenever they or
+        their progress change.
+        """
+        shown = None
+
+        def tick():
+            nonlocal shown
+            try:
+                self.deliver()
+                if on_busy is not None:
+                    tasks = self.busy()
+                    state = [(id(task), task.progress) for task in tasks]
+                    if state != shown:
+                        shown = state
+                        on_busy(tasks)
+            finally:
+                root.after(interval, tick)
+
+        tick()
@@ -0,0 +1,32 @@
+"""Timers and the metrics registry (instrumentation.py)."""
+from instrumentation import instrument, metrics, observe, timed
+
+
+@timed("test.timed")
+def timed_function():
+    pass
+
+
+class Instrumented:
+    def method(self):
+        pass
+
+
+instrument(Instrumented, "test.instrumented")
+
+
+def test_reset_keeps_decorated_timers_recording():
+    timed_function()
+    Instrumented().method()
+    observe("test.observed", 0.001)
+    metrics.reset()
+    assert metrics.histograms["test.timed"].count == 0
+
+    timed_function()
+    Instrumented().method()
+    observe("test.observed", 0.002)
+    assert metrics.histograms["test.timed"].count == 1
+    assert metrics.histograms["test.instrumented.method"].count == 1
+    histogram = metrics.histograms["test.observed"]
+    assert (histogram.count, histogram.sum, histogram.max, list(histogram.recent)) == (1, 0.002, 0.002, [0.002])
+    assert sum(histogram.counts) == 1
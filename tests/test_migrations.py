@@ -0,0 +1,169 @@
+"""Migrating a database with the original schema and data (user_version 0)."""
+import calendar
+import sqlite3
+import time
+
+import pytest
+
+from database import Database
+from migrations import MIGRATIONS, initial_schema, migrate, schema_version
+from uid import legacy_text, to_uid
+
+USERS = {"Anna": b"\x04\xa2\x1f\x9c", "Ben": b"\x04\x11\x22\x33\x44\x55\x66"}
+HOUSES = {"Haus Nord": b"\x09\x00\x00\x01", "Haus Süd": b"\x09\x00\x00\x02", "Haus Ost": b"\x09\x00\x00\x03"}
+
+# (user, house, 'YYYY-MM-DD HH:MM:SS' UTC) in id order, as the old program wrote them
+PICKUPS = [
+    ("Anna", "Haus Nord", "2024-01-01 08:00:00"),
+    ("Ben", "Haus Süd", "2024-01-01 09:00:00"),
+    ("Anna", "Haus Nord", "2024-01-02 08:00:00"),
+    ("Ben", "Haus Ost", "2024-01-03 11:00:00"),
+    ("Anna", "Haus Süd", "2024-01-03 23:30:00"),
+]
+RETURNS = [
+    ("Anna", "Haus Nord", "2024-01-01 17:00:00"),
+    # Of a key Anna never picked up, closes nothing
+    ("Anna", "Haus Ost", "2024-01-02 12:00:00"),
+    ("Ben", "Haus Süd", "2024-01-03 10:00:00"),
+]
+
+
+def legacy(kind, name):
+    return legacy_text((USERS if kind == "user" else HOUSES)[name])
+
+
+def epoch(text):
+    return calendar.timegm(time.strptime(text, "%Y-%m-%d %H:%M:%S"))
+
+
+def local_day(text):
+    return time.strftime("%Y-%m-%d", time.localtime(epoch(text)))
+
+
+@pytest.fixture
+def path(tmp_path):
+    """A database as the program wrote it before migrations existed."""
+    path = str(tmp_path / "key_management.db")
+    conn = sqlite3.connect(path)
+    initial_schema(conn)
+    for name in USERS:
+        conn.execute("INSERT INTO users (name, rfid_token) VALUES (?, ?)", (name, legacy("user", name)))
+    for name in HOUSES:
+        conn.execute("INSERT INTO houses (house_name, rfid_token) VALUES (?, ?)", (name, legacy("house", name)))
+        conn.execute("INSERT INTO keys (rfid_token, status) VALUES (?, 'available')", (legacy("house", name),))
+    for user, house, ts in PICKUPS:
+        conn.execute("INSERT INTO key_pickups (user_rfid, house_rfid, timestamp) VALUES (?, ?, ?)",
+                     (legacy("user", user), legacy("house", house), ts))
+    for user, house, ts in RETURNS:
+        conn.execute("INSERT INTO key_returns (user_rfid, house_rfid, timestamp) VALUES (?, ?, ?)",
+                     (legacy("user", user), legacy("house", house), ts))
+    conn.commit()
+    assert schema_version(conn) == 0
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def db(path):
+    db = Database(path)
+    db.create_schema()
+    yield db
+    db.close()
+
+
+def expected_loans():
+    # A pickup is closed by the first later return of the key by the user
+    loans = []
+    for pickup_id, (user, house, ts) in enumerate(PICKUPS, start=1):
+        closing = [(return_ts, return_id) for return_id, (r_user, r_house, return_ts) in enumerate(RETURNS, start=1)
+                   if (r_user, r_house) == (user, house) and return_ts > ts]
+        return_ts, return_id = min(closing) if closing else (None, None)
+        loans.append((pickup_id, return_id, USERS[user], HOUSES[house], epoch(ts),
+                      epoch(return_ts) if return_ts else None))
+    return loans
+
+
+def test_migrates_to_the_latest_version(db):
+    assert schema_version(db.conn) == len(MIGRATIONS)
+
+
+def test_loans_match_pickups_and_returns(db):
+    rows = db.conn.execute(
+        "SELECT pickup_id, return_id, user_rfid, house_rfid, pickup_ts, return_ts FROM loans ORDER BY pickup_id")
+    assert rows.fetchall() == expected_loans()
+
+
+def test_stats_match_pickups_and_returns(db):
+    loans = expected_loans()
+    days = {}
+    for _, _, ts in PICKUPS:
+        days.setdefault(local_day(ts), [0, 0])[0] += 1
+    for _, _, ts in RETURNS:
+        days.setdefault(local_day(ts), [0, 0])[1] += 1
+    assert {day: [pickups, returns] for day, pickups, returns in db.conn.execute(
+        "SELECT day, pickups, returns FROM daily_stats")} == days
+
+    houses = {}
+    for _, _, _, house, _, return_ts in loans:
+        stats = houses.setdefault(house, [0, 0])
+        stats[0] += 1
+        stats[1] += return_ts is None
+    assert {house: [pickups, open_] for house, pickups, open_ in db.conn.execute(
+        "SELECT house_rfid, pickups, open FROM house_stats")} == houses
+
+    assert db.counter("users") == len(USERS)
+    assert db.counter("open_loans") == sum(loan[5] is None for loan in loans)
+
+
+def test_timestamps_round_trip(db):
+    pickups = db.conn.execute("SELECT ts, datetime(ts, 'unixepoch') FROM key_pickups ORDER BY id").fetchall()
+    assert pickups == [(epoch(ts), ts) for _, _, ts in PICKUPS]
+    returns = db.conn.execute("SELECT ts, datetime(ts, 'unixepoch') FROM key_returns ORDER BY id").fetchall()
+    assert returns == [(epoch(ts), ts) for _, _, ts in RETURNS]
+    # As the assignments view shows them
+    shown = [row[2:] for row in db.assignments() if row[0] == "Anna" and row[1] == "Haus Nord"]
+    assert sorted(shown) == [("2024-01-01 08:00:00", "2024-01-01 17:00:00"), ("2024-01-02 08:00:00", None)]
+
+
+def test_legacy_tokens_become_uid_bytes(db):
+    conn = db.conn
+    for name, uid in USERS.items():
+        assert to_uid(legacy("user", name)) == uid
+        assert conn.execute("SELECT rfid_token FROM users WHERE name = ?", (name,)).fetchone()[0] == uid
+    for name, uid in HOUSES.items():
+        assert conn.execute("SELECT rfid_token FROM houses WHERE house_name = ?", (name,)).fetchone()[0] == uid
+    assert {row[0] for row in conn.execute("SELECT rfid_token FROM keys")} == set(HOUSES.values())
+    for table in ("key_pickups", "key_returns", "loans"):
+        types = conn.execute(f"SELECT DISTINCT typeof(user_rfid), typeof(house_rfid) FROM {table}").fetchall()
+        assert types == [("blob", "blob")], table
+    assert {row[0] for row in conn.execute("SELECT token FROM search_index")} == \
+        {uid.hex().upper() for uid in (*USERS.values(), *HOUSES.values())}
+    # The old decimal form still resolves
+    assert db.user_name(legacy("user", "Ben")) == "Ben"
+    assert db.house_name(HOUSES["Haus Ost"]) == "Haus Ost"
+
+
+def test_triggers_keep_migrated_tables_current(db):
+    anna, nord = USERS["Anna"], HOUSES["Haus Nord"]
+    open_loans = db.counter("open_loans")
+    db.record_scans([("return", anna, nord, epoch("2024-01-04 08:00:00"))])
+    assert db.conn.execute("SELECT return_ts FROM loans WHERE pickup_id = 3").fetchone()[0] == \
+        epoch("2024-01-04 08:00:00")
+    assert db.counter("open_loans") == open_loans - 1
+
+
+def dump(conn):
+    schema = conn.execute("SELECT type, name, sql FROM sqlite_master ORDER BY type, name").fetchall()
+    tables = [name for kind, name, _ in schema
+              if kind == "table" and not name.startswith(("sqlite_", "search_index_"))]
+    return schema, {table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall(), key=repr)
+                    for table in tables}
+
+
+def test_migrating_twice_is_a_no_op(db):
+    conn = db.conn
+    before = dump(conn)
+    changes = conn.total_changes
+    assert migrate(conn) == len(MIGRATIONS)
+    assert conn.total_changes == changes
+    assert dump(conn) == before
@@ -0,0 +1,180 @@
+"""Replaying the scan journal after a crash (scan_journal.py, db_writer.py)."""
+import json
+import sqlite3
+import time
+
+import pytest
+
+from database import Database
+from db_writer import DatabaseWriter
+from scan_journal import ScanJournal
+
+USER = b"\x04\xa2\x1f\x9c"
+HOUSES = [bytes([9, 0, 0, i]) for i in range(1, 9)]
+ENTRIES = [[("pickup", USER, house, 1700000000 + i)] for i, house in enumerate(HOUSES)]
+
+
+@pytest.fixture
+def paths(tmp_path):
+    db_path = str(tmp_path / "key_management.db")
+    db = Database(db_path)
+    db.create_schema()
+    db.close()
+    return db_path, str(tmp_path / "scans.journal")
+
+
+def crash(db_path, journal_path, entries, committed=0):
+    """Journal ``entries`` and commit the first ``committed`` of them as the
+    writer does, then stop without telling the journal, as a crash would."""
+    journal = ScanJournal(journal_path)
+    journal.open()
+    seqs = journal.append(entries)
+    db = Database(db_path)
+    for seq, events in zip(seqs[:committed], entries[:committed]):
+        db.record_scans(events, journal=(journal.name, seq))
+    db.close()
+    journal.close()
+    return seqs
+
+
+def replay(db_path, journal_path, retry_delay=0.05):
+    writer = DatabaseWriter(Database(db_path), ScanJournal(journal_path), retry_delay=retry_delay)
+    writer.start()
+    return writer
+
+
+def wait_applied(writer, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while writer.pending():
+        assert time.monotonic() < deadline, f"{writer.pending()} entries not applied"
+        time.sleep(0.01)
+
+
+def pickups(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return [row[0] for row in conn.execute("SELECT house_rfid FROM key_pickups ORDER BY id")]
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("committed", [0, 3, len(ENTRIES)])
+def test_every_entry_is_applied_once(paths, committed):
+    db_path, journal_path = paths
+    seqs = crash(db_path, journal_path, ENTRIES, committed)
+    writer = replay(db_path, journal_path)
+    wait_applied(writer)
+    writer.stop()
+    assert pickups(db_path) == HOUSES
+    db = Database(db_path)
+    assert db.journal_seq("scans.journal") == seqs[-1]
+    db.close()
+
+    # And not again at the next start
+    writer = replay(db_path, journal_path)
+    wait_applied(writer)
+    writer.stop()
+    assert pickups(db_path) == HOUSES
+
+
+def test_entries_already_committed_are_skipped(paths):
+    db_path, journal_path = paths
+    crash(db_path, journal_path, ENTRIES, committed=5)
+    assert pickups(db_path) == HOUSES[:5]
+    writer = replay(db_path, journal_path)
+    wait_applied(writer)
+    writer.stop()
+    assert pickups(db_path) == HOUSES
+
+
+def test_new_entries_continue_after_a_replay(paths):
+    db_path, journal_path = paths
+    seqs = crash(db_path, journal_path, ENTRIES[:4], committed=2)
+    writer = replay(db_path, journal_path)
+    writer.write(ENTRIES[4])
+    wait_applied(writer)
+    writer.stop()
+    assert pickups(db_path) == HOUSES[:5]
+    assert writer.journal.last_seq == seqs[-1] + 1
+
+
+def test_compaction_keeps_unapplied_entries(paths):
+    db_path, journal_path = paths
+    seqs = crash(db_path, journal_path, ENTRIES)
+    journal = ScanJournal(journal_path)
+    assert journal.open() == [(seq, events) for seq, events in zip(seqs, ENTRIES)]
+    journal.applied(seqs[2])
+    journal.compact()
+    journal.close()
+
+    journal = ScanJournal(journal_path)
+    assert journal.open() == [(seq, events) for seq, events in zip(seqs[3:], ENTRIES[3:])]
+    assert (journal.applied_seq, journal.last_seq) == (seqs[2], seqs[-1])
+    assert journal.append([ENTRIES[0]]) == [seqs[-1] + 1]
+    journal.close()
+
+
+def test_compaction_of_an_applied_journal_keeps_the_sequence(paths):
+    db_path, journal_path = paths
+    seqs = crash(db_path, journal_path, ENTRIES, committed=len(ENTRIES))
+    writer = replay(db_path, journal_path)
+    wait_applied(writer)
+    writer.stop()
+    journal = ScanJournal(journal_path)
+    assert journal.open() == []
+    assert journal.last_seq == seqs[-1]
+    journal.close()
+
+
+def test_locked_database_keeps_entries_in_the_journal(paths):
+    db_path, journal_path = paths
+    seqs = crash(db_path, journal_path, ENTRIES)
+    lock = sqlite3.connect(db_path)
+    lock.execute("BEGIN IMMEDIATE")
+    writer = DatabaseWriter(Database(db_path, timeout=0), ScanJournal(journal_path), retry_delay=0.05)
+    writer.start()
+    time.sleep(0.3)
+    assert writer.pending() == len(ENTRIES)
+    assert writer.last_error is not None
+    writer.stop()
+    lock.rollback()
+    lock.close()
+    assert pickups(db_path) == []
+
+    journal = ScanJournal(journal_path)
+    assert [seq for seq, _ in journal.open()] == seqs
+    journal.close()
+    writer = replay(db_path, journal_path)
+    wait_applied(writer)
+    writer.stop()
+    assert pickups(db_path) == HOUSES
+
+
+def test_torn_last_line_is_dropped(paths):
+    db_path, journal_path = paths
+    seqs = crash(db_path, journal_path, ENTRIES[:3])
+    with open(journal_path, "a", encoding="utf-8") as f:
+        f.write('{"seq": 4, "events": [["pickup", "04A2')
+    journal = ScanJournal(journal_path)
+    assert [seq for seq, _ in journal.open()] == seqs
+    assert journal.append([ENTRIES[3]]) == [seqs[-1] + 1]
+    journal.close()
+    journal = ScanJournal(journal_path)
+    assert len(journal.open()) == 4
+    journal.close()
+
+
+def test_rejected_entry_does_not_hold_up_the_others(paths):
+    db_path, journal_path = paths
+    entries = ENTRIES[:2] + [[("pickup", USER, HOUSES[2], "not a time")]] + ENTRIES[3:]
+    seqs = crash(db_path, journal_path, entries)
+    writer = replay(db_path, journal_path)
+    wait_applied(writer)
+    writer.stop()
+    assert pickups(db_path) == HOUSES[:2] + HOUSES[3:]
+    with open(journal_path + ".rejects", encoding="utf-8") as f:
+        rejects = [json.loads(line) for line in f]
+    assert [reject["seq"] for reject in rejects] == [seqs[2]]
+    db = Database(db_path)
+    assert db.journal_seq("scans.journal") == seqs[-1]
+    db.close()
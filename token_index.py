@@ -0,0 +1,121 @@
+import threading
+from collections import Counter
+
+
+class TokenIndex:
+    """In-memory token -> name maps for users and houses.
+
+    Loaded once from the database and kept current by the Database add and
+    delete methods, so resolving a scanned token is a dict lookup. Changes
+    made by other connections or processes are picked up by check(), which
+    compares ``PRAGMA data_version`` and the id/count signature of both tables
+    before reloading.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.users = {}
+        self.houses = {}
+        self.user_names = Counter()
+        self.house_names = Counter()
+        self.loaded = False
+        self.version = 0
+        self._data_version = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _read_signature(self, conn):
+        return conn.execute("""
+            SELECT (SELECT COUNT(*) FROM users), (SELECT MAX(id) FROM users),
+                   (SELECT COUNT(*) FROM houses), (SELECT MAX(id) FROM houses)
+        """).fetchone()
+
+    def load(self):
+        conn = self.db.conn
+        users = dict(conn.execute("SELECT rfid_token, name FROM users"))
+        houses = dict(conn.execute("SELECT rfid_token, house_name FROM houses"))
+        with self._lock:
+            self.users = users
+            self.houses = houses
+            self.user_names = Counter(users.values())
+            self.house_names = Counter(houses.values())
+            self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            self._signature = self._read_signature(conn)
+            self.loaded = True
+            self.version += 1
+
+    def check(self):
+        """Reload if another connection changed users or houses. Returns True on reload."""
+        if not self.loaded:
+            self.load()
+            return True
+        conn = self.db.conn
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return False
+        self._data_version = data_version
+        if self._read_signature(conn) == self._signature:
+            # Only pickups or returns were written
+            return False
+        self.load()
+        return True
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def user_name(self, token):
+        self._ensure_loaded()
+        return self.users.get(token)
+
+    def house_name(self, token):
+        self._ensure_loaded()
+        return self.houses.get(token)
+
+    def has_user_name(self, name):
+        self._ensure_loaded()
+        return self.user_names[name] > 0
+
+    def has_house_name(self, name):
+        self._ensure_loaded()
+        return self.house_names[name] > 0
+
+    def _changed(self):
+        # Forget the signature so the next change seen through data_version
+        # reloads, in case another process wrote at the same time
+        self.version += 1
+        self._signature = None
+
+    def add_user(self, token, name):
+        if not self.loaded:
+            return
+        with self._lock:
+            self.users[token] = name
+            self.user_names[name] += 1
+            self._changed()
+
+    def remove_user(self, token):
+        if not self.loaded:
+            return
+        with self._lock:
+            name = self.users.pop(token, None)
+            if name is not None:
+                self.user_names[name] -= 1
+            self._changed()
+
+    def add_house(self, token, name):
+        if not self.loaded:
+            return
+        with self._lock:
+            self.houses[token] = name
+            self.house_names[name] += 1
+            self._changed()
+
+    def remove_house(self, token):
+        if not self.loaded:
+            return
+        with self._lock:
+            name = self.houses.pop(token, None)
+            if name is not None:
+                self.house_names[name] -= 1
+            self._changed()
@@ -0,0 +1,46 @@
+"""RFID UIDs: stored as the raw UID bytes, shown as hexadecimal.
+
+The reader prints a UID as hex bytes ("Card UID: 04 A2 1F 9C"). Tokens used
+to be the bytes as zero-padded 3-digit decimals ("004162031156"), 21
+characters for a 7-byte UID; they are stored as a BLOB of the bytes now and
+shown as "04A21F9C". to_uid() accepts both text forms, so tokens printed,
+exported or typed in the old form still resolve. The forms cannot be
+mistaken for each other: UIDs are 4, 7 or 10 bytes long, 8, 14 or 20 hex
+digits, but 12, 21 or 30 decimal digits.
+"""
+
+
+def to_uid(value):
+    """Canonical UID bytes of a token given as bytes, hex text or legacy decimal text.
+
+    Text that is neither (typed by hand, say) is kept as its UTF-8 bytes, so
+    every token still maps to exactly one key. Returns b"" for empty text.
+    """
+    if type(value) is bytes:
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    text = str(value).strip()
+    if text.isdigit() and len(text) % 3 == 0:
+        groups = [int(text[i:i + 3]) for i in range(0, len(text), 3)]
+        if max(groups) <= 255:
+            return bytes(groups)
+    try:
+        return bytes.fromhex(text.replace(":", " ").replace("-", " "))
+    except ValueError:
+        return text.encode("utf-8")
+
+
+def uid_text(uid):
+    """The hex form shown to users, as SQLite's hex() writes it."""
+    return uid.hex().upper()
+
+
+def legacy_text(uid):
+    """The zero-padded decimal form tokens had before they were stored as bytes."""
+    return "".join(f"{byte:03d}" for byte in uid)
+
+
+def sql_uid(value):
+    # to_uid() as an SQLite function, for migrations; NULL stays NULL
+    return None if value is None else to_uid(value)
@@ -0,0 +1,71 @@
+import tkinter as tk
+
+
+class View:
+    """Lifecycle hooks of a view built by ViewManager.
+
+    ``on_show`` runs every time the view becomes visible, including right
+    after it was built; ``on_hide`` runs when another view replaces it.
+    """
+
+    def __init__(self, on_show=None, on_hide=None):
+        self._on_show = on_show
+        self._on_hide = on_hide
+
+    def on_show(self):
+        if self._on_show is not None:
+            self._on_show()
+
+    def on_hide(self):
+        if self._on_hide is not None:
+            self._on_hide()
+
+
+class ViewManager:
+    """Builds every view once into its own frame and switches between them.
+
+    Switching only hides the current frame and shows the next one, so the
+    widgets, entered values and loaded rows of a view survive being left.
+    ``register(name, build)`` adds a view; ``build(frame)`` fills the frame
+    and returns a View with its hooks, or None.
+    """
+
+    def __init__(self, container):
+        self.container = container
+        self.builders = {}
+        self.frames = {}
+        self.views = {}
+        self.current = None
+
+    def register(self, name, build):
+        self.builders[name] = build
+
+    def show(self, name):
+        """Show the view ``name``, building it on first use."""
+        if name != self.current:
+            self.hide()
+            if name not in self.frames:
+                frame = tk.Frame(self.container)
+                self.views[name] = self.builders[name](frame) or View()
+                self.frames[name] = frame
+            self.frames[name].pack(fill="both", expand=True)
+            self.current = name
+        self.views[name].on_show()
+
+    def hide(self):
+        if self.current is None:
+            return
+        name, self.current = self.current, None
+        try:
+            self.views[name].on_hide()
+        finally:
+            self.frames[name].pack_forget()
+
+    def discard(self, name):
+        """Destroy a built view, it is built again the next time it is shown."""
+        if name == self.current:
+            self.hide()
+        frame = self.frames.pop(name, None)
+        self.views.pop(name, None)
+        if frame is not None:
+            frame.destroy()
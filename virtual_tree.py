@@ -0,0 +1,308 @@
+import logging
+import tkinter as tk
+from tkinter import ttk
+
+log = logging.getLogger("kms.tree")
+
+
+class VirtualTreeview(tk.Frame):
+    """Treeview that only holds the rows currently on screen.
+
+    Rows come from a database.PagedQuery in keyset-paginated pages as the
+    user scrolls; a few pages around the visible window are cached in memory.
+    Clicking a heading re-sorts on the database side.
+
+    With a task_runner.TaskRunner as ``runner``, no query runs on the
+    calling (Tk) thread: refresh() counts the rows and reads the first
+    window on a worker, and a scroll past the cached rows reads the missing
+    page there; the rows are shown when they arrive and the old ones stay
+    on screen until then. Scrolling on while a page is read only moves the
+    window the next read is for.
+    """
+
+    def __init__(self, master, source, headings, page_size=200, format_row=None, runner=None, **kwargs):
+        super().__init__(master, **kwargs)
+        self.source = source
+        self.runner = runner
+        self._generation = 0
+        self._loading = False
+        # Bumped whenever the cache changes on the Tk thread, a page read
+        # from an older cache is dropped
+        self._cache_version = 0
+        self.page_size = page_size
+        self.max_cache = page_size * 4
+        self.format_row = format_row
+        self.sort = source.default_sort
+        self.desc = source.default_desc
+
+        columns = tuple(headings)
+        self.tree = ttk.Treeview(self, columns=columns, show="headings")
+        for column, text in headings.items():
+            self.tree.heading(column, text=text, command=lambda c=column: self.sort_by(c))
+        self.vsb = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.tree.grid(row=0, column=0, sticky="nsew")
+        self.vsb.grid(row=0, column=1, sticky="ns")
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.tree.bind("<Configure>", self._on_configure)
+        self.tree.bind("<MouseWheel>", self._on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+
+        self.visible = 20
+        self.offset = 0
+        self._reset()
+
+    def _reset(self):
+        self._cache_version += 1
+        self.total = None
+        self.cache = []
+        self.cache_start = 0
+        # offset of a page start -> key of the row before it, for jumps
+        self.bookmarks = {0: None}
+
+    @staticmethod
+    def _key(row):
+        return (row[1], row[0])
+
+    def refresh(self):
+        """Drop cached rows and reload the current window."""
+        self._reset()
+        if self.runner is None:
+            self.render()
+            return
+        self._generation += 1
+        self._loading = True
+        generation = self._generation
+        self.runner.submit(self._read_window, self.source, self.sort, self.desc, self.offset, self.visible,
+                           key=("tree", id(self)), name="tree.load", on_done=lambda result: self._show_window(generation, result),
+                           on_error=lambda error: self._load_failed(generation, error))
+
+    def loading(self):
+        return self._loading
+
+    def _read_window(self, source, sort, desc, offset, visible):
+        # Runs on a worker thread, so it changes nothing and touches no widget
+        total = source.count()
+        offset = max(0, min(offset, total - visible))
+        rows = source.fetch(sort, desc, None, offset, max(self.page_size, visible)) if total else []
+        return total, offset, rows
+
+    def _show_window(self, generation, result):
+        if generation != self._generation or not self.winfo_exists():
+            return  # sorted, refreshed or given another source since
+        self._loading = False
+        self.total, self.offset, cache = result
+        self.bookmarks = {0: None}
+        self._set_cache(cache, self.offset)
+        self.render()
+
+    def _load_failed(self, generation, error):
+        if generation != self._generation or not self.winfo_exists():
+            return
+        self._loading = False
+        log.error("rows not loaded", exc_info=error)
+        # Shown in place of the rows; the next scroll or refresh tries again
+        self.tree.delete(*self.tree.get_children())
+        self.tree.insert("", tk.END, values=(f"Fehler beim Laden: {error}",))
+
+    def set_source(self, source):
+        """Show the rows of another query with the same columns, from the top."""
+        self.source = source
+        self.sort = source.default_sort
+        self.desc = source.default_desc
+        self.offset = 0
+        self.refresh()
+
+    def in_default_order(self):
+        return self.sort == self.source.default_sort and self.desc == self.source.default_desc
+
+    def prepend_rows(self, rows):
+        """Add rows that sort before every row already in the list."""
+        if not rows:
+            return
+        if self.total is None:
+            self.render()
+            return
+        count = len(rows)
+        self._cache_version += 1
+        self.total += count
+        self.bookmarks = {offset + count if offset else 0: key for offset, key in self.bookmarks.items()}
+        if self.cache_start == 0:
+            self.cache[:0] = rows
+            del self.cache[self.max_cache:]
+        else:
+            self.cache_start += count
+        # Keep the rows the user is looking at in place unless at the top
+        if self.offset > 0:
+            self.offset += count
+        self.render()
+
+    def update_rows(self, rows):
+        """Replace the values of rows that are cached or on screen."""
+        by_id = {row[0]: row for row in rows}
+        self._cache_version += 1
+        for i, row in enumerate(self.cache):
+            if row[0] in by_id:
+                self.cache[i] = by_id[row[0]]
+        for row in rows:
+            iid = str(row[0])
+            if self.tree.exists(iid):
+                values = row[2:]
+                if self.format_row is not None:
+                    values = self.format_row(values)
+                self.tree.item(iid, values=values)
+
+    def sort_by(self, column):
+        if column == self.sort:
+            self.desc = not self.desc
+        else:
+            self.sort = column
+            self.desc = False
+        self.offset = 0
+        self.refresh()
+
+    def scroll(self, rows):
+        self.show(self.offset + rows)
+
+    def show(self, offset):
+        if self.loading():
+            return
+        if self.total is None:
+            self.offset = offset
+            self.render()
+            return
+        self.offset = max(0, min(offset, self.total - self.visible))
+        self.render()
+
+    def _cached(self, offset, count):
+        end = min(offset + count, self.total)
+        return bool(self.cache) and self.cache_start <= offset and end <= self.cache_start + len(self.cache)
+
+    def _read_rows(self, source, sort, desc, cache, cache_start, bookmarks, total, offset, count):
+        """The cache, and where it starts, with rows ``offset`` to ``offset +
+        count`` in it. Only reads and works on copies, so it can run on a
+        worker thread."""
+        def fetch(after, skip=0, limit=None, backwards=False):
+            return source.fetch(sort, desc, after, skip, limit or self.page_size, backwards)
+
+        cache_end = cache_start + len(cache)
+        end = min(offset + count, total)
+        if cache and cache_start <= offset <= cache_end:
+            # Scrolling down: continue after the last cached key
+            rows = fetch(self._key(cache[-1]), limit=max(self.page_size, end - cache_end))
+            cache = cache + rows
+            drop = max(0, len(cache) - self.max_cache)
+            drop = min(drop, offset - cache_start)
+            return cache[drop:], cache_start + drop
+        if cache and offset < cache_start <= end + self.page_size:
+            # Scrolling up: fetch the rows before the first cached key
+            rows = fetch(self._key(cache[0]), limit=max(self.page_size, cache_start - offset), backwards=True)
+            rows.reverse()
+            return (rows + cache)[:self.max_cache], cache_start - len(rows)
+        # Jump: start from the nearest known page boundary, or count back
+        # from the end of the list if that is closer
+        start = max(k for k in bookmarks if k <= offset)
+        if total - end < offset - start:
+            cache = fetch(None, skip=total - end, limit=end - offset, backwards=True)
+            cache.reverse()
+        else:
+            cache = fetch(bookmarks[start], skip=offset - start, limit=max(self.page_size, count))
+        return cache, offset
+
+    def _read_args(self):
+        return (self.source, self.sort, self.desc, list(self.cache), self.cache_start, dict(self.bookmarks),
+                self.total, self.offset, self.visible)
+
+    def _load_rows(self):
+        # Coalesced with the tree's other reads: scrolling on while a page
+        # is read only changes the window the next one is for
+        generation, version = self._generation, self._cache_version
+        window = (self.offset, self.visible)
+        self.runner.submit(self._read_rows, *self._read_args(), key=("tree", id(self)), name="tree.page",
+                           on_done=lambda result: self._show_rows(generation, version, window, result),
+                           on_error=lambda error: self._load_failed(generation, error))
+
+    def _show_rows(self, generation, version, window, result):
+        if generation != self._generation or not self.winfo_exists():
+            return
+        if version != self._cache_version or window != (self.offset, self.visible):
+            # The cache changed or the user scrolled on meanwhile, reads
+            # again if the rows are still missing
+            if version == self._cache_version:
+                self._set_cache(*result)
+            self.render()
+            return
+        # Drawn even when fewer rows came back than counted, e.g. after a
+        # delete, instead of reading again
+        self._set_cache(*result)
+        self._draw()
+
+    def _set_cache(self, cache, cache_start):
+        self.cache, self.cache_start = cache, cache_start
+        self._cache_version += 1
+        self._add_bookmarks()
+
+    def _add_bookmarks(self):
+        for i in range(1, len(self.cache)):
+            position = self.cache_start + i
+            if position % self.page_size == 0:
+                self.bookmarks[position] = self._key(self.cache[i - 1])
+
+    def render(self):
+        if self.loading():
+            return
+        if self.total is None:
+            if self.runner is not None:
+                self.refresh()
+                return
+            self.total = self.source.count()
+        self.offset = max(0, min(self.offset, self.total - self.visible))
+        if self.total and not self._cached(self.offset, self.visible):
+            if self.runner is not None:
+                self._load_rows()
+                self._update_scrollbar()
+                return
+            self._set_cache(*self._read_rows(*self._read_args()))
+        self._draw()
+
+    def _draw(self):
+        self.tree.delete(*self.tree.get_children())
+        if self.total:
+            first = self.offset - self.cache_start
+            for row in self.cache[first:first + self.visible]:
+                values = row[2:]
+                if self.format_row is not None:
+                    values = self.format_row(values)
+                self.tree.insert("", tk.END, iid=str(row[0]), values=values)
+        self._update_scrollbar()
+
+    def _update_scrollbar(self):
+        if not self.total:
+            self.vsb.set(0.0, 1.0)
+            return
+        self.vsb.set(self.offset / self.total, min(1.0, (self.offset + self.visible) / self.total))
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if self.loading():
+            return
+        if action == "moveto":
+            if self.total is None:
+                self.render()
+                return
+            self.show(int(float(value) * self.total))
+        elif action == "scroll":
+            step = self.visible if unit == "pages" else 1
+            self.scroll(int(value) * step)
+
+    def _on_mousewheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+
+    def _on_configure(self, event):
+        style = ttk.Style()
+        row_height = int(style.lookup("Treeview", "rowheight") or 20)
+        visible = max(1, (event.height - 25) // row_height)
+        if visible != self.visible:
+            self.visible = visible
+            self.render()